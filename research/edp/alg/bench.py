@@ -0,0 +1,465 @@
+# bench.py
+# EDP計画のベンチマーク
+# line / waxman の経路（4〜40ホップ）で、f_reqとフィデリティ格子の刻みを変えながら各plannerを解き、
+# 計画時間・_EDPの呼び出し回数・memo/キャッシュの大きさ・ピークメモリをJSON/CSVに書く
+# 最適化の前後でJSONを残しておき、--compareで比べる
+# 実行: python -m edp.alg.bench --out-dir out/bench [--compare 前のbench.json]
+
+import argparse
+import csv
+import json
+import os
+import platform
+import random
+import subprocess
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from qns.entity.node import QNode
+from qns.network import QuantumNetwork
+from qns.network.route.dijkstra import DijkstraRouteAlgorithm
+from qns.network.topology import WaxmanTopology
+from qns.network.topology.topo import ClassicTopology
+from qns.utils.rnd import set_seed
+
+from edp.alg.edp import F, PLANNERS, _EDP, _EDPContext, batch_EDP
+from edp.alg.edp_dp import EDP_dp
+from edp.alg.plan_cache import PlanCache
+from edp.sim.new_qchannel import NewQC
+from edp.sim.new_request import NewRequest
+
+HOPS = (4, 8, 16, 24, 32, 40)
+F_REQS = (0.7, 0.8, 0.9)
+GRID_STEPS = (0.01, 0.02, 0.05)
+TOPOLOGIES = ("line", "waxman")
+# recursiveは枝刈りあり/なしの両方を測る（なしは遅いのでこのホップ数まで）
+UNPRUNED_MAX_HOPS = 16
+
+GEN_RATE = 50
+LINK_FID = 0.99  # qnet2DictConverterの既定値
+# waxmanではリンク長に応じてfidをLINK_FIDからこの幅だけ下げる（リンクごとに違う値にするため）
+WAXMAN_FID_SPAN = 0.04
+WAXMAN_SIZE = 100000
+WAXMAN_ALPHA = 0.2
+WAXMAN_BETA = 0.6
+# 小さいWaxmanは連結にならないことが多いので、経路用のトポロジは最低この数のノードで作る
+WAXMAN_MIN_NODES = 20
+
+BENCH_COLUMNS = [
+    "case",
+    "topology",
+    "hops",
+    "f_req",
+    "grid_step",
+    "grid_size",
+    "planner",
+    "prune",
+    "found",
+    "latency",
+    "time_sec",
+    "calls",
+    "memo_entries",
+    "cache_entries",
+    "peak_mem_kb",
+]
+
+# --compareで突き合わせる列
+_KEY_COLUMNS = ("case", "topology", "hops", "f_req", "grid_step", "planner", "prune")
+
+Qnet = Dict[Tuple[QNode, QNode], Dict[str, float]]
+
+
+def line_path(hops: int) -> Tuple[List[QNode], Qnet]:
+    """ホップ数hopsの直線。リンクは全部同じrate/fid"""
+    path = [QNode(f"n{i + 1}") for i in range(hops + 1)]
+    qnet = {(a, b): {"rate": GEN_RATE, "fid": LINK_FID} for a, b in zip(path, path[1:])}
+    return path, qnet
+
+
+def waxman_path(hops: int, seed: int = 0) -> Tuple[List[QNode], Qnet]:
+    """
+    Waxmanトポロジ上のホップ数hopsのループなし経路（ランダムな深さ優先で探す）
+    最短経路だとWaxmanでは数ホップにしかならないので、単純経路ならなんでもよいことにする
+    fidはリンク長に比例してLINK_FIDからWAXMAN_FID_SPANまで下げる
+    """
+    set_seed(seed)
+    topo = WaxmanTopology(
+        nodes_number=max(WAXMAN_MIN_NODES, 2 * hops),
+        size=WAXMAN_SIZE,
+        alpha=WAXMAN_ALPHA,
+        beta=WAXMAN_BETA,
+    )
+    nodes, qcs = topo.build()
+    adj: Dict[QNode, List[QNode]] = {nd: [] for nd in nodes}
+    length: Dict[Tuple[QNode, QNode], float] = {}
+    for qc in qcs:
+        a, b = qc.node_list[0], qc.node_list[1]
+        adj[a].append(b)
+        adj[b].append(a)
+        length[(a, b)] = length[(b, a)] = qc.length
+    max_len = max(length.values())
+
+    rng = random.Random(seed)
+    path = _random_simple_path(adj, nodes, hops, rng)
+    if path is None:
+        raise ValueError(f"No simple path of {hops} hops in waxman topology")
+    qnet = {
+        (a, b): {
+            "rate": GEN_RATE,
+            "fid": round(LINK_FID - WAXMAN_FID_SPAN * length[(a, b)] / max_len, 4),
+        }
+        for a, b in zip(path, path[1:])
+    }
+    return path, qnet
+
+
+def _random_simple_path(
+    adj: Dict[QNode, List[QNode]],
+    nodes: List[QNode],
+    hops: int,
+    rng: random.Random,
+    max_steps: int = 200000,
+) -> Optional[List[QNode]]:
+    # 明示スタックのDFS。隣接ノードの順番をランダムにして最初に見つかった長さhopsの経路
+    steps = 0
+    for start in rng.sample(nodes, len(nodes)):
+        path = [start]
+        on_path = {start}
+        stack = [iter(rng.sample(adj[start], len(adj[start])))]
+        while stack:
+            if len(path) == hops + 1:
+                return path
+            steps += 1
+            if steps > max_steps:
+                return None
+            nxt = next((v for v in stack[-1] if v not in on_path), None)
+            if nxt is None:
+                stack.pop()
+                on_path.discard(path.pop())
+                continue
+            path.append(nxt)
+            on_path.add(nxt)
+            stack.append(iter(rng.sample(adj[nxt], len(adj[nxt]))))
+    return None
+
+
+def make_grid(step: float, lo: float = F[0], hi: float = F[-1]) -> List[float]:
+    # lo..hiをstep刻みで（両端込み）
+    n = int(round((hi - lo) / step))
+    return [round(lo + step * i, 3) for i in range(n + 1)]
+
+
+def make_path(topology: str, hops: int, seed: int = 0) -> Tuple[List[QNode], Qnet]:
+    if topology == "line":
+        return line_path(hops)
+    if topology == "waxman":
+        return waxman_path(hops, seed=seed)
+    raise ValueError(f"Unknown topology: {topology}")
+
+
+def _measure(fn: Callable[[], Any], repeat: int) -> Tuple[Any, float, float]:
+    """
+    (fnの戻り値, 最短の実行時間[s], ピークメモリ[KB]) を返す
+    tracemalloc中は遅くなるので、時間はrepeat回の計測、メモリは別に1回だけ測る
+    """
+    res = None
+    best = float("inf")
+    for _ in range(max(1, repeat)):
+        t0 = time.perf_counter()
+        res = fn()
+        best = min(best, time.perf_counter() - t0)
+    tracemalloc.start()
+    try:
+        fn()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return res, best, peak / 1024
+
+
+def bench_path(
+    path: List[QNode],
+    qnet: Qnet,
+    f_req: float,
+    planner: str,
+    grid: Optional[Sequence[float]] = None,
+    prune: bool = True,
+    repeat: int = 3,
+) -> Dict[str, Any]:
+    """経路1本を1つのplannerで解いた結果の1行（case, topology, hops, grid_stepは呼び出し側で埋める）"""
+    src, dest = path[0], path[-1]
+    stats: Dict[str, Any] = {"calls": None, "memo_entries": None}
+
+    if planner == "recursive":
+
+        def fn():
+            # 呼び出し回数とmemoを見るために、EDP()と同じことをここで組み立てる
+            ctx = _EDPContext(
+                cache=PlanCache(),
+                path=path,
+                qnet=qnet,
+                grid=list(grid) if grid is not None else F,
+                prune=prune,
+            )
+            res = _EDP(
+                ctx=ctx, src=src, dest=dest, f_req=f_req, depth=0, max_depth=None
+            )
+            stats["calls"] = ctx.calls
+            stats["memo_entries"] = len(ctx.memo)
+            return res
+
+    elif planner == "dp":
+
+        def fn():
+            return EDP_dp(
+                path=path, src=src, dest=dest, qnet=qnet, f_req=f_req, grid=grid
+            )
+
+    else:
+        raise ValueError(f"Unknown planner: {planner}")
+
+    res, elapsed, peak_kb = _measure(fn, repeat)
+    return {
+        "f_req": f_req,
+        "grid_size": len(grid) if grid is not None else len(F),
+        "planner": planner,
+        "prune": prune if planner == "recursive" else None,
+        "found": res is not None,
+        "latency": float(res[0]) if res is not None else None,
+        "time_sec": elapsed,
+        "calls": stats["calls"],
+        "memo_entries": stats["memo_entries"],
+        "cache_entries": None,
+        "peak_mem_kb": peak_kb,
+    }
+
+
+def bench_batch(
+    nodes: int,
+    requests: int,
+    f_req: float,
+    planner: str,
+    seed: int = 0,
+    repeat: int = 3,
+) -> Dict[str, Any]:
+    """Waxmanネットワーク上のrequests本をbatch_EDPでまとめて計画した1行"""
+    set_seed(seed)
+    topo = WaxmanTopology(
+        nodes_number=nodes, size=WAXMAN_SIZE, alpha=WAXMAN_ALPHA, beta=WAXMAN_BETA
+    )
+    net = QuantumNetwork(
+        topo=topo, classic_topo=ClassicTopology.All, route=DijkstraRouteAlgorithm()
+    )
+    net.build_route()
+    net.random_requests(number=requests)
+    qcs = [
+        NewQC(name=qc.name, node_list=qc.node_list, length=qc.length)
+        for qc in net.qchannels
+    ]
+    reqs = [
+        NewRequest(name=f"r{i}", src=r.src, dest=r.dest, priority=0, f_req=f_req)
+        for i, r in enumerate(net.requests)
+    ]
+    hops = [len(net.query_route(r.src, r.dest)[0][2]) - 1 for r in reqs]
+    caches: List[PlanCache] = []
+
+    def fn():
+        cache = PlanCache()
+        caches.append(cache)
+        return batch_EDP(
+            net, reqs, qcs, gen_rate=GEN_RATE, planner=planner, cache=cache
+        )
+
+    res, elapsed, peak_kb = _measure(fn, repeat)
+    found = [r for r in res if r is not None]
+    return {
+        "case": "batch",
+        "topology": "waxman",
+        "hops": max(hops) if hops else 0,
+        "f_req": f_req,
+        "grid_step": None,
+        "grid_size": len(F),
+        "planner": planner,
+        "prune": True if planner == "recursive" else None,
+        "found": len(found),
+        "latency": None,
+        "time_sec": elapsed,
+        "calls": None,
+        "memo_entries": None,
+        "cache_entries": len(caches[-1]),
+        "peak_mem_kb": peak_kb,
+    }
+
+
+def run_bench(
+    topologies: Sequence[str] = TOPOLOGIES,
+    hops_list: Sequence[int] = HOPS,
+    f_reqs: Sequence[float] = F_REQS,
+    grid_steps: Sequence[float] = GRID_STEPS,
+    planners: Sequence[str] = PLANNERS,
+    unpruned_max_hops: int = UNPRUNED_MAX_HOPS,
+    batch_nodes: int = 30,
+    batch_requests: int = 10,
+    seed: int = 0,
+    repeat: int = 3,
+    log: Optional[Callable[[str], None]] = None,
+) -> List[Dict[str, Any]]:
+    """全条件を回してBENCH_COLUMNSの行のリストを返す。batch_requests=0ならbatch_EDPの計測はしない"""
+    rows: List[Dict[str, Any]] = []
+    for topology in topologies:
+        for hops in hops_list:
+            path, qnet = make_path(topology, hops, seed=seed)
+            for f_req in f_reqs:
+                for step in grid_steps:
+                    grid = make_grid(step)
+                    cases = [(planner, True) for planner in planners]
+                    if "recursive" in planners and hops <= unpruned_max_hops:
+                        cases.append(("recursive", False))
+                    for planner, prune in cases:
+                        row = bench_path(
+                            path,
+                            qnet,
+                            f_req,
+                            planner,
+                            grid=grid,
+                            prune=prune,
+                            repeat=repeat,
+                        )
+                        row.update(
+                            case="path", topology=topology, hops=hops, grid_step=step
+                        )
+                        rows.append(row)
+                        if log is not None:
+                            log(_format_row(row))
+    if batch_requests > 0:
+        for f_req in f_reqs:
+            for planner in planners:
+                row = bench_batch(
+                    batch_nodes,
+                    batch_requests,
+                    f_req,
+                    planner,
+                    seed=seed,
+                    repeat=repeat,
+                )
+                rows.append(row)
+                if log is not None:
+                    log(_format_row(row))
+    return rows
+
+
+def _format_row(row: Dict[str, Any]) -> str:
+    prune = "" if row["prune"] in (None, True) else " (no prune)"
+    return (
+        f"{row['case']} {row['topology']} hops={row['hops']} f_req={row['f_req']} "
+        f"step={row['grid_step']} {row['planner']}{prune}: "
+        f"{row['time_sec'] * 1000:.2f} ms, calls={row['calls']}, "
+        f"peak={row['peak_mem_kb']:.0f} KB"
+    )
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        out = subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return out.stdout.strip()
+
+
+def write_results(
+    rows: List[Dict[str, Any]], out_dir: str, meta: Optional[Dict[str, Any]] = None
+) -> Tuple[str, str]:
+    """out_dir/bench.json（metaと行）とout_dir/bench.csv（行だけ）を書いてパスを返す"""
+    os.makedirs(out_dir, exist_ok=True)
+    json_path = os.path.join(out_dir, "bench.json")
+    csv_path = os.path.join(out_dir, "bench.csv")
+    with open(json_path, "w", encoding="utf-8") as f:
+        json.dump({"meta": meta or {}, "rows": rows}, f, ensure_ascii=False, indent=2)
+    with open(csv_path, "w", encoding="utf-8", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=BENCH_COLUMNS)
+        writer.writeheader()
+        for row in rows:
+            writer.writerow({col: row.get(col) for col in BENCH_COLUMNS})
+    return json_path, csv_path
+
+
+def compare(
+    baseline: List[Dict[str, Any]], current: List[Dict[str, Any]]
+) -> List[Dict[str, Any]]:
+    """
+    同じ条件の行を突き合わせて、時間・呼び出し回数・ピークメモリの比（current / baseline）と遅延の差を返す
+    片方にしかない条件は飛ばす
+    """
+    base = {tuple(row.get(c) for c in _KEY_COLUMNS): row for row in baseline}
+    out = []
+    for row in current:
+        key = tuple(row.get(c) for c in _KEY_COLUMNS)
+        old = base.get(key)
+        if old is None:
+            continue
+        diff = dict(zip(_KEY_COLUMNS, key))
+        for col in ("time_sec", "calls", "peak_mem_kb"):
+            a, b = old.get(col), row.get(col)
+            diff[f"{col}_ratio"] = b / a if a and b is not None else None
+        a, b = old.get("latency"), row.get("latency")
+        diff["latency_diff"] = b - a if a is not None and b is not None else None
+        out.append(diff)
+    return out
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="EDP計画のベンチマーク")
+    parser.add_argument("--out-dir", default="bench_out")
+    parser.add_argument("--topologies", nargs="+", default=list(TOPOLOGIES))
+    parser.add_argument("--hops", nargs="+", type=int, default=list(HOPS))
+    parser.add_argument("--f-req", nargs="+", type=float, default=list(F_REQS))
+    parser.add_argument("--grid-steps", nargs="+", type=float, default=list(GRID_STEPS))
+    parser.add_argument("--planners", nargs="+", default=list(PLANNERS))
+    parser.add_argument("--unpruned-max-hops", type=int, default=UNPRUNED_MAX_HOPS)
+    parser.add_argument("--batch-nodes", type=int, default=30)
+    parser.add_argument("--batch-requests", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--compare", default=None, help="比較する前回のbench.json")
+    args = parser.parse_args(argv)
+
+    rows = run_bench(
+        topologies=args.topologies,
+        hops_list=args.hops,
+        f_reqs=args.f_req,
+        grid_steps=args.grid_steps,
+        planners=args.planners,
+        unpruned_max_hops=args.unpruned_max_hops,
+        batch_nodes=args.batch_nodes,
+        batch_requests=args.batch_requests,
+        seed=args.seed,
+        repeat=args.repeat,
+        log=print,
+    )
+    meta = {
+        "commit": _git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "args": vars(args),
+    }
+    json_path, csv_path = write_results(rows, args.out_dir, meta=meta)
+    print(f"wrote {json_path}, {csv_path}")
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            baseline = json.load(f)["rows"]
+        for diff in compare(baseline, rows):
+            print(diff)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
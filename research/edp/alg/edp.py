@@ -1,17 +1,23 @@
 # edp.py
 # EDP algorithm
 
+import functools
 import math
-from typing import Dict, List, Tuple
+import os
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
 
 from qns.entity.node import QNode
-from qns.entity.qchannel import QuantumChannel
 from qns.network import QuantumNetwork
 
-from edp.sim.models import f_pur, f_swap, l_pur, l_swap, p_pur
+from edp.alg.ksp import PathCache
+from edp.alg.plan_array import PlanArray
+from edp.alg.plan_cache import PlanCache, PlanContext, planner_key
+from edp.alg.plan_store import PlanStore, topology_hash
+from edp.sim.models import f_pur, f_swap, l_pur, l_swap
 from edp.sim.new_qchannel import NewQC
 from edp.sim.new_request import NewRequest
-from edp.sim.op import Operation, build_ops_from_edp_result
+from edp.sim.op import OpTemplate, build_ops_from_plan_array
 
 # ネットワーク定義（例）
 fidelity = 0.9
@@ -28,7 +34,11 @@ def qnet2DictConverter(
         dest = qc.node_list[1]
         # fid = qc.fidelity
         fid = 0.99
-        qc_dict[(src, dest)] = {"rate": gen_rate, "fid": fid}
+        # チャネル固有の値があればそちらを使う（update_linkで変えたとき）
+        if qc.plan_fidelity is not None:
+            fid = qc.plan_fidelity
+        rate = qc.gen_rate if qc.gen_rate is not None else gen_rate
+        qc_dict[(src, dest)] = {"rate": rate, "fid": fid}
     return qc_dict
 
 
@@ -45,32 +55,253 @@ Q = {
 # フィデリティの候補集合
 F = [round(0.70 + 0.01 * i, 3) for i in range(31)]
 
-memo = {}
+
+PLANNERS = ("recursive", "dp")
+# batch_EDPを並列にする最小リクエスト数
+PARALLEL_MIN_BATCH = 8
+
+
+def planner_fn(planner: str, options: Optional[Dict[str, Any]] = None) -> Callable:
+    """
+    batch_EDPが使う計画関数（path, src, dest, qnet, f_req, cacheを受け取る）を返す
+    options: 計画関数への追加引数（例: recursiveのprune, max_depth）
+    """
+    if planner not in PLANNERS:
+        raise ValueError(f"Unknown planner: {planner}")
+    if planner == "dp":
+        from edp.alg.edp_dp import EDP_dp  # 遅延インポートで循環参照を回避
+
+        fn = EDP_dp
+    else:
+        fn = EDP
+    if options:
+        return functools.partial(fn, **options)
+    return fn
 
 
 def batch_EDP(
-    qnet: QuantumNetwork, reqs: List[NewRequest], qcs: List[NewQC], gen_rate: int = 50
+    qnet: QuantumNetwork,
+    reqs: List[NewRequest],
+    qcs: List[NewQC],
+    gen_rate: int = 50,
+    planner: str = "recursive",
+    cache: Optional[PlanCache] = None,
+    workers: int = 1,
+    parallel_min_batch: int = PARALLEL_MIN_BATCH,
+    k_paths: int = 1,
+    path_cache: Optional[PathCache] = None,
+    store: Optional[PlanStore] = None,
+    planner_options: Optional[Dict[str, Any]] = None,
+    templates: Optional[Dict[Any, OpTemplate]] = None,
 ):
+    """
+    planner: "recursive"（memo付き再帰のEDP）か "dp"（ボトムアップのEDP_dp）
+    cache: リクエスト・run間で共有する計画キャッシュ。Noneならこのバッチ内だけで使う
+    workers: 計画に使うプロセス数。1なら逐次、0以下ならCPU数
+    parallel_min_batch: 計画するjob数がこれ未満なら逐次（プール起動の方が高くつく）
+    k_paths: 1ならルーティングテーブルの経路だけ。2以上ならk本の最短経路それぞれで計画し、遅延最小の木を使う
+    path_cache: (src, dest)ごとのk最短経路の使い回し。Noneならこのバッチ内だけ
+    store: ディスク上の計画ストア。あればリクエスト単位で読み、無いものだけ計画して書き込む
+    planner_options: 計画関数への追加引数（planner_fn参照）
+    templates: OPの木の雛形の使い回し（同じ計画のリクエストは雛形から写すだけ）。Noneならこのバッチ内だけ
+    各リクエストのplan_timeに計画時間（秒、候補経路の合計）を入れる
+    """
+    plan_fn = planner_fn(planner, planner_options)
+
+    if cache is None:
+        cache = PlanCache()
+    if workers <= 0:
+        workers = os.cpu_count() or 1
     qnet_dist = qnet2DictConverter(qcs=qcs, gen_rate=gen_rate)
-    results: List[Tuple[float, dict] | None] = []
+    results: List[Tuple[float, dict] | None] = [None] * len(reqs)
+    best: Dict[int, PlanArray] = {}
     for req in reqs:
+        req.plan_time = 0.0
+
+    store_keys: Dict[int, str] = {}  # ストアに無かったリクエストのキー
+    if store is not None:
+        topo_hash = topology_hash(qnet_dist, F)
+        options = {"planner": planner, "k_paths": k_paths, **(planner_options or {})}
+        nodes = {nd.name: nd for link in qnet_dist for nd in link}
+
+    # jobごとのリクエスト番号（k_paths > 1なら1リクエストに複数job）
+    owners: List[int] = []
+    jobs = []
+    for i, req in enumerate(reqs):
         paths = qnet.query_route(req.src, req.dest)
         if not paths:
-            results.append(None)
             continue
 
+        if store is not None:
+            t0 = time.perf_counter()
+            key = store.key(topo_hash, req.src, req.dest, req.f_req, options)
+            hit, res = store.load(key, nodes)
+            req.plan_time = time.perf_counter() - t0
+            if hit:
+                if res is not None:
+                    best[i] = res
+                continue
+            store_keys[i] = key
+
         path = paths[0][2]
-        res = EDP(
-            src=req.src, dest=req.dest, qnet=qnet_dist, path=path, f_req=req.f_req
+        candidates = [path]
+        if k_paths > 1:
+            if path_cache is None:
+                path_cache = PathCache(qcs)
+            candidates = path_cache.get(req.src, req.dest, k_paths, first=path)
+        for path in candidates:
+            owners.append(i)
+            jobs.append((path, req.src, req.dest, req.f_req))
+
+    if workers > 1 and len(jobs) >= parallel_min_batch:
+        from edp.alg.edp_parallel import plan_parallel  # 遅延インポートで循環参照を回避
+
+        plans = plan_parallel(
+            jobs=jobs,
+            qnet=qnet_dist,
+            planner=planner,
+            workers=workers,
+            cache=cache,
+            planner_options=planner_options,
         )
-        if res is not None:
-            op_list = build_ops_from_edp_result(res)
-            results.append(op_list)
-        else:
-            results.append(None)
+    else:
+        plans = []
+        for path, src, dest, f_req in jobs:
+            t0 = time.perf_counter()
+            res = plan_fn(
+                src=src,
+                dest=dest,
+                qnet=qnet_dist,
+                path=path,
+                f_req=f_req,
+                cache=cache,
+            )
+            plan = PlanArray.from_tree(res[0], res[1]) if res is not None else None
+            plans.append((plan, time.perf_counter() - t0))
+
+    # 候補経路のうち遅延最小の木を採用（同じなら短い経路を優先）
+    for i, (res, elapsed) in zip(owners, plans):
+        reqs[i].plan_time += elapsed
+        if res is not None and (i not in best or res.latency < best[i].latency):
+            best[i] = res
+    if store is not None:
+        for i, key in store_keys.items():
+            store.save(key, best.get(i))
+
+    if templates is None:
+        templates = {}
+    for i, plan in best.items():
+        op_list = build_ops_from_plan_array(plan, templates=templates)
+        results[i] = op_list
     return results
 
 
+class _EDPContext(PlanContext):
+    """
+    再帰EDP用の作業領域
+    F×Fのf_swap表から作る(f1, f2)のPareto frontierと、区間ごとの遅延下界を持つ
+    """
+
+    def __init__(
+        self,
+        cache: PlanCache,
+        path: List[QNode],
+        qnet: Dict[Tuple[QNode, QNode], Dict[str, float]],
+        grid: List[float],
+        prune: bool = True,
+    ):
+        super().__init__(
+            cache=cache,
+            path=path,
+            qnet=qnet,
+            grid=grid,
+            planner=planner_key("recursive", {"prune": prune}),
+        )
+        self.prune = prune
+        self.calls: int = 0  # _EDPの呼び出し回数（ベンチマーク用）
+        # 今の部分問題の中でmax_depthに打ち切られた再帰があったか
+        # 打ち切られた結果は呼び出し時の深さに依存するので、memo・キャッシュに入れない
+        self.truncated: bool = False
+        self.index: Dict[QNode, int] = {nd: i for i, nd in enumerate(path)}
+        self._swap_table = [[f_swap(f1, f2) for f2 in self.grid] for f1 in self.grid]
+        self._pur_table = [f_pur(f0, f0) for f0 in self.grid]
+        self._swap_pairs: Dict[float, List[Tuple[float, float]]] = {}
+        self._pur_sources: Dict[float, List[float]] = {}
+        self._lower_bound = _latency_lower_bounds(path, qnet) if prune else None
+
+    def swap_pairs(self, f_req: float) -> List[Tuple[float, float]]:
+        """
+        f_swap(f1, f2) >= f_req となる候補(f1, f2)（f1, f2の昇順）
+        pruneなら支配されない組（各f1で最小のf2かつ、より小さいf1より真に小さいf2）だけ返す
+        区間の最小遅延はfについて単調非減少なので、支配される組が真に良くなることはない
+        """
+        pairs = self._swap_pairs.get(f_req)
+        if pairs is None:
+            pairs = []
+            b_prev = len(self.grid)
+            for a, f1 in enumerate(self.grid):
+                row = self._swap_table[a]
+                if not self.prune:
+                    pairs.extend(
+                        (f1, f2) for b, f2 in enumerate(self.grid) if row[b] >= f_req
+                    )
+                    continue
+                for b in range(b_prev):
+                    if row[b] >= f_req:
+                        pairs.append((f1, self.grid[b]))
+                        b_prev = b
+                        break
+            self._swap_pairs[f_req] = pairs
+        return pairs
+
+    def purify_sources(self, f_req: float) -> List[float]:
+        """
+        f0 < f_req かつ f_pur(f0, f0) >= f_req となる候補f0（昇順）
+        pruneなら最小のf0だけ（l_purはfに依存せず遅延に単調なので他は支配される）
+        """
+        sources = self._pur_sources.get(f_req)
+        if sources is None:
+            sources = [
+                f0
+                for f0, fp in zip(self.grid, self._pur_table)
+                if f0 < f_req and fp >= f_req
+            ]
+            if self.prune:
+                sources = sources[:1]
+            self._pur_sources[f_req] = sources
+        return sources
+
+    def lower_bound(self, n1: QNode, n2: QNode) -> float:
+        # フィデリティを問わない区間の遅延下界（prune時のみ）
+        assert self._lower_bound is not None
+        i, j = self.index[n1], self.index[n2]
+        if i > j:
+            i, j = j, i
+        return self._lower_bound[i][j]
+
+
+def _latency_lower_bounds(
+    path: List[QNode], qnet: Dict[Tuple[QNode, QNode], Dict[str, float]]
+) -> List[List[float]]:
+    """
+    lb[i][j]: 経路区間(i, j)をどんなフィデリティでも作れる最小遅延
+    直接リンクかswapのみで計算（l_pur(l, f) >= l なのでpurifyは下界を下げない）
+    """
+    n = len(path)
+    lb = [[math.inf] * n for _ in range(n)]
+    for d in range(1, n):
+        for i in range(n - d):
+            j = i + d
+            best = math.inf
+            for key in ((path[i], path[j]), (path[j], path[i])):
+                if key in qnet:
+                    best = min(best, 1 / qnet[key]["rate"])
+            for z in range(i + 1, j):
+                best = min(best, l_swap(lb[i][z], lb[z][j]))
+            lb[i][j] = best
+    return lb
+
+
 def EDP(
     path: List[QNode],
     src: QNode,
@@ -78,15 +309,56 @@ def EDP(
     qnet: Dict[Tuple[QNode, QNode], Dict[str, float]],
     f_req: float = 0.7,
     depth: int = 0,
-    max_depth: int = 20,
+    max_depth: Optional[int] = None,
+    cache: Optional[PlanCache] = None,
+    prune: bool = True,
+    grid: Optional[List[float]] = None,
+):
+    """
+    prune: 単調性による枝刈り（Pareto frontierの(f1, f2)だけ再帰し、遅延下界で分割を打ち切る）
+    枝刈りしても返す計画は同じ。Falseで全候補を列挙する従来の探索
+    grid: 部分区間に要求するフィデリティの候補（昇順）。NoneならF
+    max_depth: 再帰の深さの上限。Noneなら上限なし（swapは区間が縮み、purifyはf_reqが下がるので必ず止まる）
+        上限で打ち切った部分問題の結果はmemo・キャッシュに入れない（深さによって変わるため）
+    """
+    if cache is None:
+        cache = PlanCache()
+    if grid is None:
+        grid = F
+    ctx = _EDPContext(cache=cache, path=path, qnet=qnet, grid=grid, prune=prune)
+    return _EDP(
+        ctx=ctx, src=src, dest=dest, f_req=f_req, depth=depth, max_depth=max_depth
+    )
+
+
+def _EDP(
+    ctx: _EDPContext,
+    src: QNode,
+    dest: QNode,
+    f_req: float,
+    depth: int,
+    max_depth: Optional[int],
 ):
     key = (src, dest, f_req)
+    qnet = ctx.qnet
+    path = ctx.path
+    memo = ctx.memo
+    ctx.calls += 1
 
-    if depth > max_depth:
+    if max_depth is not None and depth > max_depth:
+        ctx.truncated = True
         return None
 
     if key in memo:
         return memo[key]
+    hit, res = ctx.lookup(src, dest, f_req)
+    if hit:
+        memo[key] = res
+        return res
+
+    # 部分問題ごとに打ち切りの有無を見る（呼び出し元の分は最後に戻す）
+    outer_truncated = ctx.truncated
+    ctx.truncated = False
 
     best_latency = math.inf
     best_tree = None
@@ -105,75 +377,78 @@ def EDP(
 
     # Swap
     # path = ["A", "B", "C", "D", "E", "F"]
-    i_x = path.index(src)
-    i_y = path.index(dest)
+    i_x = ctx.index[src]
+    i_y = ctx.index[dest]
     if i_x > i_y:
         i_x, i_y = i_y, i_x
     valid_z = path[i_x + 1 : i_y]
 
+    pairs = ctx.swap_pairs(f_req)
     for z in valid_z:
-        for f1 in F:
-            for f2 in F:
-                f_sw = f_swap(f1, f2)
-                if f_sw >= f_req:
-                    res1 = EDP(
-                        path=path,
-                        src=src,
-                        dest=z,
-                        f_req=f1,
-                        qnet=qnet,
-                        depth=depth + 1,
-                        max_depth=max_depth,
-                    )
-                    res2 = EDP(
-                        path=path,
-                        src=z,
-                        dest=dest,
-                        f_req=f2,
-                        qnet=qnet,
-                        depth=depth + 1,
-                        max_depth=max_depth,
-                    )
-                    if res1 and res2:
-                        latency = l_swap(res1[0], res2[0])
-                        if latency < best_latency:
-                            best_latency = latency
-                            best_tree = {
-                                "type": "Swap",
-                                "via": z,
-                                "x": src,
-                                "y": dest,
-                                "left": res1[1],
-                                "right": res2[1],
-                            }
-
-    # Purify
-    for f0 in F:
-        if f0 >= f_req:
-            continue
-        f_purify = f_pur(f0, f0)
-        if f_purify >= f_req:
-            res = EDP(
-                path=path,
+        if ctx.prune:
+            lb_right = ctx.lower_bound(z, dest)
+            # 下界同士でもincumbentを更新できない分割は見ない
+            if l_swap(ctx.lower_bound(src, z), lb_right) >= best_latency:
+                continue
+        for f1, f2 in pairs:
+            res1 = _EDP(
+                ctx=ctx,
                 src=src,
+                dest=z,
+                f_req=f1,
+                depth=depth + 1,
+                max_depth=max_depth,
+            )
+            if not res1:
+                continue
+            if ctx.prune and l_swap(res1[0], lb_right) >= best_latency:
+                continue
+            res2 = _EDP(
+                ctx=ctx,
+                src=z,
                 dest=dest,
-                f_req=f0,
-                qnet=qnet,
+                f_req=f2,
                 depth=depth + 1,
                 max_depth=max_depth,
             )
-            if res:
-                latency = l_pur(res[0], f0)
+            if res2:
+                latency = l_swap(res1[0], res2[0])
                 if latency < best_latency:
                     best_latency = latency
-                    best_tree = {"type": "Purify", "x": src, "y": dest, "child": res[1]}
+                    best_tree = {
+                        "type": "Swap",
+                        "via": z,
+                        "x": src,
+                        "y": dest,
+                        "left": res1[1],
+                        "right": res2[1],
+                    }
 
-    if best_latency < math.inf:
-        memo[key] = (best_latency, best_tree)
-        return memo[key]
-    else:
-        memo[key] = None
-        return None
+    # Purify
+    for f0 in ctx.purify_sources(f_req):
+        if ctx.prune and l_pur(ctx.lower_bound(src, dest), f0) >= best_latency:
+            continue
+        res = _EDP(
+            ctx=ctx,
+            src=src,
+            dest=dest,
+            f_req=f0,
+            depth=depth + 1,
+            max_depth=max_depth,
+        )
+        if res:
+            latency = l_pur(res[0], f0)
+            if latency < best_latency:
+                best_latency = latency
+                best_tree = {"type": "Purify", "x": src, "y": dest, "child": res[1]}
+
+    res = (best_latency, best_tree) if best_latency < math.inf else None
+    if not ctx.truncated:
+        memo[key] = res
+        ctx.store(src, dest, f_req, res)
+    # 打ち切られた再帰を含む結果はこの深さでしか正しくないので、呼び出し元も保存しない
+    ctx.truncated = ctx.truncated or outer_truncated
+    return res
 
 
 # ツリーをきれいに表示する関数
@@ -0,0 +1,204 @@
+# edp_dp.py
+# EDPのボトムアップ版
+# 再帰＋memoの代わりに、経路上の区間(i, j)×フィデリティ格子のテーブルをNumPyで埋める
+
+import math
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from qns.entity.node import QNode
+
+from edp.alg.plan_cache import PlanCache, PlanContext, planner_key, segment_nodes
+from edp.sim.models import f_pur, f_swap, l_pur
+
+# バックポインタの種類
+KIND_NONE = 0
+KIND_LINK = 1  # (src, dest)の直接リンク
+KIND_LINK_REV = 2  # (dest, src)の直接リンク
+KIND_SWAP = 3
+KIND_PURIFY = 4
+
+
+def _l_swap(l1: np.ndarray, l2: np.ndarray, pf=0.8, tau_f=1, tau_c=1) -> np.ndarray:
+    # models.l_swapの配列版（maxを要素ごとのnp.maximumにしたもの）
+    return (1.5 * np.maximum(l1, l2) + (tau_f + tau_c)) / pf
+
+
+def _swap_min_index(grid: np.ndarray, targets: np.ndarray) -> np.ndarray:
+    """
+    各ターゲットtと左側フィデリティf1について、f_swap(f1, f2) >= targets[t]を満たす
+    最小のf2インデックスを返す（存在しなければlen(grid)）。shape: (T, G)
+    f_swapは各引数に単調増加なので、満たすf2はこのインデックス以降すべてになる
+    """
+    fs = f_swap(grid[:, None], grid[None, :])
+    ok = fs[None, :, :] >= targets[:, None, None]
+    first = ok.argmax(axis=2)
+    return np.where(ok.any(axis=2), first, len(grid))
+
+
+def _purify_sources(grid: Sequence[float], targets: Sequence[float]) -> List[List[int]]:
+    # 再帰版と同じ条件: f0 < f_req かつ f_pur(f0, f0) >= f_req
+    return [
+        [k for k, f0 in enumerate(grid) if f0 < t and f_pur(f0, f0) >= t]
+        for t in targets
+    ]
+
+
+def EDP_dp(
+    path: List[QNode],
+    src: QNode,
+    dest: QNode,
+    qnet: Dict[Tuple[QNode, QNode], Dict[str, float]],
+    f_req: float = 0.7,
+    grid: Optional[Sequence[float]] = None,
+    cache: Optional[PlanCache] = None,
+) -> Optional[Tuple[float, dict]]:
+    """
+    EDPと同じ (latency, tree_dict) を返すボトムアップ版
+    lat[i, j, t]: 区間(i, j)でtargets[t]以上のEPを作る最小遅延
+    targetsはフィデリティ格子F + 末尾にf_req（部分区間の要求は格子上の値だけ）
+    cacheには経路全体の結果だけを出し入れする
+    """
+    if grid is None:
+        from edp.alg.edp import F  # 遅延インポートで循環参照を回避
+
+        grid = F
+
+    ctx: Optional[PlanContext] = None
+    if cache is not None:
+        ctx = PlanContext(
+            cache=cache, path=path, qnet=qnet, grid=grid, planner=planner_key("dp")
+        )
+        hit, res = ctx.lookup(src, dest, f_req)
+        if hit:
+            return res
+    res = _EDP_dp_table(
+        path=path, src=src, dest=dest, qnet=qnet, f_req=f_req, grid=grid
+    )
+    if ctx is not None:
+        ctx.store(src, dest, f_req, res)
+    return res
+
+
+def _EDP_dp_table(
+    path: List[QNode],
+    src: QNode,
+    dest: QNode,
+    qnet: Dict[Tuple[QNode, QNode], Dict[str, float]],
+    f_req: float,
+    grid: Sequence[float],
+) -> Optional[Tuple[float, dict]]:
+    nodes = segment_nodes(path, src, dest)
+    n = len(nodes)
+    if n < 2:
+        return None
+
+    grid_arr = np.asarray(grid, dtype=float)
+    n_grid = len(grid_arr)
+    targets = np.append(grid_arr, f_req)
+    n_t = len(targets)
+    t_idx = np.arange(n_t)
+
+    g_min = _swap_min_index(grid_arr, targets)  # (T, G)
+    pur_src = _purify_sources(list(grid), targets.tolist())
+
+    lat = np.full((n, n, n_t), math.inf)
+    kind = np.zeros((n, n, n_t), dtype=np.int8)
+    bp_z = np.zeros((n, n, n_t), dtype=np.int32)  # swapの中間ノード
+    bp_a = np.zeros((n, n, n_t), dtype=np.int32)  # swapのf1 / purifyのf0
+    bp_b = np.zeros((n, n, n_t), dtype=np.int32)  # swapのf2
+
+    for d in range(1, n):
+        for i in range(n - d):
+            j = i + d
+            row = np.full(n_t, math.inf)
+            row_kind = np.zeros(n_t, dtype=np.int8)
+
+            # 直接リンク
+            for key, k in (
+                ((nodes[i], nodes[j]), KIND_LINK),
+                ((nodes[j], nodes[i]), KIND_LINK_REV),
+            ):
+                if key not in qnet:
+                    continue
+                latency = 1 / qnet[key]["rate"]
+                better = (qnet[key]["fid"] >= targets) & (latency < row)
+                row[better] = latency
+                row_kind[better] = k
+
+            # Swap: 中間ノードz、f1ごとに満たす最小f2以降での最小遅延を使う
+            if d >= 2:
+                zs = np.arange(i + 1, j)
+                left = lat[i, zs, :n_grid]  # (nz, G)
+                right = np.concatenate(
+                    [lat[zs, j, :n_grid], np.full((len(zs), 1), math.inf)], axis=1
+                )  # (nz, G+1) 末尾は「該当なし」
+                right_suffix = np.minimum.accumulate(right[:, ::-1], axis=1)[:, ::-1]
+                cand = _l_swap(left[:, None, :], right_suffix[:, g_min])  # (nz, T, G)
+                flat = cand.transpose(1, 0, 2).reshape(n_t, -1)
+                best = flat.argmin(axis=1)
+                best_lat = flat[t_idx, best]
+                z_sel = best // n_grid
+                a_sel = best % n_grid
+                # f2は「最小f2以降で遅延最小の最初のもの」（再帰版と同じ選び方）
+                cols = np.arange(n_grid + 1)
+                right_sel = np.where(
+                    cols[None, :] >= g_min[t_idx, a_sel][:, None],
+                    right[z_sel],
+                    math.inf,
+                )
+                b_sel = right_sel.argmin(axis=1)
+
+                better = best_lat < row
+                row[better] = best_lat[better]
+                row_kind[better] = KIND_SWAP
+                bp_z[i, j, better] = zs[z_sel[better]]
+                bp_a[i, j, better] = a_sel[better]
+                bp_b[i, j, better] = b_sel[better]
+
+            # Purify: 同じ区間のより低いフィデリティから（格子の昇順に確定させる）
+            lat_row = row.tolist()
+            pur_lat: List[float] = [math.inf] * n_grid
+            for t in range(n_t):
+                for k in pur_src[t]:
+                    if pur_lat[k] < lat_row[t]:
+                        lat_row[t] = pur_lat[k]
+                        row_kind[t] = KIND_PURIFY
+                        bp_a[i, j, t] = k
+                if t < n_grid and lat_row[t] < math.inf:
+                    pur_lat[t] = l_pur(lat_row[t], grid[t])
+
+            lat[i, j] = lat_row
+            kind[i, j] = row_kind
+
+    best_latency = float(lat[0, n - 1, n_t - 1])
+    if best_latency == math.inf:
+        return None
+
+    def _tree(i: int, j: int, t: int) -> dict:
+        k = kind[i, j, t]
+        x, y = nodes[i], nodes[j]
+        if k == KIND_LINK:
+            return {"type": "Link", "link": (x, y)}
+        if k == KIND_LINK_REV:
+            return {"type": "Link", "link": (y, x)}
+        if k == KIND_SWAP:
+            z = int(bp_z[i, j, t])
+            return {
+                "type": "Swap",
+                "via": nodes[z],
+                "x": x,
+                "y": y,
+                "left": _tree(i, z, int(bp_a[i, j, t])),
+                "right": _tree(z, j, int(bp_b[i, j, t])),
+            }
+        if k == KIND_PURIFY:
+            return {
+                "type": "Purify",
+                "x": x,
+                "y": y,
+                "child": _tree(i, j, int(bp_a[i, j, t])),
+            }
+        raise ValueError(f"no plan for interval ({i}, {j}) target {t}")
+
+    return best_latency, _tree(0, n - 1, n_t - 1)
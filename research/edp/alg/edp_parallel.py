@@ -0,0 +1,122 @@
+# edp_parallel.py
+# batch_EDPの並列版
+# リクエストごとの計画をプロセスプールに振り分け、リクエスト順に結果を戻す
+# QNodeはプロセス間で送らず、ノード名とリンク表（名前キー）だけを各ワーカーに1回渡す
+
+import concurrent.futures as futures
+import time
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from qns.entity.node import QNode
+
+from edp.alg.edp import F, planner_fn
+from edp.alg.plan_array import PlanArray
+from edp.alg.plan_cache import PlanCache, PlanContext, planner_key
+
+# (path, src, dest, f_req)
+PlanJob = Tuple[List[QNode], QNode, QNode, float]
+# 経路をノード表に持つ配列表現 / None
+PlanResult = Optional[PlanArray]
+# (経路のノード名, srcの位置, destの位置, f_req)
+_WireJob = Tuple[Tuple[str, ...], int, int, float]
+
+# ワーカープロセス側の状態（_init_workerで1回だけ作る）
+_worker_state: Dict = {}
+
+
+def _init_worker(
+    link_table: Dict[Tuple[str, str], Dict[str, float]],
+    planner: str,
+    cache_max_entries: int,
+    planner_options: Optional[Dict[str, Any]],
+):
+    nodes: Dict[str, QNode] = {}
+    for n1, n2 in link_table:
+        for name in (n1, n2):
+            if name not in nodes:
+                nodes[name] = QNode(name=name)
+    _worker_state["nodes"] = nodes
+    _worker_state["qnet"] = {
+        (nodes[n1], nodes[n2]): info for (n1, n2), info in link_table.items()
+    }
+    _worker_state["plan_fn"] = planner_fn(planner, planner_options)
+    # ワーカー内で共通区間の計画を使い回す
+    _worker_state["cache"] = PlanCache(max_entries=cache_max_entries)
+
+
+def _plan_worker(job: _WireJob) -> Tuple[PlanResult, float]:
+    t0 = time.perf_counter()
+    names, i_src, i_dest, f_req = job
+    nodes = _worker_state["nodes"]
+    path = [nodes[name] for name in names]
+    res = _worker_state["plan_fn"](
+        path=path,
+        src=path[i_src],
+        dest=path[i_dest],
+        qnet=_worker_state["qnet"],
+        f_req=f_req,
+        cache=_worker_state["cache"],
+    )
+    plan = None
+    if res is not None:
+        # 親プロセスのノードに戻せるよう、経路上の位置の配列で返す（pickleも軽い）
+        index = {nd: i for i, nd in enumerate(path)}
+        plan = PlanArray.from_tree(res[0], res[1], index=index)
+    return plan, time.perf_counter() - t0
+
+
+def plan_parallel(
+    jobs: Sequence[PlanJob],
+    qnet: Dict[Tuple[QNode, QNode], Dict[str, float]],
+    planner: str,
+    workers: int,
+    cache: PlanCache,
+    planner_options: Optional[Dict[str, Any]] = None,
+) -> List[Tuple[PlanResult, float]]:
+    """
+    jobsをworkers個のプロセスで計画し、jobsと同じ順で (経路をノード表に持つPlanArray, 計画時間[秒]) を返す
+    cacheは親プロセスで経路全体の結果だけ出し入れする（ヒットしたjobはワーカーに送らない）
+    """
+    results: List[Tuple[PlanResult, float]] = [(None, 0.0)] * len(jobs)
+    contexts: Dict[int, PlanContext] = {}
+    # 親プロセスで出し入れするエントリのキー（計画関数と追加引数ごとに分ける）
+    pkey = planner_key(planner, planner_options)
+    wire: List[_WireJob] = []
+    pending: List[int] = []
+    for k, (path, src, dest, f_req) in enumerate(jobs):
+        t0 = time.perf_counter()
+        ctx = PlanContext(cache=cache, path=path, qnet=qnet, grid=F, planner=pkey)
+        hit, res = ctx.lookup_plan(src, dest, f_req)
+        if hit:
+            results[k] = (res, time.perf_counter() - t0)
+            continue
+        contexts[k] = ctx
+        pending.append(k)
+        wire.append(
+            (
+                tuple(nd.name for nd in path),
+                path.index(src),
+                path.index(dest),
+                f_req,
+            )
+        )
+    if not pending:
+        return results
+
+    link_table = {(n1.name, n2.name): info for (n1, n2), info in qnet.items()}
+    n_workers = min(workers, len(pending))
+    chunksize = max(1, len(pending) // (n_workers * 4))
+    with futures.ProcessPoolExecutor(
+        max_workers=n_workers,
+        initializer=_init_worker,
+        initargs=(link_table, planner, cache.max_entries, planner_options),
+    ) as ex:
+        planned = list(ex.map(_plan_worker, wire, chunksize=chunksize))
+
+    for k, (res, elapsed) in zip(pending, planned):
+        path, src, dest, f_req = jobs[k]
+        if res is not None:
+            res = res.with_nodes(path)
+        contexts[k].store_plan(src, dest, f_req, res)
+        results[k] = (res, elapsed)
+    return results
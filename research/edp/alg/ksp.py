@@ -0,0 +1,115 @@
+# ksp.py
+# k本の最短経路（Yen）
+# 重みはDijkstraRouteAlgorithmの既定と同じホップ数。src/destの組ごとにPathCacheで使い回す
+
+import heapq
+from collections import deque
+from typing import Dict, List, Optional, Set, Tuple
+
+from qns.entity.node import QNode
+
+from edp.sim.new_qchannel import NewQC
+
+
+class PathCache:
+    """
+    qcsから作った隣接リストと、(src, dest)ごとのk最短経路
+    同じ組でより大きいkを頼まれたとき、1本目に違う経路を頼まれたときは計算し直す
+    """
+
+    def __init__(self, qcs: List[NewQC]):
+        self.adj: Dict[QNode, List[QNode]] = {}
+        for qc in qcs:
+            n1, n2 = qc.node_list[0], qc.node_list[1]
+            self.adj.setdefault(n1, []).append(n2)
+            self.adj.setdefault(n2, []).append(n1)
+        self._paths: Dict[Tuple[QNode, QNode], List[List[QNode]]] = {}
+        self._k: Dict[Tuple[QNode, QNode], int] = {}
+
+    def get(
+        self, src: QNode, dest: QNode, k: int, first: Optional[List[QNode]] = None
+    ) -> List[List[QNode]]:
+        """
+        src -> dest のループなし経路を短い順に最大k本
+        first: 1本目に使う経路（ルーティングテーブルの経路と揃えるため）
+        """
+        key = (src, dest)
+        paths = self._paths.get(key)
+        if (
+            paths is None
+            or self._k[key] < k
+            or (first is not None and (not paths or paths[0] != first))
+        ):
+            self._paths[key] = k_shortest_paths(self.adj, src, dest, k, first=first)
+            self._k[key] = k
+        return self._paths[key][:k]
+
+
+def _bfs_path(
+    adj: Dict[QNode, List[QNode]],
+    src: QNode,
+    dest: QNode,
+    banned_nodes: Set[QNode],
+    banned_edges: Set[Tuple[QNode, QNode]],
+) -> Optional[List[QNode]]:
+    # ホップ数最小の経路（重みが全部1なのでBFS）
+    prev: Dict[QNode, Optional[QNode]] = {src: None}
+    queue = deque([src])
+    while queue:
+        u = queue.popleft()
+        if u == dest:
+            break
+        for v in adj.get(u, []):
+            if v in prev or v in banned_nodes or (u, v) in banned_edges:
+                continue
+            prev[v] = u
+            queue.append(v)
+    if dest not in prev:
+        return None
+    path = [dest]
+    while path[-1] != src:
+        path.append(prev[path[-1]])
+    return path[::-1]
+
+
+def k_shortest_paths(
+    adj: Dict[QNode, List[QNode]],
+    src: QNode,
+    dest: QNode,
+    k: int,
+    first: Optional[List[QNode]] = None,
+) -> List[List[QNode]]:
+    """Yenのアルゴリズム。ホップ数の昇順（同じなら見つけた順）"""
+    if first is None:
+        first = _bfs_path(adj, src, dest, set(), set())
+    if first is None:
+        return []
+    found: List[List[QNode]] = [first]
+    seen = {tuple(first)}
+    candidates: List[Tuple[int, int, List[QNode]]] = []
+    counter = 0
+    while len(found) < k:
+        last = found[-1]
+        for i in range(len(last) - 1):
+            spur = last[i]
+            root = last[: i + 1]
+            # 同じrootを持つ既出経路の次の辺を使わない
+            banned_edges: Set[Tuple[QNode, QNode]] = set()
+            for p in found:
+                if len(p) > i and p[: i + 1] == root:
+                    banned_edges.add((p[i], p[i + 1]))
+                    banned_edges.add((p[i + 1], p[i]))
+            banned_nodes = set(root[:-1])
+            tail = _bfs_path(adj, spur, dest, banned_nodes, banned_edges)
+            if tail is None:
+                continue
+            path = root[:-1] + tail
+            if tuple(path) in seen:
+                continue
+            seen.add(tuple(path))
+            heapq.heappush(candidates, (len(path), counter, path))
+            counter += 1
+        if not candidates:
+            break
+        found.append(heapq.heappop(candidates)[2])
+    return found
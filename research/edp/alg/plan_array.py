@@ -0,0 +1,204 @@
+# plan_array.py
+# swapping treeの配列表現
+# 入れ子のdictの代わりに、後行順（左の子 -> 右の子 -> 親）の並列配列で木を持つ
+# ノードはノード表へのインデックスで持つので、表を差し替えれば別の経路区間・別runのQNodeにも載せ替えられる
+
+from array import array
+from typing import Dict, List, Optional, Sequence
+
+from qns.entity.node import QNode
+
+# 操作の種類（typesの値）
+PLAN_LINK = 0
+PLAN_SWAP = 1
+PLAN_PURIFY = 2
+
+_TYPE_NAMES = {"Link": PLAN_LINK, "Swap": PLAN_SWAP, "Purify": PLAN_PURIFY}
+
+
+class PlanArray:
+    """
+    (latency, tree_dict) の配列版
+    i番目の操作: types[i], n1[i], n2[i], via[i]（swap以外は-1）, parent[i]（根は-1）
+    後行順なので子は必ず親より前にあり、根は末尾
+    nodes: ノード表。Noneなら使う側が表を渡す（計画キャッシュの相対表現など）
+    """
+
+    __slots__ = ("latency", "types", "n1", "n2", "via", "parent", "nodes")
+
+    def __init__(
+        self,
+        latency: float,
+        types: array,
+        n1: array,
+        n2: array,
+        via: array,
+        parent: array,
+        nodes: Optional[Sequence[QNode]] = None,
+    ):
+        self.latency = latency
+        self.types = types
+        self.n1 = n1
+        self.n2 = n2
+        self.via = via
+        self.parent = parent
+        self.nodes = tuple(nodes) if nodes is not None else None
+
+    def __len__(self) -> int:
+        return len(self.types)
+
+    @classmethod
+    def from_tree(
+        cls,
+        latency: float,
+        tree: dict,
+        index: Optional[Dict[QNode, int]] = None,
+    ) -> "PlanArray":
+        """
+        tree_dictを後行順に並べる
+        index: ノード -> インデックス。Noneなら木に出てきた順にノード表を作って持たせる
+        """
+        own_nodes: Optional[List[QNode]] = None
+        if index is None:
+            index = {}
+            own_nodes = []
+        types = array("b")
+        n1 = array("i")
+        n2 = array("i")
+        via = array("i")
+        parent = array("i")
+
+        def _idx(nd: QNode) -> int:
+            i = index.get(nd)
+            if i is None:
+                assert own_nodes is not None
+                i = index[nd] = len(own_nodes)
+                own_nodes.append(nd)
+            return i
+
+        # 再帰だと深いpurify鎖で詰まるので、明示スタックで後行順に積む
+        stack = [(tree, False)]
+        roots: List[int] = []  # 確定済みで親がまだ無い部分木の根
+        while stack:
+            node, expanded = stack.pop()
+            t = node["type"]
+            if not expanded:
+                stack.append((node, True))
+                if t == "Swap":
+                    stack.append((node["right"], False))
+                    stack.append((node["left"], False))
+                elif t == "Purify":
+                    stack.append((node["child"], False))
+                continue
+            if t == "Link":
+                a, b = node["link"]
+                n_children = 0
+            elif t == "Swap":
+                a, b = node["x"], node["y"]
+                n_children = 2
+            elif t == "Purify":
+                a, b = node["x"], node["y"]
+                n_children = 1
+            else:
+                raise ValueError(f"Unknown node type: {t}")
+            i = len(types)
+            types.append(_TYPE_NAMES[t])
+            n1.append(_idx(a))
+            n2.append(_idx(b))
+            via.append(_idx(node["via"]) if t == "Swap" else -1)
+            parent.append(-1)
+            # 直前に確定した部分木の根がこの操作の子
+            for _ in range(n_children):
+                parent[roots.pop()] = i
+            roots.append(i)
+        return cls(latency, types, n1, n2, via, parent, nodes=own_nodes)
+
+    def to_tree(self, nodes: Optional[Sequence[QNode]] = None) -> dict:
+        # tree_dictに戻す（後行順なので子の部分木はすでに組み上がっている）
+        nodes = self._resolve(nodes)
+        built: List[dict] = []
+        pending: Dict[int, List[dict]] = {}
+        for i in range(len(self.types)):
+            t = self.types[i]
+            x, y = nodes[self.n1[i]], nodes[self.n2[i]]
+            children = pending.pop(i, [])
+            if t == PLAN_LINK:
+                d = {"type": "Link", "link": (x, y)}
+            elif t == PLAN_SWAP:
+                d = {
+                    "type": "Swap",
+                    "via": nodes[self.via[i]],
+                    "x": x,
+                    "y": y,
+                    "left": children[0],
+                    "right": children[1],
+                }
+            elif t == PLAN_PURIFY:
+                d = {"type": "Purify", "x": x, "y": y, "child": children[0]}
+            else:
+                raise ValueError(f"Unknown plan type: {t}")
+            p = self.parent[i]
+            if p >= 0:
+                pending.setdefault(p, []).append(d)
+            built.append(d)
+        return built[-1]
+
+    def with_nodes(self, nodes: Sequence[QNode]) -> "PlanArray":
+        # 配列は共有したままノード表だけ差し替える
+        return PlanArray(
+            self.latency,
+            self.types,
+            self.n1,
+            self.n2,
+            self.via,
+            self.parent,
+            nodes=nodes,
+        )
+
+    def relative_to(self, index: Dict[QNode, int]) -> "PlanArray":
+        # ノード表を外した、index（別のノード表）基準の配列にする
+        remap = [index[nd] for nd in self._resolve(None)]
+        return PlanArray(
+            self.latency,
+            self.types,
+            array("i", (remap[i] for i in self.n1)),
+            array("i", (remap[i] for i in self.n2)),
+            array("i", (remap[i] if i >= 0 else -1 for i in self.via)),
+            self.parent,
+        )
+
+    def _resolve(self, nodes: Optional[Sequence[QNode]]) -> Sequence[QNode]:
+        if nodes is None:
+            nodes = self.nodes
+        if nodes is None:
+            raise ValueError("PlanArray has no node table")
+        return nodes
+
+    def to_json(self) -> dict:
+        # JSON化用。ノード表はノード名で持つ
+        return {
+            "latency": self.latency,
+            "types": self.types.tolist(),
+            "n1": self.n1.tolist(),
+            "n2": self.n2.tolist(),
+            "via": self.via.tolist(),
+            "parent": self.parent.tolist(),
+            "nodes": [nd.name for nd in self.nodes] if self.nodes else None,
+        }
+
+    @classmethod
+    def from_json(
+        cls, data: dict, nodes_by_name: Optional[Dict[str, QNode]] = None
+    ) -> "PlanArray":
+        nodes = None
+        if data.get("nodes") is not None and nodes_by_name is not None:
+            nodes = [nodes_by_name[name] for name in data["nodes"]]
+        return cls(
+            data["latency"],
+            array("b", data["types"]),
+            array("i", data["n1"]),
+            array("i", data["n2"]),
+            array("i", data["via"]),
+            array("i", data["parent"]),
+            nodes=nodes,
+        )
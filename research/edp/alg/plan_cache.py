@@ -0,0 +1,196 @@
+# plan_cache.py
+# EDPの計画キャッシュ
+# 計画関数（名前と追加引数）+ 経路区間（ノード名の並び）+ 区間内リンクのrate/fid + フィデリティ格子 + f_req をキーにLRUで保持する
+# 計画関数ごとに結果が違いうるので、別の計画関数のエントリは共有しない
+# 木は配列表現（plan_array）で、ノードは区間内の相対インデックスで保存するので、別リクエスト・別runでも安全に再利用できる
+
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, List, Optional, Sequence, Tuple
+
+from qns.entity.node import QNode
+
+from edp.alg.plan_array import PlanArray
+
+SegmentKey = Tuple[Tuple[str, ...], Tuple, Tuple[float, ...]]
+
+
+class PlanCache:
+    """
+    EDPの計画キャッシュ（LRU）
+    max_entries: 保持するエントリ（計画関数, 区間, f_req）の最大件数
+        件数で数える（バイト数ではない）。1件は区間の長さに比例する大きさの配列なので、
+        メモリを抑えたいときは経路長を見て件数を決める
+    値はNone（計画なし）もキャッシュする
+    """
+
+    def __init__(self, max_entries: int = 200_000):
+        assert max_entries > 0
+        self.max_entries: int = max_entries
+        self._entries: "OrderedDict[Hashable, Optional[PlanArray]]" = OrderedDict()
+        self.hits: int = 0
+        self.misses: int = 0
+        self.evictions: int = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def lookup(self, key: Hashable) -> Tuple[bool, Optional[PlanArray]]:
+        # (見つかったか, 値) を返す
+        if key in self._entries:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return True, self._entries[key]
+        self.misses += 1
+        return False, None
+
+    def store(self, key: Hashable, value: Optional[PlanArray]):
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        self._entries.clear()
+
+    def invalidate_link(self, n1: str, n2: str) -> int:
+        """
+        リンクn1-n2が区間内のリンクとしてキーに入っているエントリを捨てる
+        （区間の隣り合うホップか、区間内の2ノードを直接つなぐリンク。両端を含むだけの区間は残す）
+        キーにrate/fidが入っているので古いエントリが誤って使われることはないが、もう当たらないので掃除する
+        消した件数を返す
+        """
+        stale = [
+            key
+            for key in self._entries
+            if _has_link(key[1], n1, n2)  # key = (planner, segment_key, f_req)
+        ]
+        for key in stale:
+            del self._entries[key]
+        return len(stale)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "size": len(self._entries),
+        }
+
+
+class PlanContext:
+    """
+    1経路分の計画中に使う作業領域
+    区間キーの計算結果とローカルmemoを持ち、共有のPlanCacheへの出し入れ（木の変換）をまとめる
+    planner: 計画関数のキー（planner_key）。キャッシュのキーに入れ、別の計画関数とエントリを共有しない
+    storeには呼び出し時の状況（再帰の深さなど）に依存しない、完全な結果だけを渡すこと
+    """
+
+    def __init__(
+        self,
+        cache: PlanCache,
+        path: List[QNode],
+        qnet: Dict[Tuple[QNode, QNode], Dict[str, float]],
+        grid: Sequence[float],
+        planner: Hashable,
+    ):
+        self.cache = cache
+        self.planner = planner
+        self.path = path
+        self.qnet = qnet
+        self.grid = tuple(grid)
+        # (src, dest, f_req) -> 結果（この計画中はノードそのままの木で持つ）
+        self.memo: Dict[Tuple[QNode, QNode, float], Optional[Tuple[float, dict]]] = {}
+        self._segments: Dict[
+            Tuple[QNode, QNode], Tuple[List[QNode], Dict[QNode, int], SegmentKey]
+        ] = {}
+
+    def _segment(self, src: QNode, dest: QNode):
+        seg = self._segments.get((src, dest))
+        if seg is None:
+            nodes = segment_nodes(self.path, src, dest)
+            index = {nd: i for i, nd in enumerate(nodes)}
+            seg = (nodes, index, segment_key(nodes, self.qnet, self.grid))
+            self._segments[(src, dest)] = seg
+        return seg
+
+    def lookup(
+        self, src: QNode, dest: QNode, f_req: float
+    ) -> Tuple[bool, Optional[Tuple[float, dict]]]:
+        hit, plan = self.lookup_plan(src, dest, f_req)
+        if plan is None:
+            return hit, None
+        return hit, (plan.latency, plan.to_tree())
+
+    def store(
+        self,
+        src: QNode,
+        dest: QNode,
+        f_req: float,
+        value: Optional[Tuple[float, dict]],
+    ):
+        _, index, key = self._segment(src, dest)
+        if value is not None:
+            value = PlanArray.from_tree(value[0], value[1], index=index)
+        self.cache.store((self.planner, key, f_req), value)
+
+    def lookup_plan(
+        self, src: QNode, dest: QNode, f_req: float
+    ) -> Tuple[bool, Optional[PlanArray]]:
+        # 配列表現のまま取り出す（ノード表はこの区間のノード）
+        nodes, _, key = self._segment(src, dest)
+        hit, value = self.cache.lookup((self.planner, key, f_req))
+        if value is not None:
+            value = value.with_nodes(nodes)
+        return hit, value
+
+    def store_plan(
+        self, src: QNode, dest: QNode, f_req: float, plan: Optional[PlanArray]
+    ):
+        _, index, key = self._segment(src, dest)
+        if plan is not None:
+            plan = plan.relative_to(index)
+        self.cache.store((self.planner, key, f_req), plan)
+
+
+def _has_link(key: SegmentKey, n1: str, n2: str) -> bool:
+    # 区間キーのリンク（区間内の相対インデックスの組）にn1-n2があるか
+    names = key[0]
+    if n1 not in names or n2 not in names:
+        return False
+    a, b = sorted((names.index(n1), names.index(n2)))
+    return any(link[0] == a and link[1] == b for link in key[1])
+
+
+def planner_key(planner: str, options: Optional[Dict[str, Any]] = None) -> Hashable:
+    """計画関数の名前と追加引数のキャッシュキー（引数の値はreprで比べる）"""
+    return (planner, tuple(sorted((k, repr(v)) for k, v in (options or {}).items())))
+
+
+def segment_nodes(path: List[QNode], src: QNode, dest: QNode) -> List[QNode]:
+    # src -> dest の向きに並べた経路区間
+    i_x = path.index(src)
+    i_y = path.index(dest)
+    if i_x <= i_y:
+        return path[i_x : i_y + 1]
+    return path[i_y : i_x + 1][::-1]
+
+
+def segment_key(
+    nodes: Sequence[QNode],
+    qnet: Dict[Tuple[QNode, QNode], Dict[str, float]],
+    grid: Sequence[float],
+) -> SegmentKey:
+    """区間のキャッシュキー（ノード名、区間内リンクのrate/fid、フィデリティ格子）"""
+    links = []
+    n = len(nodes)
+    for a in range(n):
+        for b in range(a + 1, n):
+            for key, direction in (
+                ((nodes[a], nodes[b]), 0),
+                ((nodes[b], nodes[a]), 1),
+            ):
+                info = qnet.get(key)
+                if info is not None:
+                    links.append((a, b, direction, info["rate"], info["fid"]))
+    return (tuple(nd.name for nd in nodes), tuple(links), tuple(grid))
@@ -0,0 +1,104 @@
+# plan_store.py
+# EDP計画のディスク保存（内容アドレス）
+# キー: トポロジ（リンクのrate/fid込み）のハッシュ + src/dest + f_req + 計画オプション
+# 木は配列表現（plan_array）＋ノード名の表で保存するので、同じseedで作り直したトポロジ（別QNodeオブジェクト）でも読み戻せる
+# 計画はT_MEMに依存しないので、t_memやpsw_thresholdのスイープ点の間で使い回せる
+
+import hashlib
+import json
+import os
+import tempfile
+from typing import Any, Dict, Optional, Sequence, Tuple
+
+from qns.entity.node import QNode
+
+from edp.alg.plan_array import PlanArray
+
+# 保存形式を変えたら上げる（キーに含めるので古いファイルは読まれない）
+# 3: 再帰EDPの深さ上限で打ち切られた計画が保存されていたので、それ以前のファイルは使わない
+PLAN_STORE_VERSION = 3
+
+
+class PlanStore:
+    """
+    root_dir/<ハッシュ先頭2文字>/<ハッシュ>.json に1リクエスト分の計画を置く
+    値はNone（計画なし）も保存する
+    """
+
+    def __init__(self, root_dir: str):
+        self.root_dir = root_dir
+        os.makedirs(root_dir, exist_ok=True)
+        self.hits: int = 0
+        self.misses: int = 0
+        self.writes: int = 0
+
+    def key(
+        self,
+        topo_hash: str,
+        src: QNode,
+        dest: QNode,
+        f_req: float,
+        options: Dict[str, Any],
+    ) -> str:
+        payload = {
+            "topology": topo_hash,
+            "src": src.name,
+            "dest": dest.name,
+            "f_req": f_req,
+            "options": options,
+            "version": PLAN_STORE_VERSION,
+        }
+        return _sha256(payload)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.root_dir, key[:2], f"{key}.json")
+
+    def load(
+        self, key: str, nodes: Dict[str, QNode]
+    ) -> Tuple[bool, Optional[PlanArray]]:
+        # (見つかったか, 計画) を返す。nodesはノード名 -> QNode
+        try:
+            with open(self._path(key), "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            # 無い・壊れている場合は計画し直して上書きする
+            self.misses += 1
+            return False, None
+        self.hits += 1
+        if data["plan"] is None:
+            return True, None
+        return True, PlanArray.from_json(data["plan"], nodes)
+
+    def save(self, key: str, value: Optional[PlanArray]):
+        plan = value.to_json() if value is not None else None
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # 並列スイープで同じキーを書いても壊れないよう、一時ファイルから置き換える
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump({"key": key, "plan": plan}, f)
+            os.replace(tmp, path)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+        self.writes += 1
+
+    def stats(self) -> Dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses, "writes": self.writes}
+
+
+def topology_hash(
+    qnet: Dict[Tuple[QNode, QNode], Dict[str, float]], grid: Sequence[float]
+) -> str:
+    """リンク（向き込み）とそのrate/fid、フィデリティ格子のハッシュ"""
+    links = sorted(
+        (n1.name, n2.name, info["rate"], info["fid"]) for (n1, n2), info in qnet.items()
+    )
+    return _sha256({"links": links, "grid": list(grid)})
+
+
+def _sha256(payload: Any) -> str:
+    text = json.dumps(payload, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
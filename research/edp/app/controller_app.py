@@ -1,27 +1,34 @@
 # controller_app.py
 # main duty: controll the entire network
+import heapq
 import logging
 import math
 import random
 from collections import deque
 from os import name
-from typing import DefaultDict, Deque, Dict, List, Optional
+from typing import Any, DefaultDict, Deque, Dict, List, Optional, Set
 
 import qns.utils.log as log
 from qns.entity.node.app import Application
 from qns.entity.node.node import QNode
 from qns.network import QuantumNetwork
 from qns.network.topology.waxmantopo import QuantumChannel
-from qns.simulator.event import func_to_event
 from qns.simulator.simulator import Simulator
 from qns.simulator.ts import Time
 
 from edp.alg.edp import batch_EDP
-from edp.sim.ep import EP
+from edp.alg.ksp import PathCache
+from edp.alg.plan_cache import PlanCache
+from edp.alg.plan_store import PlanStore
+from edp.sim.calendar_pool import clear_events, peek_time
+from edp.sim.ep import EP, DecayClock
+from edp.sim.ep_pool import EPPool, PooledEP
+from edp.sim.events import PhaseEvent, PurifyDoneEvent, SwapDoneEvent
+from edp.sim.link_store import LinkStore
 from edp.sim.models import f_pur, f_swap, p_pur
 from edp.sim.new_qchannel import NewQC
 from edp.sim.new_request import NewRequest
-from edp.sim.op import Operation, OpStatus, OpType
+from edp.sim.op import Operation, OpStatus, OpTemplate, OpType
 
 # 初期値
 p_swap = 0.4
@@ -35,6 +42,7 @@ f_cut = 0.70  # 切り捨て閾値
 init_fidelity = 0.99
 l0_link_max = 5  # リンクレベルEPのバッファ数
 CLASSICAL_LIGHT_SPEED = 2e8  # m/s 相当（伝送遅延近似用）
+CYCLE_SLOTS = 3  # gen -> req -> link の1周期のスロット数
 
 
 class PSWRequest:
@@ -52,6 +60,7 @@ class PSWRequest:
         self.target_op = target_op
         self.is_done: bool = False
         self.is_psw: bool = True
+        self.order: int = 0  # コントローラのrequestsに加えた順
 
 
 class ControllerApp(Application):
@@ -70,6 +79,15 @@ class ControllerApp(Application):
         init_fidelity: float = init_fidelity,
         enable_psw: bool = True,
         psw_threshold: Optional[float] = None,
+        edp_planner: str = "recursive",
+        plan_cache: Optional[PlanCache] = None,
+        edp_workers: int = 1,
+        edp_k_paths: int = 1,
+        plan_store: Optional[PlanStore] = None,
+        edp_planner_options: Optional[Dict[str, Any]] = None,
+        ep_pool: str = "object",
+        skip_idle: bool = False,
+        fused_tick: bool = False,
     ):
         super().__init__()
         self.p_swap: float = p_swap
@@ -85,11 +103,59 @@ class ControllerApp(Application):
         self.psw_threshold: Optional[float] = (
             psw_threshold if psw_threshold is not None else f_cut + 0.05
         )
+        # スワップ計画の探索方法 "recursive" or "dp"（edp.alg.edp.batch_EDP参照）
+        self.edp_planner: str = edp_planner
+        # 計画関数への追加引数（recursiveのprune, max_depthなど）
+        self.edp_planner_options: Optional[Dict[str, Any]] = edp_planner_options
+        # スイープ側から渡せばrun間で計画を使い回す。Noneならbuild_EDP内だけのキャッシュ
+        self.plan_cache: Optional[PlanCache] = plan_cache
+        # 計画を並列にするプロセス数。1なら逐次、0以下ならCPU数
+        self.edp_workers: int = edp_workers
+        # 2以上ならk本の最短経路それぞれで計画して遅延最小の木を使う
+        self.edp_k_paths: int = edp_k_paths
+        self.path_cache: Optional[PathCache] = None  # (src, dest)ごとのk最短経路
+        # ディスク上の計画ストア。同じトポロジ・リクエストの計画をrun間（プロセス間）で使い回す
+        self.plan_store: Optional[PlanStore] = plan_store
         self.net: QuantumNetwork
         self.node: QNode
         self.requests: List[NewRequest] = []
-        self.links: List[EP] = []  # シンプルにlinkEPぶち込んでEP管理
-        self.links_next: List[EP] = []  # 次のタイムスロットで使えるようになる新EP
+        self._request_seq: int = 0  # 次にrequestsに加えるリクエストのorder
+        # EPの置き場。使えるEP（live）と次のタイムスロットで使えるようになる新EP（pending）
+        self.link_store = LinkStore()
+        # EPの減衰の時計。links_manager_routineのたびに全EPが1周期分減衰する
+        self.decay_clock = DecayClock(period=CYCLE_SLOTS)
+        # EPの状態の持ち方 "object"（EPごと、切り捨ては時刻のヒープ）or "numpy"（EPPoolの配列、切り捨てはtickごとのベクトル判定）
+        if ep_pool == "object":
+            self.ep_pool: Optional[EPPool] = None
+        elif ep_pool == "numpy":
+            self.ep_pool = EPPool(clock=self.decay_clock)
+        else:
+            raise ValueError(f"Unknown ep_pool: {ep_pool}")
+        # Trueなら何も起きないtickを飛ばし、次に状態が変わり得るtickからgen -> req -> linkを再開する
+        self.skip_idle: bool = skip_idle
+        # swap/purifyの完了イベントのスロット（最小ヒープ、skip_idleの起床時刻の計算用）
+        self._completion_slots: List[int] = []
+        self.skipped_ticks: int = 0  # skip_idleで飛ばしたtick数（1周期 = 3tick）
+        # Trueなら、次のフェーズ（gen -> req -> link）までに他のイベントが無い限り、
+        # イベントを積まずに時刻だけ進めて同じイベントの中で続けて実行する
+        self.fused_tick: bool = fused_tick
+        self._deferred_phase: Optional[tuple[Time, Any]] = None
+        self._in_phase: bool = False
+        self.fused_phases: int = 0  # イベントを積まずに実行したフェーズ数
+        self.all_done: bool = False
+        # EPの通し番号（シミュレーションごと）と、delete_EPで返されたEPのfree list
+        self._ep_next_id: int = 0
+        self._ep_free: List[EP] = []
+        # EPがf_cutを下回る時刻の最小ヒープ (時刻[s], ep_id, 通し番号, EP)。消費されたEPは遅延削除
+        # 同じ時刻ならep_idの順（生成順。リンクのリストを頭から切り捨てていたときと同じ順）
+        self._cutoff_heap: List[tuple[float, Optional[int], int, EP]] = []
+        self._cutoff_seq: int = 0
+        self._cutoff_stale: int = 0  # ヒープに残っている無効な登録の数
+        # PSWの発火予定 (時刻[s], 通し番号, op)。片側待ちのEPがpsw_thresholdを下回る時刻
+        # _psw_armedに無い・時刻が違う項目は無効（登録し直した・発火済み）
+        self._psw_heap: List[tuple[float, int, Operation]] = []
+        self._psw_armed: Dict[Operation, float] = {}
+        self._psw_seq: int = 0
         # self.fidelity: List[float] = []  # i番目のqcで生成されるlinkのフィデリティ初期値
         self.nodes: List[QNode] | None = None
         self.completed_requests: List[dict] = []
@@ -111,7 +177,24 @@ class ControllerApp(Application):
         self.swap_wait_times_by_req: Dict[str, List[int]] = {}
         # gen_link -> gen_EP_routineで生成するqcリスト dict[qc_name, [op待ち行列]]
         self.genlink_queue: dict[str, deque[Operation]] = {}
+        # 待ち行列に要求が入っているqc（空になったものはgen_EP_routineで外す）
+        self._genlink_active: Set[str] = set()
+        # qcの並び（genlink_queueと同じ順）。生成はこの順に行う
+        self._qc_order: Dict[str, int] = {}
         self.qc_by_name: Dict[str, NewQC] = {}
+        # gen_rateを個別に持つqcの次回生成スロット dict[qc_name, time_slot]
+        self._qc_next_gen_slot: Dict[str, int] = {}
+        # 再計画済みで差し替え待ちの計画（実行中の操作がなくなったら入れ替える）
+        self.pending_plans: Dict[NewRequest, tuple[Operation, list[Operation]]] = {}
+        self.replanned: int = 0  # 差し替えた計画の数
+        # READYになったop（Operation.set_readyが積む）。request_handler_routineはここだけを見る
+        self.ready_ops: deque[Operation] = deque()
+        # OPの木の雛形。リクエスト用は計画ごと、PSW用はターゲットのopごと
+        self.op_templates: Dict[Any, OpTemplate] = {}
+        self.psw_templates: Dict[Operation, OpTemplate] = {}
+        self.psw_trees_reused: int = 0  # free listから使い回したPSWの木の数
+        # 片付けたPSWの木。EPの受け渡しが済んだ次のrequest_handler_routineで返す
+        self._psw_released: List[tuple[OpTemplate, List[Operation]]] = []
 
     def install(self, node: QNode, simulator: Simulator):
         super().install(node, simulator)
@@ -137,8 +220,10 @@ class ControllerApp(Application):
         # 初期イベントを挿入
         # gen_ep -> req_routine -> link_manager_routine -> gen_ep -> ...
         self._next_gen_time_slot = t.time_slot
-        gen_ep_routine = func_to_event(t=t, fn=self.gen_EP_routine, by=self)
-        self._simulator.add_event(gen_ep_routine)
+        self.decay_clock.install(
+            self._simulator, first_slot=t.time_slot + CYCLE_SLOTS - 1
+        )
+        self._add_phase_event(t, self.gen_EP_routine)
         # req_routine = func_to_event(t=t, fn=self.request_handler_routine, by=self)
         # self._simulator.add_event(req_routine)
         # link_routine = func_to_event(t=t, fn=self.links_manager_routine, by=self)
@@ -155,15 +240,26 @@ class ControllerApp(Application):
             new_req = NewRequest(
                 src=src, dest=dest, name=name, priority=0, f_req=self.f_req
             )  # リクエストのインスタンス作成
-            self.requests.append(new_req)
+            self._add_request(new_req)
 
         self.build_EDP()  # ルーティングテーブル作成
 
+    def _add_request(self, req: NewRequest | PSWRequest):
+        # requestsの末尾に加える。orderはrequestsでの並び順（削除しても前後は変わらない）
+        req.order = self._request_seq
+        self._request_seq += 1
+        self.requests.append(req)
+
+    @staticmethod
+    def _run_order(op: Operation) -> tuple[float, int]:
+        # 同じtickのopの実行順: リクエストの順 -> opsリストの順
+        # （リクエストごとにopsを走査していたときと同じ順。リンク生成の要求順もこれで決まる）
+        req = op.request
+        return (req.order if req is not None else math.inf, op.order)
+
     def build_EDP(self):
         # EDPのswaping tree作成
-        swap_plans = batch_EDP(
-            qnet=self.net, reqs=self.requests, qcs=self.new_qcs, gen_rate=self.gen_rate
-        )
+        swap_plans = self._plan_requests(self.requests)
         for i, plan in enumerate(swap_plans):
             if plan is None:
                 log.logger.debug(
@@ -175,6 +271,138 @@ class ControllerApp(Application):
             _, ops = plan
             for op in ops:
                 op.request = self.requests[i]
+            self._attach_ops(ops)
+
+    def _plan_requests(self, reqs: List[NewRequest]):
+        if self.edp_k_paths > 1 and self.path_cache is None:
+            self.path_cache = PathCache(self.new_qcs)
+        if self.plan_cache is None:
+            # 再計画で変わっていない区間を使い回せるよう、コントローラで1つ持つ
+            self.plan_cache = PlanCache()
+        return batch_EDP(
+            qnet=self.net,
+            reqs=reqs,
+            qcs=self.new_qcs,
+            gen_rate=self.gen_rate,
+            planner=self.edp_planner,
+            cache=self.plan_cache,
+            workers=self.edp_workers,
+            k_paths=self.edp_k_paths,
+            path_cache=self.path_cache,
+            store=self.plan_store,
+            planner_options=self.edp_planner_options,
+            templates=self.op_templates,
+        )
+
+    def update_link(
+        self,
+        qc: NewQC | str,
+        rate: Optional[float] = None,
+        fidelity: Optional[float] = None,
+    ):
+        """
+        チャネルの生成レート・初期フィデリティを変えて、そのリンクを経路に含むリクエストだけ再計画する
+        新しい計画はすぐには入れ替えず、実行中の操作がなくなった時点で差し替える（_apply_pending_plans）
+        """
+        if isinstance(qc, str):
+            qc = self.qc_by_name[qc]
+        n1, n2 = qc.node_list[0], qc.node_list[1]
+        if self.plan_cache is not None:
+            # 変わったリンクを含む区間の計画だけ捨てる（それ以外の区間はキャッシュから再利用）
+            n_stale = self.plan_cache.invalidate_link(n1.name, n2.name)
+            log.logger.debug(f"{qc.name}: invalidated {n_stale} cached intervals")
+        if rate is not None:
+            qc.gen_rate = rate
+        if fidelity is not None:
+            qc.fidelity_init = fidelity
+            qc.plan_fidelity = fidelity
+        self.replan(changed_qcs=[qc])
+
+    def replan(self, changed_qcs: List[NewQC]):
+        # changed_qcsのどれかを候補経路に含むリクエストを再計画して差し替え待ちにする
+        ends = [set(qc.node_list) for qc in changed_qcs]
+        affected: List[NewRequest] = []
+        for req in self.requests:
+            if getattr(req, "is_psw", False):
+                continue
+            if req.is_done and req.swap_plan is not None:
+                continue  # 完了済み
+            paths = self._candidate_paths(req)
+            if any(e <= set(path) for path in paths for e in ends):
+                affected.append(req)
+        if not affected:
+            return
+
+        swap_plans = self._plan_requests(affected)
+        for req, plan in zip(affected, swap_plans):
+            if plan is None:
+                # 新しい条件で計画が無ければ今の計画のまま続ける
+                log.logger.debug(f"replan: swap plan not found for request {req.name}")
+                continue
+            _, ops = plan
+            for op in ops:
+                op.request = req
+            self.pending_plans[req] = plan
+        log.logger.info(
+            f"replanned {len(affected)} requests for {[qc.name for qc in changed_qcs]}"
+        )
+
+    def _candidate_paths(self, req: NewRequest) -> List[List[QNode]]:
+        # batch_EDPと同じ候補経路
+        paths = self.net.query_route(req.src, req.dest)
+        if not paths:
+            return []
+        path = paths[0][2]
+        if self.edp_k_paths > 1 and self.path_cache is not None:
+            return self.path_cache.get(req.src, req.dest, self.edp_k_paths, first=path)
+        return [path]
+
+    def _apply_pending_plans(self):
+        # 差し替え待ちの計画を、実行中の操作・PSWが無いリクエストから入れ替える
+        for req, plan in list(self.pending_plans.items()):
+            if req.is_done and req.swap_plan is not None:
+                del self.pending_plans[req]
+                continue
+            if req.swap_plan is not None:
+                _, old_ops = req.swap_plan
+                if not self._is_safe_to_swap(old_ops):
+                    continue
+                self._retire_ops(old_ops)
+            req.swap_plan = plan
+            self._attach_ops(plan[1])
+            req.is_done = False
+            del self.pending_plans[req]
+            self.replanned += 1
+            log.logger.debug(f"{self._simulator.tc} swap plan replaced req={req.name}")
+
+    def _is_safe_to_swap(self, ops: List[Operation]) -> bool:
+        for op in ops:
+            op.sync()
+        if any(op.status == OpStatus.RUNNING for op in ops):
+            return False
+        op_set = set(ops)
+        return not any(
+            meta.get("target") in op_set for meta in self.psw_op_target.values()
+        )
+
+    def _attach_ops(self, ops: List[Operation]):
+        # 実行対象になったopをready_opsにつなぐ（GEN_LINKなど最初からREADYのものはここで積まれる）
+        for op in ops:
+            op.attach_ready_queue(self.ready_ops)
+
+    def _retire_ops(self, ops: List[Operation]):
+        # 古い計画のopが持っているEPとリンク生成要求を片付ける
+        for op in ops:
+            op.attach_ready_queue(None)  # ready_opsに残っていても実行しない（中でsyncも済む）
+            self.psw_templates.pop(op, None)
+            for ep in [op.ep, *op.pur_eps]:
+                if ep is not None and ep.owner_op is op:
+                    self.consume_EP(ep)
+            if op.demand_registered:
+                qc = self._find_qc_by_nodes(op.n1, op.n2)
+                if qc is not None and op in self.genlink_queue[qc.name]:
+                    self.genlink_queue[qc.name].remove(op)
+                op.demand_registered = False
 
     def init_qcs(self):
         # qc.fidelityを設定
@@ -194,7 +422,10 @@ class ControllerApp(Application):
 
         self.new_qcs = new_qcs
         self.genlink_queue = {qc.name: deque() for qc in self.new_qcs}
+        self._genlink_active = set()
+        self._qc_order = {qc.name: i for i, qc in enumerate(self.new_qcs)}
         self.qc_by_name = {qc.name: qc for qc in self.new_qcs}
+        self.qc_by_nodes = {frozenset(qc.node_list): qc for qc in self.new_qcs}
 
     def gen_EP_routine(self):
         # 全チャネルでリンクレベルもつれ生成x
@@ -213,14 +444,22 @@ class ControllerApp(Application):
         log.logger.debug(f"{self._simulator.tc} gen ep routine start")
 
         # pending demandsからEP生成
-        for qc_name, queue in list(self.genlink_queue.items()):
+        # 要求のあるqcだけを、全qcを回していたときと同じ順に見る
+        active = self._genlink_active
+        for qc_name in sorted(active, key=self._qc_order.__getitem__):
+            queue = self.genlink_queue[qc_name]
             if not queue:
+                active.discard(qc_name)  # 計画の差し替え等で空になった
                 continue
             qc = self.qc_by_name[qc_name]
             assert qc is not None, f"no QC named {qc_name}"
             if not qc.has_free_memory:
                 continue
+            # チャネル固有のgen_rateがあればその間隔も守る（全体の生成間隔より速くはならない）
+            if tc.time_slot < self._qc_next_gen_slot.get(qc_name, 0):
+                continue
             op = queue.popleft()
+            op.sync()
             nodes = qc.node_list
             ep = self.gen_single_EP(
                 src=nodes[0],
@@ -232,20 +471,24 @@ class ControllerApp(Application):
             if ep is None:
                 queue.appendleft(op)  # queueの先頭に戻す
                 continue
+            if not queue:
+                active.discard(qc_name)
             # gen_linkをdoneにする
             op.ep = ep
             ep.set_owner(op)
             op.done()
+            self._arm_psw(op, op.parent)
             op.demand_registered = False  # 再生成のために解除
+            if qc.gen_rate is not None:
+                self._qc_next_gen_slot[qc_name] = (
+                    tc.time_slot + self._calc_gen_interval_slot(qc.gen_rate)
+                )
 
         # 次回の生成時刻を更新
         self._next_gen_time_slot += self.gen_interval_slot
 
     def _find_qc_by_nodes(self, n1: QNode, n2: QNode) -> Optional[NewQC]:
-        for qc in self.new_qcs:
-            if set(qc.node_list) == {n1, n2}:
-                return qc
-        return None
+        return self.qc_by_nodes.get(frozenset((n1, n2)))
 
     def request_handler_routine(self):
         # リクエストを管理
@@ -255,8 +498,14 @@ class ControllerApp(Application):
         self._add_next_tick_event(fn=self.links_manager_routine)
 
         log.logger.debug(f"{self._simulator.tc} req routine start")
+        if self.pending_plans:
+            self._apply_pending_plans()
+        if self._psw_released:
+            for template, ops in self._psw_released:
+                self._release_psw_tree(template, ops)
+            self._psw_released.clear()
         is_all_done = True
-        for req in self.requests:
+        for idx, req in enumerate(self.requests):
             if req.swap_plan is None:
                 if not req.is_done:
                     log.logger.debug(f"skip request without swap plan: {req.name}")
@@ -264,9 +513,8 @@ class ControllerApp(Application):
                 continue
 
             # 終了判定
-            root_op, ops = req.swap_plan
+            root_op, _ = req.swap_plan
             assert isinstance(root_op, Operation)
-            idx = self.requests.index(req)
             if req.is_done:
                 # print("!!!!!!!!req", idx, " finished!!!!!!!!")
                 continue
@@ -277,6 +525,9 @@ class ControllerApp(Application):
                 # f_reqも終了条件に加える
                 req.is_done = True
                 if not getattr(req, "is_psw", False):
+                    # このリクエストのopはもうPSWのターゲットにならない
+                    for op in req.swap_plan[1]:
+                        self.psw_templates.pop(op, None)
                     finish_time = self._simulator.tc.time_slot
                     self.completed_requests.append(
                         {
@@ -292,43 +543,123 @@ class ControllerApp(Application):
                 continue
             else:
                 is_all_done = False
-                self._advance_request(req, root_op, ops)
 
         if is_all_done:
             # 全リクエスト終わったらシミュレータのイベント全消しして終了
             # TODO self.result = [time, ...]
             log.debug("!!!!!!!!all requests finished!!!!!!!!!")
-            self._simulator.event_pool.event_list.clear()
+            self.all_done = True
+            clear_events(self._simulator.event_pool)
             return
+        self._run_ready_ops()
 
     def links_manager_routine(self):
-        # self.linksからLinkEPのデコヒーレンスを管理
-        # self.links_next　を次のタイムスロットでself.linksに挿入
+        # link_storeのliveなLinkEPのデコヒーレンスを管理
+        # pendingのEPを次のタイムスロットで使えるようにする
+        # フィデリティはEPが読むたびに減衰の回数から計算するので、ここでは時計を進めて切り捨てるだけ
         log.logger.debug(f"{self._simulator.tc} link routine start")
 
-        if len(self.links_next) != 0:
-            self.links += self.links_next
-
-        # print("links: ", [link.fidelity for link in self.links])
-        dt = Time(time_slot=3).sec  # 1 timeslotをsec単位に変換
-        for link in list(self.links):  # 途中でリンクが削除されても安全に回す
-            self.fid_update_EP(ep=link, dt=dt)  # フィデリティ更新
-            if link.fidelity < self.f_cut:  # f_cut以下のもつれを切り捨てる
-                log.logger.info(f"{self._simulator.tc} decoherenced link {link.nodes}")
-                self.decoherence_EP(link)
+        self.decay_clock.tick()
+        self.link_store.promote()
+        self._expire_links()
         if self.enable_psw and self.psw_threshold is not None:
-            self._scan_psw_targets()
-        self.links_next.clear()
+            self._trigger_psw()
 
-        self._add_next_tick_event(fn=self.gen_EP_routine)
+        if self.skip_idle:
+            self._schedule_next_cycle()
+        else:
+            self._add_next_tick_event(fn=self.gen_EP_routine)
 
-    def _advance_request(
-        self, req: NewRequest, root_op: Operation, ops: List[Operation]
-    ):
-        # リクエストを１操作分進める
-        # 現時点でREADYなopだけ実行
-        ready_ops = [op for op in ops if op.status == OpStatus.READY]
-        for op in ready_ops:  # コピー使うことで1操作分以上進まないようにする
+    def _schedule_cutoff(self, ep: EP):
+        # epがf_cutを下回る時刻をヒープに登録（fidelityを代入したら登録し直す）
+        # EPPoolのEPはtickごとに配列でまとめて判定するので登録しない
+        if self.ep_pool is not None:
+            return
+        if ep.cutoff_at is not None:
+            self._cutoff_stale += 1  # 前の登録は無効になる
+        t_cut = ep.crossing_time(self.f_cut)
+        if math.isinf(t_cut):
+            ep.cutoff_at = None
+            return
+        ep.cutoff_at = t_cut
+        self._cutoff_seq += 1
+        heapq.heappush(self._cutoff_heap, (t_cut, ep.ep_id, self._cutoff_seq, ep))
+
+    def _cancel_cutoff(self, ep: EP):
+        # 消費・削除されたepの登録を無効にする。無効な登録が半分を超えたら作り直す
+        if ep.cutoff_at is None:
+            return
+        ep.cutoff_at = None
+        self._cutoff_stale += 1
+        heap = self._cutoff_heap
+        if self._cutoff_stale > 64 and self._cutoff_stale * 2 > len(heap):
+            self._cutoff_heap = [
+                e for e in heap if e[3].cutoff_at == e[0] and e[3].ep_id == e[1]
+            ]
+            heapq.heapify(self._cutoff_heap)
+            self._cutoff_stale = 0
+
+    def _expire_links(self):
+        # 切り捨て時刻を過ぎたliveなEPをf_cut以下として切り捨てる（全リンクの走査はしない）
+        now = self._simulator.tc.sec
+        if self.ep_pool is not None:
+            for link in self.ep_pool.below(self.f_cut):
+                if not self.link_store.is_live(link):
+                    continue  # pendingのEPは次のtickで見る
+                log.logger.info(f"{self._simulator.tc} decoherenced link {link.nodes}")
+                self.decoherence_EP(link)
+            return
+        heap = self._cutoff_heap
+        retry: List[tuple[float, Optional[int], int, EP]] = []
+        while heap and heap[0][0] <= now:
+            entry = heapq.heappop(heap)
+            t_cut, ep_id, _, link = entry
+            if link.cutoff_at != t_cut or link.ep_id != ep_id:
+                self._cutoff_stale -= 1  # 消費済み・登録し直したEP
+                continue
+            if not self.link_store.is_live(link) or link.fidelity >= self.f_cut:
+                # まだpending、または境界ちょうどで丸めにより下回っていない -> 次のtickで見る
+                retry.append(entry)
+                continue
+            log.logger.info(f"{self._simulator.tc} decoherenced link {link.nodes}")
+            link.cutoff_at = None
+            self.decoherence_EP(link)
+        for entry in retry:
+            heapq.heappush(heap, entry)
+
+    def _run_ready_ops(self):
+        # 各リクエストを１操作分進める
+        # このtickの開始までにready_opsに積まれたopだけ実行（実行中にREADYになったものは次のtick）
+        batch: List[Operation] = []
+        for _ in range(len(self.ready_ops)):
+            op = self.ready_ops.popleft()
+            op.queued = False
+            if op.ready_queue is None:
+                continue  # 計画ごと差し替えられた
+            op.sync()
+            # 再生成でEPを失ったなら、兄弟のEPだけが親で待っているかもしれない
+            self._arm_psw(op.parent)
+            if op.status == OpStatus.RETRY:
+                # request_regenされた部分木。子孫のリセットをここで反映し、葉を積ませる
+                op.sync_subtree()
+                continue
+            batch.append(op)
+        # sync_subtreeで積まれた葉は、request_regenの時点で積まれていたのと同じくこのtickで実行する
+        # 積まれた順はsync_subtreeの辿り方で決まるので、実行順は下でまとめて元のopsの順に並べ直す
+        while self.ready_ops:
+            op = self.ready_ops.popleft()
+            op.queued = False
+            self._arm_psw(op.parent)
+            batch.append(op)
+        # READYになった順ではなく、リクエストの順 -> opsリストの順（後行順）に実行する
+        batch.sort(key=self._run_order)
+        for op in batch:
+            op.sync()
+            if op.status != OpStatus.READY or op.ready_queue is None:
+                continue  # 積まれた後に状態が変わった・計画ごと差し替えられた
+            req = op.request
+            if req is None or req.is_done:
+                continue
             log.logger.debug(f"{self._simulator.tc} {op} start op")
             self._run_op(req, op)
 
@@ -376,7 +707,7 @@ class ControllerApp(Application):
 
         # pair = set((op.n1, op.n2))
         # ep_cand: Optional[EP] = None
-        # for link in self.links:
+        # for link in self.link_store.live():
         #     if set(link.nodes) == pair and link.is_free:
         #         ep_cand = link
         #         break
@@ -402,12 +733,15 @@ class ControllerApp(Application):
         assert qc is not None, f"no QC for GEN_LINK: {op.n1.name}-{op.n2.name}"
         if not op.demand_registered:
             self.genlink_queue[qc.name].append(op)
+            self._genlink_active.add(qc.name)
             op.demand_registered = True
         op.status = OpStatus.WAITING
         return qc
 
     def _handle_swap(self, op: Operation, req: Optional[NewRequest] = None):
         # swap
+        for child in op.children:
+            child.sync()
         ep_left = op.children[0].ep
         ep_right = op.children[1].ep
         if ep_left is None or ep_right is None:
@@ -415,9 +749,10 @@ class ControllerApp(Application):
             log.logger.debug(f"{self._simulator.tc} swap missing ep op={op}")
             op.request_regen()
             return
-        if ep_left not in self.links or ep_right not in self.links:
-            if ep_left in self.links_next or ep_right in self.links_next:
-                op.status = OpStatus.READY
+        store = self.link_store
+        if not store.is_live(ep_left) or not store.is_live(ep_right):
+            if store.is_pending(ep_left) or store.is_pending(ep_right):
+                op.set_ready()
                 return
             # 必要なEPがデコヒーレンス等で欠落したら再生成を要求する
             log.logger.debug(f"{self._simulator.tc} swap missing ep op={op}")
@@ -448,12 +783,10 @@ class ControllerApp(Application):
             tc = self._simulator.tc
             delay_slot = self._calc_delay_slots(max(len_left, len_right))
             t_done = tc.__add__(Time(time_slot=delay_slot))
-            event = func_to_event(
-                t=t_done,
-                fn=lambda op=op, fid=new_fid: self._finish_swap(op=op, fidelity=fid),
-                by=self,
-            )
+            event = SwapDoneEvent(t_done, self, op, new_fid)
+            op.set_completion(event)
             self._simulator.add_event(event)
+            self._note_completion(t_done)
             log.logger.debug(
                 f"{self._simulator.tc} swap scheduled op={op} delay_slot={delay_slot}"
             )
@@ -482,17 +815,10 @@ class ControllerApp(Application):
         delay_slot = self._calc_delay_slots(length)
         tc = self._simulator.tc
         t_done = tc.__add__(Time(time_slot=delay_slot))
-        event = func_to_event(
-            t=t_done,
-            fn=lambda op=op,
-            ep=ep_target,
-            fid=new_fid,
-            prob=success_prob: self._finish_purify(  # noqa: E501
-                op=op, ep_target=ep, new_fid=fid, success_prob=prob
-            ),
-            by=self,
-        )
+        event = PurifyDoneEvent(t_done, self, op, ep_target, new_fid, success_prob)
+        op.set_completion(event)
         self._simulator.add_event(event)
+        self._note_completion(t_done)
         log.logger.debug(
             f"{self._simulator.tc} purify scheduled op={op} delay_slot={delay_slot}"
         )
@@ -514,23 +840,29 @@ class ControllerApp(Application):
         if qc is not None:
             qc.use_single_memory()
 
-        link = EP(
-            fidelity=fidelity,
-            nodes=(src, dest),
-            qc=qc,
-            created_at=t,
-            is_free=is_free,
-        )
-        self.links_next.append(link)
+        state: Dict[str, Any] = {
+            "fidelity": fidelity,
+            "nodes": (src, dest),
+            "qc": qc,
+            "created_at": t,
+            "is_free": is_free,
+            "t_mem": self.t_mem,
+            "ep_id": self._ep_next_id,
+            "clock": self.decay_clock,
+        }
+        self._ep_next_id += 1
+        if self._ep_free:
+            link = self._ep_free.pop()
+            link.reinit(**state)
+        else:
+            if self.ep_pool is not None:
+                link = PooledEP(pool=self.ep_pool, **state)
+            else:
+                link = EP(**state)
+        self.link_store.add(link)
+        self._schedule_cutoff(link)
         return link
 
-    def fid_update_EP(self, ep: EP, dt: float):
-        # 時間経過によるフィデリティ更新
-        f = ep.fidelity
-        alpha: float = math.exp(-dt / self.t_mem)
-        f_new: float = 1 / 4 + alpha * (f - 1 / 4)
-        ep.fidelity = f_new
-
     def decoherence_EP(self, ep: EP):
         # デコヒーレンスによってLinkEPが切り捨てられるとき
         owner = ep.owner_op
@@ -538,6 +870,9 @@ class ControllerApp(Application):
             owner.request_regen()
             ep.free_owner(owner)
         self.delete_EP(ep)
+        if owner:
+            # 兄弟のEPだけが親で待つことになったかもしれない（このlink routineのうちに発火し得る）
+            self._arm_psw(owner.parent)
 
     def consume_EP(self, ep: EP):
         # opの実行によってLinkEPが消費されるとき
@@ -547,29 +882,158 @@ class ControllerApp(Application):
         self.delete_EP(ep=ep)
 
     def delete_EP(self, ep: EP):
-        # LinkEPをself.linksから削除、インスタンスも削除
+        # LinkEPをlink_storeから削除、インスタンスも削除
         if ep.qc is not None:
             ep.qc.free_single_memory()
-        if ep in self.links:
-            self.links.remove(ep)
-        elif ep in self.links_next:
-            self.links_next.remove(ep)
-        del ep
+        self.link_store.remove(ep)
+        if isinstance(ep, PooledEP):
+            ep.release()
+        else:
+            self._cancel_cutoff(ep)
+        # 使い回す（古い参照はep_idが変わるので見分けられる）
+        ep.owner_op = None
+        self._ep_free.append(ep)
 
     def _add_next_tick_event(self, fn):
         t_tick = Time(time_slot=1)
         tc = self._simulator.tc
         tn = tc.__add__(t_tick)
-        next_event = func_to_event(t=tn, fn=fn, by=self)
-        self._simulator.add_event(next_event)
+        self._add_phase_event(tn, fn)
+
+    def _add_phase_event(self, t: Time, fn):
+        # gen -> req -> link のフェーズを時刻tに積む
+        # fused_tickでフェーズの実行中なら、積まずに_run_phaseへ返す
+        # ただしt以前にイベントが積まれていれば、ここで積んでキューの中の順を保つ
+        # （あとから積まれる同じ時刻の完了イベントより先に動くように）
+        if self.fused_tick:
+            if self._in_phase and self._can_fuse(t):
+                self._deferred_phase = (t, fn)
+                return
+            fn = self._phase_runner(fn)
+        self._simulator.add_event(PhaseEvent(t, self, fn))
 
-    def _calc_gen_interval_slot(self) -> int:
-        if self.gen_rate <= 0:
+    def _can_fuse(self, t: Time) -> bool:
+        # 時刻tまでに取り出されるイベントが無ければ、tのフェーズはイベントを積まずに続けられる
+        if t > self._simulator.te:
+            return False
+        t_next = peek_time(self._simulator.event_pool)
+        return t_next is None or t < t_next
+
+    def _phase_runner(self, fn):
+        return lambda: self._run_phase(fn)
+
+    def _run_phase(self, fn):
+        # fused_tick: fnを実行し、続くフェーズを積まなかったなら、時刻を進めてこのまま続ける
+        # 積むかどうかは_add_phase_eventで決まっている
+        pool = self._simulator.event_pool
+        while True:
+            self._deferred_phase = None
+            self._in_phase = True
+            try:
+                fn()
+            finally:
+                self._in_phase = False
+            deferred = self._deferred_phase
+            self._deferred_phase = None
+            if deferred is None or self.all_done:
+                return
+            t, fn = deferred
+            t_next = peek_time(pool)
+            if t_next is not None and t_next < t:
+                # 決めた後でtより前のイベントが積まれた（完了は1スロット以上先なので起きないはず）
+                self._simulator.add_event(PhaseEvent(t, self, self._phase_runner(fn)))
+                return
+            pool.tc = t  # 次のイベントを取り出したときと同じく時刻を進める
+            self.fused_phases += 1
+
+    def _note_completion(self, t_done: Time):
+        # 完了イベントのスロットを覚えておく（skip_idleのときだけ）
+        if self.skip_idle:
+            heapq.heappush(self._completion_slots, t_done.time_slot)
+
+    def _schedule_next_cycle(self):
+        # skip_idle: 次にgen_EP_routineを動かす周期まで飛ばす
+        nxt = self._simulator.tc.time_slot + 1
+        wake = self._next_wake_slot(nxt)
+        if wake is None:
+            return  # もう何も起きない
+        if wake > nxt:
+            self._catch_up_gen_slot(nxt, wake)
+            self.skipped_ticks += wake - nxt
+        self._add_phase_event(
+            self._simulator.time(time_slot=wake), self.gen_EP_routine
+        )
+
+    def _next_wake_slot(self, nxt: int) -> Optional[int]:
+        # nxt（次の周期の先頭）以降で、何かが変わり得る最初の周期の先頭スロット
+        # 飛ばさなければ同じスロットで同じ処理が起きるよう、完了イベントや切り捨て時刻はその前の周期から動かす
+        if (
+            self.ready_ops
+            or self.pending_plans
+            or self._psw_released
+            or self.link_store.has_pending()
+        ):
+            return nxt
+        wake = math.inf
+        # 生成要求があれば、次の生成スロット以降の最初の周期
+        if any(self.genlink_queue[name] for name in self._genlink_active):
+            wake = self._cycle_at_or_after(self._next_gen_time_slot, nxt)
+        # swap/purifyの完了イベント（この周期のreqスロットのものはrequest_handler_routineの後に
+        # 起きたかもしれないので、次の周期で拾う）
+        slots = self._completion_slots
+        while slots and slots[0] < nxt - 2:
+            heapq.heappop(slots)
+        if slots:
+            wake = min(wake, self._cycle_at_or_before(slots[0], nxt))
+        # f_cut・psw_thresholdを下回る時刻（links_manager_routineのスロットで判定される）
+        times: List[float] = []
+        if self.ep_pool is not None:
+            times.append(self.ep_pool.next_crossing(self.f_cut))
+        elif self._cutoff_heap:
+            times.append(self._cutoff_heap[0][0])
+        if self._psw_heap:
+            times.append(self._psw_heap[0][0])
+        for t in times:
+            if not math.isinf(t):
+                # 下回る時刻はlinks_manager_routineのスロットちょうど
+                slot = round(t * self._simulator.accuracy) - (CYCLE_SLOTS - 1)
+                wake = min(wake, self._cycle_at_or_before(slot, nxt))
+        if math.isinf(wake):
+            return None
+        return int(wake)
+
+    @staticmethod
+    def _cycle_at_or_after(slot: int, nxt: int) -> int:
+        if slot <= nxt:
+            return nxt
+        return nxt + -(-(slot - nxt) // CYCLE_SLOTS) * CYCLE_SLOTS
+
+    @staticmethod
+    def _cycle_at_or_before(slot: int, nxt: int) -> int:
+        if slot <= nxt:
+            return nxt
+        return nxt + (slot - nxt) // CYCLE_SLOTS * CYCLE_SLOTS
+
+    def _catch_up_gen_slot(self, first: int, stop: int):
+        # 飛ばした周期でもgen_EP_routineは_next_gen_time_slotを進めていた（生成要求が無いので生成はしない）
+        assert self._next_gen_time_slot is not None
+        cycle = first
+        while cycle < stop:
+            if cycle < self._next_gen_time_slot:
+                cycle = self._cycle_at_or_after(self._next_gen_time_slot, cycle)
+                continue
+            self._next_gen_time_slot += self.gen_interval_slot
+            cycle += CYCLE_SLOTS
+
+    def _calc_gen_interval_slot(self, gen_rate: Optional[float] = None) -> int:
+        if gen_rate is None:
+            gen_rate = self.gen_rate
+        if gen_rate <= 0:
             log.logger.debug(
                 "gen_rateが0以下のため、生成間隔をデフォルト1タイムスロットに設定します"
             )
             return 1
-        t = 1 / self.gen_rate
+        t = 1 / gen_rate
         interval = Time(sec=t, accuracy=self._simulator.accuracy)
         if interval.time_slot <= 0:
             return 1
@@ -589,14 +1053,20 @@ class ControllerApp(Application):
 
     def _psw_waiting_ep(self, op: Operation) -> Optional[EP]:
         """PSW対象のopが「片側だけEPありで待機中」なら、そのEPを返す。"""
+        # syncはせずに読む（リセットを反映すると、葉がrequest_regenのときと違う順でready_opsに積まれる）
+        # まだ反映していない無効化があれば、リセット後と同じくEPは無い
+        if op.is_stale():
+            return None
         if op.type == OpType.GEN_LINK:
             return op.ep
         if op.type == OpType.SWAP:
             if len(op.children) < 2:
                 return None
-            ep_left = op.children[0].ep
-            ep_right = op.children[1].ep
-            eps = [ep for ep in (ep_left, ep_right) if ep is not None]
+            eps = [
+                child.ep
+                for child in op.children[:2]
+                if child.ep is not None and not child.is_stale()
+            ]
             return eps[0] if len(eps) == 1 else None
         if op.type == OpType.PURIFY:
             if len(op.pur_eps) < 2:
@@ -609,62 +1079,92 @@ class ControllerApp(Application):
         """PSW対象になり得る待機中かどうか。"""
         return self._psw_waiting_ep(op) is not None
 
-    def _scan_psw_targets(self):
+    def _arm_psw(self, *ops: Optional[Operation]):
+        # 片側待ちになったopについて、待っているEPがpsw_thresholdを下回る時刻に発火を予約する
+        # 呼ぶ場所: opかその子がEPを得たとき、子が再生成されたとき、PSWが片付いたとき
         if not self.enable_psw or self.psw_threshold is None:
             return
-        for req in self.requests:
-            if getattr(req, "is_psw", False):
+        now = self._simulator.tc.sec
+        for op in ops:
+            if op is None or op.threshold_purified:
                 continue
-            if req.swap_plan is None:
+            waiting_ep = self._psw_waiting_ep(op)
+            if waiting_ep is None:
                 continue
-            _, ops = req.swap_plan
-            for op in ops:
-                if op.threshold_purified:
-                    continue
-                waiting_ep = self._psw_waiting_ep(op)
-                if waiting_ep is None:
-                    continue
-                if waiting_ep.fidelity >= self.psw_threshold:
-                    continue
-                if self._has_pending_psw(op):
-                    continue
-                parent_type = op.parent.type.name if op.parent is not None else "NONE"
-                log.logger.info(
-                    f"{self._simulator.tc} PSW target found op={op} parent={parent_type} fid={waiting_ep.fidelity:.3f} threshold={self.psw_threshold}"  # noqa: E501
-                )
-                self._schedule_psw_op(target_op=op)
+            t_cross = max(waiting_ep.crossing_time(self.psw_threshold), now)
+            if math.isinf(t_cross) or self._psw_armed.get(op) == t_cross:
+                continue
+            self._psw_armed[op] = t_cross
+            self._psw_seq += 1
+            heapq.heappush(self._psw_heap, (t_cross, self._psw_seq, op))
+
+    def _trigger_psw(self):
+        # 予約時刻を過ぎたopだけ、以前の全op走査と同じ条件を確かめてPSWを始める
+        # 走査していたときと同じく、リクエストの順 -> opsリストの順に確かめる
+        now = self._simulator.tc.sec
+        heap = self._psw_heap
+        due: List[Operation] = []
+        while heap and heap[0][0] <= now:
+            t_cross, _, op = heapq.heappop(heap)
+            if self._psw_armed.get(op) != t_cross:
+                continue  # 登録し直した古い項目
+            del self._psw_armed[op]
+            due.append(op)
+        if not due:
+            return
+        due.sort(key=self._run_order)
+        rearm: List[Operation] = []
+        for op in due:
+            req = op.request
+            if req is None or getattr(req, "is_psw", False) or op.ready_queue is None:
+                continue  # PSWのop、差し替えられた計画のop
+            if op.threshold_purified:
+                continue
+            waiting_ep = self._psw_waiting_ep(op)
+            if waiting_ep is None:
+                continue  # 兄弟が揃った・EPを失った
+            if waiting_ep.fidelity >= self.psw_threshold:
+                rearm.append(op)  # 待っているEPが入れ替わった
+                continue
+            if self._has_pending_psw(op):
+                continue  # 片付いたときに予約し直す
+            parent_type = op.parent.type.name if op.parent is not None else "NONE"
+            log.logger.info(
+                f"{self._simulator.tc} PSW target found op={op} parent={parent_type} fid={waiting_ep.fidelity:.3f} threshold={self.psw_threshold}"  # noqa: E501
+            )
+            self._schedule_psw_op(target_op=op)
+        self._arm_psw(*rearm)
 
     def _has_pending_psw(self, target_op: Operation) -> bool:
         return any(
             meta.get("target") is target_op for meta in self.psw_op_target.values()
         )
 
-    def _clone_psw_tree(self, op: Operation) -> List[Operation]:
-        ops: List[Operation] = []
-
-        def _clone(node: Operation, parent: Optional[Operation] = None) -> Operation:
-            status = (
-                OpStatus.READY if node.type == OpType.GEN_LINK else OpStatus.WAITING
-            )
-            clone = Operation(
-                name=f"PSW_{node.name}",
-                type=node.type,
-                n1=node.n1,
-                n2=node.n2,
-                via=node.via,
-                status=status,
-                parent=parent,
-                children=[],
-                request=node.request,
-            )
-            ops.append(clone)
-            for child in node.children:
-                child_clone = _clone(child, parent=clone)
-                clone.children.append(child_clone)
-            return clone
-
-        _clone(op)
-        return ops
+    def _psw_template(self, op: Operation) -> OpTemplate:
+        # opの部分木の雛形（ターゲットごとに1回だけ作る）
+        # 完了したリクエストのop（全op走査のころから対象になり得た）は覚えておかない
+        template = self.psw_templates.get(op)
+        if template is None:
+            template = OpTemplate.from_op(op, prefix="PSW_")
+            if op.request is None or not op.request.is_done:
+                self.psw_templates[op] = template
+        return template
+
+    def _release_psw_tree(self, template: OpTemplate, ops: List[Operation]):
+        # もうどこからも参照されていなければ雛形のfree listに返す（そうでなければGCに任せる）
+        tree = ops[: len(template)]
+        for op in tree:
+            op.sync()
+            if op.ep is not None or op.pur_eps:
+                return
+            if op.type == OpType.GEN_LINK:
+                qc = self._find_qc_by_nodes(op.n1, op.n2)
+                if qc is not None and op in self.genlink_queue[qc.name]:
+                    return
+            # 再生成で持ち主のopから外れたEPも、owner_opは残っている
+            if self.link_store.owned_by(op, op.n1, op.n2) is not None:
+                return
+        template.release(tree)
 
     def _register_psw_group(
         self,
@@ -674,8 +1174,13 @@ class ControllerApp(Application):
         target_op: Operation,
         role: str,
         psw_req: PSWRequest,
+        template: Optional[OpTemplate] = None,
     ) -> None:
-        self.psw_groups[root_op] = {"ops": ops, "request": psw_req}
+        self.psw_groups[root_op] = {
+            "ops": ops,
+            "request": psw_req,
+            "template": template,
+        }
         self.psw_op_target[root_op] = {
             "target": target_op,
             "role": role,
@@ -686,24 +1191,39 @@ class ControllerApp(Application):
         info = self.psw_groups.pop(root_op, {})
         ops = info.get("ops", [])
         psw_req: PSWRequest | None = info.get("request")
+        targets: List[Operation] = []
         for op in ops:
-            self.psw_op_target.pop(op, None)
+            meta = self.psw_op_target.pop(op, None)
+            if meta is not None and meta.get("target") is not None:
+                targets.append(meta["target"])
+        groups = [info]
         # 同じPSWリクエストを指す他のグループもまとめて掃除
         if psw_req:
             for key, val in list(self.psw_groups.items()):
                 if val.get("request") is psw_req:
                     self.psw_groups.pop(key, None)
+                    groups.append(val)
                     for op in val.get("ops", []):
-                        self.psw_op_target.pop(op, None)
+                        meta = self.psw_op_target.pop(op, None)
+                        if meta is not None and meta.get("target") is not None:
+                            targets.append(meta["target"])
         if psw_req:
             psw_req.is_done = True
             if psw_req in self.requests:
                 self.requests.remove(psw_req)
+        for group in groups:
+            template = group.get("template")
+            if template is not None:
+                self._psw_released.append((template, group["ops"]))
+        # threshold_purifiedが立っていないターゲットはまた対象になり得る
+        self._arm_psw(*targets)
 
     def _schedule_psw_op(self, target_op: Operation):
         target_op.threshold_purified = True  # 今回の待ち時間では1回だけ
-        ops = self._clone_psw_tree(target_op)
-        root_op = ops[0]
+        template = self._psw_template(target_op)
+        if template.free:
+            self.psw_trees_reused += 1
+        root_op, ops = template.instantiate()
         psw_req = PSWRequest(
             name=f"PSW_{target_op.name}",
             swap_plan=(root_op, ops),
@@ -711,7 +1231,8 @@ class ControllerApp(Application):
         )
         for op in ops:
             op.request = psw_req
-        self.requests.append(psw_req)
+        self._add_request(psw_req)
+        self._attach_ops(ops)
         log.logger.info(
             f"{self._simulator.tc} PSW schedule target={target_op} root={root_op}"
         )
@@ -721,6 +1242,7 @@ class ControllerApp(Application):
             target_op=target_op,
             role="sacrificial",
             psw_req=psw_req,
+            template=template,
         )
         self.psw_gen_link_scheduled += 1
 
@@ -741,6 +1263,7 @@ class ControllerApp(Application):
                 self.consume_EP(sacrificial_ep)
             target_op.threshold_purified = False
             self.psw_cancelled += 1
+            self._arm_psw(target_op, target_op.parent)
             return
         log.logger.info(
             f"{self._simulator.tc} PSW purify start target={target_op} target_fid={target_ep.fidelity:.3f} sacrificial_fid={sacrificial_ep.fidelity:.3f}"  # noqa: E501
@@ -767,11 +1290,13 @@ class ControllerApp(Application):
                 swap_plan=(purify_op, [purify_op]),
                 target_op=target_op,
             )
-            self.requests.append(psw_req)
+            self._add_request(psw_req)
         purify_op.request = psw_req
+        purify_op.attach_ready_queue(self.ready_ops)
         group_info = self.psw_groups.get(sacrificial_op)
         if group_info:
             group_ops = group_info.get("ops", [])
+            purify_op.order = len(group_ops)  # PSWリクエストのopsの末尾
             group_ops.append(purify_op)
             group_info["ops"] = group_ops
         self.psw_groups[purify_op] = {"ops": [purify_op], "request": psw_req}
@@ -793,16 +1318,19 @@ class ControllerApp(Application):
         slots = math.ceil(delay_sec * self._simulator.accuracy)
         return max(1, slots)
 
-    def _finish_swap(self, op: Operation, fidelity: float):
-        if op.status != OpStatus.RUNNING:
+    def _finish_swap(self, event: SwapDoneEvent):
+        # 再生成・使い回しで取り消された（古くなった）完了イベントなら何もしない
+        op = event.op
+        if not op.take_completion(event):
             return
         tc = self._simulator.tc
-        new_ep = self.gen_single_EP(op.n1, op.n2, fidelity=fidelity, t=tc)
+        new_ep = self.gen_single_EP(op.n1, op.n2, fidelity=event.fidelity, t=tc)
         if new_ep is None:
             op.request_regen()
             return
         new_ep.set_owner(op)
         op.done()
+        self._arm_psw(op, op.parent)
         log.logger.debug(f"{self._simulator.tc} swap success op={op}")
         meta = self.psw_op_target.get(op)
         if meta is not None and meta.get("role") == "sacrificial":
@@ -814,13 +1342,14 @@ class ControllerApp(Application):
             if target is not None:
                 self._on_psw_sacrificial_ready(sacrificial_op=op, target_op=target)
 
-    def _finish_purify(
-        self, op: Operation, ep_target: EP, new_fid: float, success_prob: float
-    ):
-        if op.status != OpStatus.RUNNING:
+    def _finish_purify(self, event: PurifyDoneEvent):
+        op = event.op
+        if not op.take_completion(event):
             return
-        # target EPが既に消えていたら再生成要求
-        if ep_target not in self.links:
+        ep_target = event.ep_target
+        new_fid = event.new_fid
+        # target EPが既に消えていたら再生成要求（使い回されていればep_idが違う）
+        if not self.link_store.is_live(ep_target) or ep_target.ep_id != event.ep_id:
             meta = self.psw_op_target.get(op)
             if meta is not None and meta.get("role") == "purify":
                 target = meta.get("target")
@@ -832,19 +1361,22 @@ class ControllerApp(Application):
             op.request_regen()
             return
 
-        success = random.random() < success_prob
+        success = random.random() < event.success_prob
         if success:
             log.logger.debug(f"{self._simulator.tc} purify success op={op}")
             ep_target.fidelity = new_fid  # fidelity更新
+            self._schedule_cutoff(ep_target)  # 切り捨て時刻も測り直す
             meta = self.psw_op_target.get(op)
             if meta is not None and meta.get("role") == "purify":
                 self.psw_purify_success += 1
                 target = meta.get("target")
                 if target is not None:
+                    target.sync()
                     if ep_target.owner_op is op:
                         ep_target.change_owner(pre_owner=op, new_owner=target)
                     target.ep = ep_target
                     target.threshold_purified = True
+                    self._arm_psw(target.parent)
                 self._cleanup_psw_group(op)
                 log.logger.info(
                     f"{self._simulator.tc} PSW purify success op={op} target={target}"
@@ -856,6 +1388,7 @@ class ControllerApp(Application):
                     pre = op.children[0]
                     ep_target.change_owner(pre_owner=pre, new_owner=op)
                 op.done()
+                self._arm_psw(op, op.parent)
                 self._cleanup_psw_group(op)
                 if target is not None:
                     self._on_psw_sacrificial_ready(sacrificial_op=op, target_op=target)
@@ -864,6 +1397,11 @@ class ControllerApp(Application):
                     pre = op.children[0]
                     ep_target.change_owner(pre_owner=pre, new_owner=op)
                 op.done()
+                self._arm_psw(op, op.parent)
+            # fidelityを代入すると減衰の起点が変わるので、EPを持つopの発火時刻も測り直す
+            owner = ep_target.owner_op
+            if owner is not None:
+                self._arm_psw(owner, owner.parent)
         else:
             log.logger.debug(f"{self._simulator.tc} purify failed op={op}")
             self.consume_EP(ep_target)
@@ -0,0 +1,118 @@
+# calendar_pool.py
+# 整数タイムスロット用のイベントプール（calendar queue）
+# 近いスロット（現在からhorizonスロット先まで）はスロットごとのdequeの輪に入れ、挿入・取り出しはO(1)
+# それより先のイベントはヒープに置き、時刻が近づいたら輪に移す。同じスロットのイベントは挿入順に取り出す
+# Simulator(pool_cls=CalendarEventPool)で使う（exp2の設定では event_pool: calendar）
+
+import heapq
+from collections import deque
+from typing import Deque, Dict, List, Optional, Tuple, Type
+
+from qns.simulator.event import Event
+from qns.simulator.pool import DefaultEventPool
+from qns.simulator.ts import Time
+
+DEFAULT_HORIZON = 64
+
+
+class CalendarEventPool(DefaultEventPool):
+    """
+    DefaultEventPoolと同じ使い方のイベントプール
+    - _ring[slot % horizon]: スロットslotのイベント（_cursor <= slot < _cursor + horizon のもの）
+    - _far: それより先のイベントの (slot, 挿入順, event) のヒープ
+    - _cursor: 次に見るスロット（取り出したイベントのスロットまでしか進めない）
+    event_listは使わないので、先頭の確認と全消しはpeek_time / clearで行う
+    """
+
+    def __init__(self, ts: Time, te: Time, horizon: int = DEFAULT_HORIZON):
+        super().__init__(ts, te)
+        if horizon <= 0:
+            raise ValueError(f"horizon must be positive: {horizon}")
+        self.horizon = horizon
+        self._ring: List[Deque[Event]] = [deque() for _ in range(horizon)]
+        self._near = 0  # _ringに入っているイベント数
+        self._far: List[Tuple[int, int, Event]] = []
+        self._seq = 0
+        self._cursor = ts.time_slot
+
+    def __len__(self) -> int:
+        return self._near + len(self._far)
+
+    def add_event(self, event: Event) -> bool:
+        if event.t < self.tc or event.t > self.te:
+            return False
+        slot = event.t.time_slot
+        if slot < self._cursor + self.horizon:
+            self._ring[slot % self.horizon].append(event)
+            self._near += 1
+        else:
+            self._seq += 1
+            heapq.heappush(self._far, (slot, self._seq, event))
+        return True
+
+    def next_event(self) -> Optional[Event]:
+        while self._near or self._far:
+            if not self._near:
+                # 輪が空なら、先のイベントのスロットまで一気に進める
+                self._advance(self._far[0][0])
+                continue
+            bucket = self._ring[self._cursor % self.horizon]
+            if bucket:
+                event = bucket.popleft()
+                self._near -= 1
+                self.tc = event.t
+                return event
+            self._advance(self._cursor + 1)
+        self.tc = self.te
+        return None
+
+    def _advance(self, slot: int):
+        # _cursorをslotに進め、輪に入る範囲になった先のイベントを移す
+        # 移す先は進める前のスロットの（空になった）dequeなので、同じスロット内の挿入順は保たれる
+        self._cursor = slot
+        limit = slot + self.horizon
+        far = self._far
+        while far and far[0][0] < limit:
+            s, _, event = heapq.heappop(far)
+            self._ring[s % self.horizon].append(event)
+            self._near += 1
+
+    def peek_time(self) -> Optional[Time]:
+        # 次に取り出されるイベントの時刻（無ければNone）。状態は変えない
+        if self._near:
+            for slot in range(self._cursor, self._cursor + self.horizon):
+                bucket = self._ring[slot % self.horizon]
+                if bucket:
+                    return bucket[0].t
+        if self._far:
+            return self._far[0][2].t
+        return None
+
+    def clear(self):
+        # 積まれているイベントを全部捨てる（シミュレーションの打ち切り）
+        for bucket in self._ring:
+            bucket.clear()
+        self._near = 0
+        self._far.clear()
+
+
+# exp2の設定（event_pool）で選べるプール
+EVENT_POOLS: Dict[str, Type[DefaultEventPool]] = {
+    "heap": DefaultEventPool,
+    "calendar": CalendarEventPool,
+}
+
+
+def peek_time(pool: DefaultEventPool) -> Optional[Time]:
+    """poolで次に取り出されるイベントの時刻。DefaultEventPoolはevent_listの先頭を見る"""
+    if isinstance(pool, CalendarEventPool):
+        return pool.peek_time()
+    return pool.event_list[0].t if pool.event_list else None
+
+
+def clear_events(pool: DefaultEventPool):
+    """poolに積まれているイベントを全部捨てる"""
+    if isinstance(pool, CalendarEventPool):
+        pool.clear()
+    else:
+        pool.event_list.clear()
@@ -1,4 +1,5 @@
 # link.py
+import math
 import uuid
 from typing import TYPE_CHECKING, Optional, Tuple
 
@@ -10,13 +11,71 @@ from edp.sim.models import f_link
 from edp.sim.new_qchannel import NewQC
 
 if TYPE_CHECKING:
+    from qns.simulator.simulator import Simulator
+
     from edp.sim.op import Operation
 
 
+class DecayClock:
+    """
+    EPの減衰の刻み（links_manager_routineの実行回数）を数える時計
+    links_manager_routineは first_slot から periodスロットごとに動き、そのたびに全EPが
+    periodスロット分（step_sec）まとめて減衰する。回数はスロットから数えるので、skip_idleで
+    飛ばした周期の分も数える。同じスロットのイベントは、そのスロットのtick()の後なら減衰後の値を読む
+    """
+
+    __slots__ = ("_simulator", "first_slot", "period", "step_sec", "_ran_slot")
+
+    def __init__(self, period: int):
+        self.period = period
+        self._simulator: Optional["Simulator"] = None
+        self.first_slot: int = 0
+        self.step_sec: float = 0.0
+        self._ran_slot: Optional[int] = None
+
+    def install(self, simulator: "Simulator", first_slot: int):
+        # first_slot: 最初のlinks_manager_routineのスロット
+        self._simulator = simulator
+        self.first_slot = first_slot
+        self.step_sec = simulator.time(time_slot=self.period).sec
+        self._ran_slot = None
+
+    def tick(self):
+        # links_manager_routineの先頭で呼ぶ（このスロットの減衰が済んだ印）
+        assert self._simulator is not None
+        self._ran_slot = self._simulator.tc.time_slot
+
+    def steps(self) -> int:
+        # 今までの減衰の回数
+        if self._simulator is None:
+            return 0
+        slot = self._simulator.tc.time_slot
+        n = slot - self.first_slot
+        if n < 0:
+            return 0
+        k = -(-n // self.period)  # first_slot <= (実行スロット) < slot の回数
+        if n % self.period == 0 and self._ran_slot == slot:
+            k += 1
+        return k
+
+    def time_of_step(self, k: int) -> float:
+        # k回目（1始まり）の減衰が起きる時刻[s]
+        assert self._simulator is not None
+        return self._simulator.time(
+            time_slot=self.first_slot + self.period * (k - 1)
+        ).sec
+
+
 class EP(Entity):
     """
     １つの link = bell pair を記述するクラス リンクレベルのリンクとは違う意味なのでややこしい
-    name(uuid), fidelity, nodes, qc, created_at, is_used, swap_level
+    name, ep_id, fidelity, nodes, qc, created_at, is_used, swap_level
+    nameは読まれたときに作る。ep_idがあれば "EP<ep_id>"、なければuuid
+    fidelityは (fidelity_init, step_created) からWernerの減衰の閉じた式で読むたびに計算する
+    1/4 + exp(-k * step_sec / t_mem) * (fidelity_init - 1/4)
+    kはstep_createdから後の減衰の回数（clock.steps() - step_created）。links_manager_routineのたびに
+    周期分ずつ減衰させていたときと同じ値になる。t_memかclockがNoneなら減衰しない
+    代入すると、その時点を起点に数え直す（purify成功時など）
     """
 
     def __init__(
@@ -30,9 +89,49 @@ class EP(Entity):
         owner_op: Optional["Operation"] = None,
         swap_level: int = 0,  # 何回のswapでできているか ここ０ならリンクレベルEP 未実装
         use_node_memory: bool = True,  # ノードメモリを消費するかどうか
+        t_mem: Optional[float] = None,  # コヒーレンス時間[s] Noneなら減衰しない
+        ep_id: Optional[int] = None,  # コントローラが振る通し番号
+        clock: Optional[DecayClock] = None,  # 減衰の回数を数える時計
+    ):
+        super().__init__(name=None)
+        self.reinit(
+            nodes=nodes,
+            fidelity=fidelity,
+            qc=qc,
+            created_at=created_at,
+            is_free=is_free,
+            owner_op=owner_op,
+            swap_level=swap_level,
+            use_node_memory=use_node_memory,
+            t_mem=t_mem,
+            ep_id=ep_id,
+            clock=clock,
+        )
+        if name is not None:
+            self.name = name
+
+    def reinit(
+        self,
+        nodes: Tuple[QNode, QNode],
+        fidelity: float = 0,
+        qc: Optional[NewQC] = None,
+        created_at: Optional[Time] = None,
+        is_free: bool = True,
+        owner_op: Optional["Operation"] = None,
+        swap_level: int = 0,
+        use_node_memory: bool = True,
+        t_mem: Optional[float] = None,
+        ep_id: Optional[int] = None,
+        clock: Optional[DecayClock] = None,
     ):
-        super().__init__(name=name or str(uuid.uuid4()))
-        self.fidelity = fidelity
+        # 初期化（delete_EP後にfree listから使い回すときもここ）
+        self._name = None  # 次に読まれたときにep_idから作る
+        self.ep_id = ep_id
+        self.t_mem = t_mem
+        self.clock = clock
+        self.fidelity_init: float = fidelity
+        self.step_created: int = clock.steps() if clock is not None else 0
+        self.cutoff_at: Optional[float] = None  # コントローラが登録した切り捨て時刻[s]
         self.nodes = nodes
         self.qc = qc
         self.created_at = created_at
@@ -41,6 +140,61 @@ class EP(Entity):
         self.swap_level = swap_level
         self.use_node_memory = use_node_memory
 
+    @property
+    def name(self) -> str:
+        if self._name is None:
+            self._name = (
+                f"EP{self.ep_id}" if self.ep_id is not None else str(uuid.uuid4())
+            )
+        return self._name
+
+    @name.setter
+    def name(self, name: Optional[str]):
+        self._name = name
+
+    @property
+    def fidelity(self) -> float:
+        if self.t_mem is None or self.clock is None:
+            return self.fidelity_init
+        return self._decayed(self.clock.steps() - self.step_created)
+
+    @fidelity.setter
+    def fidelity(self, f: float):
+        # 今の時点を起点にする
+        self.fidelity_init = f
+        if self.clock is not None:
+            self.step_created = self.clock.steps()
+
+    def _decayed(self, k: int) -> float:
+        # k回減衰した後のフィデリティ
+        if k <= 0:
+            return self.fidelity_init
+        assert self.clock is not None and self.t_mem is not None
+        return 0.25 + math.exp(-k * self.clock.step_sec / self.t_mem) * (
+            self.fidelity_init - 0.25
+        )
+
+    def crossing_time(self, f: float) -> float:
+        # fidelityがfを下回る減衰（links_manager_routine）の時刻[s]（減衰しなければinf）
+        # 初めから下回っていれば次の減衰の時刻
+        clock = self.clock
+        if clock is None:
+            return math.inf
+        if self.fidelity_init < f:
+            k = 1
+        elif self.t_mem is None or f <= 0.25:
+            return math.inf
+        else:
+            # exp(-k * step_sec / t_mem) < (f - 1/4) / (fidelity_init - 1/4) となる最小のk
+            x = self.t_mem * math.log((self.fidelity_init - 0.25) / (f - 0.25))
+            k = max(1, math.floor(x / clock.step_sec) + 1)
+            # 丸めの誤差をfidelityと同じ式で直す
+            while self._decayed(k) >= f:
+                k += 1
+            while k > 1 and self._decayed(k - 1) < f:
+                k -= 1
+        return clock.time_of_step(self.step_created + k)
+
     def change_owner(self, pre_owner: "Operation", new_owner: "Operation"):
         # controller.linksで追跡したまま(deepcopyすることなく)所有者(op)を変えたい
         # owner変えて、opも変える
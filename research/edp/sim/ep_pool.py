@@ -0,0 +1,190 @@
+# ep_pool.py
+# EPの状態をNumPy配列で持つプール（structure of arrays）
+# fidelity_init, step_created, t_mem, is_free を列ごとの配列に置き、PooledEPは配列の1行を指す窓口になる
+# f_cutを下回ったEPの判定を、全EPまとめて1回のベクトル演算で行える（ControllerApp(ep_pool="numpy")で選択）
+
+import math
+from typing import Any, List, Optional
+
+import numpy as np
+
+from edp.sim.ep import EP, DecayClock
+
+INITIAL_CAPACITY = 256
+NEVER = np.iinfo(np.int64).max  # 下回らないEPの減衰の回数
+
+
+class EPPool:
+    """
+    行 = 1つのEP。空いた行はfree listで使い回し、足りなくなったら配列を2倍にする
+    - f0, s0: 減衰の起点のフィデリティと減衰の回数（EP.fidelity_init, EP.step_created）
+    - t_mem: コヒーレンス時間[s]（減衰しないEPはinf）
+    - is_free: 持ち主のopがいないか
+    - used: 行が使われているか
+    clock: EPと同じ減衰の時計（フィデリティは clock.steps() - s0 回の減衰で計算する）
+    """
+
+    def __init__(self, clock: DecayClock, capacity: int = INITIAL_CAPACITY):
+        self.clock = clock
+        self.f0 = np.zeros(capacity)
+        self.s0 = np.zeros(capacity, dtype=np.int64)
+        self.t_mem = np.full(capacity, np.inf)
+        self.is_free = np.ones(capacity, dtype=bool)
+        self.used = np.zeros(capacity, dtype=bool)
+        self.eps: List[Optional[EP]] = [None] * capacity
+        self._free_rows: List[int] = list(range(capacity - 1, -1, -1))
+
+    def __len__(self) -> int:
+        return len(self.eps) - len(self._free_rows)
+
+    @property
+    def capacity(self) -> int:
+        return len(self.eps)
+
+    def alloc(self, ep: EP) -> int:
+        if not self._free_rows:
+            self._grow()
+        row = self._free_rows.pop()
+        self.used[row] = True
+        self.eps[row] = ep
+        return row
+
+    def free(self, row: int):
+        self.used[row] = False
+        self.eps[row] = None
+        self._free_rows.append(row)
+
+    def _grow(self):
+        old = self.capacity
+        new = old * 2
+        self.f0 = np.concatenate([self.f0, np.zeros(old)])
+        self.s0 = np.concatenate([self.s0, np.zeros(old, dtype=np.int64)])
+        self.t_mem = np.concatenate([self.t_mem, np.full(old, np.inf)])
+        self.is_free = np.concatenate([self.is_free, np.ones(old, dtype=bool)])
+        self.used = np.concatenate([self.used, np.zeros(old, dtype=bool)])
+        self.eps.extend([None] * old)
+        self._free_rows.extend(range(new - 1, old - 1, -1))
+
+    def _decayed(self, k: np.ndarray, rows: Any = slice(None)) -> np.ndarray:
+        # rowsの各EPがk回減衰した後のフィデリティ（EP._decayedと同じ式）
+        k = np.maximum(k, 0)
+        return 0.25 + np.exp(-k * self.clock.step_sec / self.t_mem[rows]) * (
+            self.f0[rows] - 0.25
+        )
+
+    def fidelities(self) -> np.ndarray:
+        # 全行の今のフィデリティ（使っていない行の値は意味なし）
+        return self._decayed(self.clock.steps() - self.s0)
+
+    def _crossing_steps(self, rows: np.ndarray, f: float) -> np.ndarray:
+        # rowsの各EPのフィデリティがfを下回る減衰の回数（時計の通し番号、届かなければNEVER）
+        # EP.crossing_timeと同じく、初めから下回っていれば次の減衰
+        f0 = self.f0[rows]
+        below = f0 < f
+        k = np.ones(len(rows), dtype=np.int64)
+        if f > 0.25:
+            t_mem = self.t_mem[rows]
+            with np.errstate(divide="ignore", invalid="ignore"):
+                x = t_mem * np.log((f0 - 0.25) / (f - 0.25)) / self.clock.step_sec
+            decays = ~below & np.isfinite(x)
+            k[decays] = np.maximum(1, np.floor(x[decays]).astype(np.int64) + 1)
+            # 丸めの誤差をfidelitiesと同じ式で直す
+            k = np.where(decays & (self._decayed(k, rows) >= f), k + 1, k)
+            k = np.where(decays & (k > 1) & (self._decayed(k - 1, rows) < f), k - 1, k)
+            reach = below | decays
+        else:
+            reach = below
+        return np.where(reach, self.s0[rows] + k, NEVER)
+
+    def next_crossing(self, f: float) -> float:
+        # 使っている行のうち、フィデリティがfを下回る最も早い減衰の時刻[s]（無ければinf）
+        rows = np.flatnonzero(self.used)
+        if len(rows) == 0:
+            return math.inf
+        step = int(self._crossing_steps(rows, f).min())
+        if step == NEVER:
+            return math.inf
+        return self.clock.time_of_step(step)
+
+    def below(self, f: float) -> List[EP]:
+        # 今のフィデリティがf未満のEP
+        # 下回った減衰の順 -> ep_idの順（EPごとの切り捨てヒープから取り出す順と同じ）
+        rows = np.flatnonzero(self.used & (self.fidelities() < f))
+        if len(rows) > 1:
+            ep_ids = np.array([self.eps[row].ep_id for row in rows])
+            rows = rows[np.lexsort((ep_ids, self._crossing_steps(rows, f)))]
+        return [self.eps[row] for row in rows]
+
+
+class PooledEP(EP):
+    """
+    状態をEPPoolの1行に置くEP。使い方はEPと同じ
+    release後（削除後）は最後の値を自分で持つので、消費した直後のfidelityの読み出しもそのまま使える
+    """
+
+    _COLUMNS = ("f0", "s0", "t_mem", "is_free")
+
+    def __init__(self, pool: EPPool, **kwargs):
+        self._pool = pool
+        self._row: Optional[int] = pool.alloc(self)
+        self._detached: List[Any] = []
+        super().__init__(**kwargs)
+
+    def reinit(self, **kwargs):
+        # free listから使い回すときは行を取り直す
+        if self._row is None:
+            self._row = self._pool.alloc(self)
+        super().reinit(**kwargs)
+
+    def release(self):
+        # 行を返す（値は手元に写す）
+        row = self._row
+        if row is None:
+            return
+        self._detached = [getattr(self._pool, c)[row].item() for c in self._COLUMNS]
+        self._pool.free(row)
+        self._row = None
+
+    def _get(self, col: int) -> Any:
+        if self._row is None:
+            return self._detached[col]
+        return getattr(self._pool, self._COLUMNS[col])[self._row].item()
+
+    def _set(self, col: int, value: Any):
+        if self._row is None:
+            self._detached[col] = value
+            return
+        getattr(self._pool, self._COLUMNS[col])[self._row] = value
+
+    @property
+    def fidelity_init(self) -> float:
+        return self._get(0)
+
+    @fidelity_init.setter
+    def fidelity_init(self, f: float):
+        self._set(0, f)
+
+    @property
+    def step_created(self) -> int:
+        return self._get(1)
+
+    @step_created.setter
+    def step_created(self, k: int):
+        self._set(1, k)
+
+    @property
+    def t_mem(self) -> Optional[float]:
+        t_mem = self._get(2)
+        return None if math.isinf(t_mem) else t_mem
+
+    @t_mem.setter
+    def t_mem(self, t_mem: Optional[float]):
+        self._set(2, math.inf if t_mem is None else t_mem)
+
+    @property
+    def is_free(self) -> bool:
+        return self._get(3)
+
+    @is_free.setter
+    def is_free(self, is_free: bool):
+        self._set(3, is_free)
@@ -0,0 +1,79 @@
+# events.py
+# コントローラが積むイベントのクラス
+# func_to_eventは呼ぶたびにクラスとクロージャを作るので、毎スロット・毎操作で積むもの
+# （gen/req/linkのフェーズ、swap/purifyの完了）は専用のクラスにして、必要な値を属性で持つ
+# （qnsのEventに__slots__が無く、インスタンスは__dict__を持つので、__slots__は付けない）
+# 完了イベントはOperation.completionに登録し、opが再生成されたらcancel()で取り消す（O(1)）
+
+from typing import TYPE_CHECKING, Callable, Optional
+
+from qns.simulator.event import Event
+from qns.simulator.ts import Time
+
+from edp.sim.ep import EP
+
+if TYPE_CHECKING:
+    from edp.app.controller_app import ControllerApp
+    from edp.sim.op import Operation
+
+
+class ControllerEvent(Event):
+    """by（積んだコントローラ）を持つイベントの共通部分"""
+
+    by: "ControllerApp"
+
+    def __init__(self, t: Time, by: "ControllerApp"):
+        super().__init__(t=t, by=by)
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}({self.t.time_slot})"
+
+
+class PhaseEvent(ControllerEvent):
+    """
+    gen -> req -> link のフェーズ（gen_EP_routineでのリンク生成もここ）
+    fnはフェーズの関数（fused_tickのときは_run_phaseに包んだもの）
+    """
+
+    def __init__(self, t: Time, by: "ControllerApp", fn: Callable[[], None]):
+        super().__init__(t, by)
+        self.fn = fn
+
+    def invoke(self) -> None:
+        self.fn()
+
+
+class SwapDoneEvent(ControllerEvent):
+    """swapの完了（古典通信の遅延後）。成功したときだけ積む"""
+
+    def __init__(self, t: Time, by: "ControllerApp", op: "Operation", fidelity: float):
+        super().__init__(t, by)
+        self.op = op
+        self.fidelity = fidelity
+
+    def invoke(self) -> None:
+        self.by._finish_swap(self)
+
+
+class PurifyDoneEvent(ControllerEvent):
+    """purifyの完了。成否は完了時に判定する"""
+
+    def __init__(
+        self,
+        t: Time,
+        by: "ControllerApp",
+        op: "Operation",
+        ep_target: EP,
+        new_fid: float,
+        success_prob: float,
+    ):
+        super().__init__(t, by)
+        self.op = op
+        self.ep_target = ep_target
+        # free listから使い回されたEPと見分けるため、積んだときのidを覚えておく
+        self.ep_id: Optional[int] = ep_target.ep_id
+        self.new_fid = new_fid
+        self.success_prob = success_prob
+
+    def invoke(self) -> None:
+        self.by._finish_purify(self)
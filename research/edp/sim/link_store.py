@@ -0,0 +1,104 @@
+# link_store.py
+# コントローラが持つEPの置き場
+# 使えるEP（live）と次のタイムスロットから使えるEP（pending）を、挿入順を保った集合（dict）で持つ
+# 追加・削除・所属確認はO(1)。NewQCごと・ノードの組ごとの索引も同時に更新する
+
+from typing import TYPE_CHECKING, Dict, FrozenSet, Iterator, List, Optional
+
+from qns.entity.node import QNode
+
+from edp.sim.ep import EP
+from edp.sim.new_qchannel import NewQC
+
+if TYPE_CHECKING:
+    from edp.sim.op import Operation
+
+
+class LinkStore:
+    """
+    links / links_next の代わり
+    - add: pendingに入れる（gen_single_EP）
+    - promote: pendingをliveに移す（links_manager_routineの先頭、links += links_next の代わり）
+    - remove: どちらにあっても外す（delete_EP）
+    """
+
+    def __init__(self):
+        # dictを挿入順の集合として使う（値はNone）
+        self._live: Dict[EP, None] = {}
+        self._pending: Dict[EP, None] = {}
+        self._by_qc: Dict[NewQC, Dict[EP, None]] = {}
+        self._by_pair: Dict[FrozenSet[QNode], Dict[EP, None]] = {}
+
+    def __len__(self) -> int:
+        return len(self._live) + len(self._pending)
+
+    def __contains__(self, ep: EP) -> bool:
+        return ep in self._live or ep in self._pending
+
+    def is_live(self, ep: EP) -> bool:
+        return ep in self._live
+
+    def is_pending(self, ep: EP) -> bool:
+        return ep in self._pending
+
+    def has_pending(self) -> bool:
+        return bool(self._pending)
+
+    def add(self, ep: EP):
+        self._pending[ep] = None
+        if ep.qc is not None:
+            self._by_qc.setdefault(ep.qc, {})[ep] = None
+        self._by_pair.setdefault(frozenset(ep.nodes), {})[ep] = None
+
+    def promote(self):
+        # 次のスロットの分を使えるようにする
+        if self._pending:
+            self._live.update(self._pending)
+            self._pending.clear()
+
+    def remove(self, ep: EP) -> bool:
+        # 外したらTrue（どこにも無ければFalse）
+        if ep in self._live:
+            del self._live[ep]
+        elif ep in self._pending:
+            del self._pending[ep]
+        else:
+            return False
+        if ep.qc is not None:
+            self._by_qc[ep.qc].pop(ep, None)
+        pair = frozenset(ep.nodes)
+        bucket = self._by_pair[pair]
+        bucket.pop(ep, None)
+        if not bucket:
+            # swapでできるEPの組は多様なので、空になった索引は消す
+            del self._by_pair[pair]
+        return True
+
+    def live(self) -> List[EP]:
+        # 使えるEPの一覧（コピーなので回しながら削除してよい）
+        return list(self._live)
+
+    def pending(self) -> List[EP]:
+        return list(self._pending)
+
+    def __iter__(self) -> Iterator[EP]:
+        # live -> pendingの順。コピーを回す
+        return iter([*self._live, *self._pending])
+
+    def by_qc(self, qc: NewQC) -> List[EP]:
+        # qcで生成されたリンクレベルEP（live / pending両方）
+        return list(self._by_qc.get(qc, ()))
+
+    def by_pair(self, n1: QNode, n2: QNode, live_only: bool = False) -> List[EP]:
+        # 両端がn1, n2のEP（向きは問わない）
+        eps = self._by_pair.get(frozenset((n1, n2)), ())
+        if live_only:
+            return [ep for ep in eps if ep in self._live]
+        return list(eps)
+
+    def owned_by(self, op: "Operation", n1: QNode, n2: QNode) -> Optional[EP]:
+        # n1-n2のEPのうちopが持ち主のもの（無ければNone）
+        for ep in self._by_pair.get(frozenset((n1, n2)), ()):
+            if ep.owner_op is op:
+                return ep
+        return None
@@ -1,7 +1,7 @@
 # new_qnet.py
 # QuantumChannelに生成されるEPの初期fidelityを追加
 
-from typing import List
+from typing import List, Optional
 from qns.entity.node import QNode
 from qns.entity.qchannel import QuantumChannel
 
@@ -16,6 +16,8 @@ class NewQC(QuantumChannel):
         delay: float = 0,
         fidelity_init: float = 0.99,
         memory_capacity: int = 5,
+        gen_rate: Optional[float] = None,
+        plan_fidelity: Optional[float] = None,
     ):
         super().__init__(
             name=name,
@@ -27,6 +29,9 @@ class NewQC(QuantumChannel):
         self.fidelity_init = fidelity_init
         self.memory_capacity = memory_capacity
         self.memory_usage = 0
+        # 計画（とEP生成間隔）に使うこのチャネル固有の値。Noneならコントローラのgen_rate / 既定のfid
+        self.gen_rate = gen_rate
+        self.plan_fidelity = plan_fidelity
 
     @property
     def has_free_memory(self) -> bool:
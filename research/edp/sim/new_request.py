@@ -25,6 +25,8 @@ class NewRequest(Request):
         self.reserve_links = []
         self.f_req = f_req
         self.is_done = is_done
+        self.plan_time: float = 0.0  # swap計画にかかった時間[秒]（batch_EDPが設定）
+        self.order: int = 0  # コントローラのrequestsに加えた順（同じtickに実行するopの順序に使う）
 
     def __repr__(self):
         return f"NewRequest({self.src}, {self.dest}, {self.name}, {self.priority}, {self.attr})"
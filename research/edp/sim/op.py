@@ -1,14 +1,17 @@
 # swap, purify等の操作を扱うクラス
 # swapping treeを構成するノード
-from enum import Enum, auto
+from enum import Enum, IntEnum, auto
 from tkinter.constants import FALSE
-from typing import TYPE_CHECKING, List, Optional, Tuple
+from typing import TYPE_CHECKING, Any, Deque, Dict, List, Optional, Sequence, Tuple
 
 from qns.entity.node import QNode
 
+from edp.alg.plan_array import PLAN_LINK, PLAN_PURIFY, PLAN_SWAP, PlanArray
 from edp.sim.ep import EP
 
 if TYPE_CHECKING:
+    from qns.simulator.event import Event
+
     from edp.sim.new_request import NewRequest
 
 
@@ -18,7 +21,8 @@ class OpType(Enum):
     GEN_LINK = auto()
 
 
-class OpStatus(Enum):
+class OpStatus(IntEnum):
+    # intなので比較が軽い（名前はそのまま使える）
     WAITING = auto()
     READY = auto()
     RUNNING = auto()
@@ -27,6 +31,34 @@ class OpStatus(Enum):
 
 
 class Operation:
+    # 大きなバッチやPSWのクローンで数万個作るので、__dict__を持たせない
+    __slots__ = (
+        "name",
+        "type",
+        "status",
+        "n1",
+        "n2",
+        "via",
+        "parent",
+        "children",
+        "pending",
+        "ep",
+        "pur_eps",
+        "request",
+        "threshold_purified",
+        "demand_registered",
+        "ready_queue",
+        "queued",
+        "epoch",
+        "checked",
+        "completion",
+        "order",
+    )
+
+    # 部分木の無効化（内部ノードのrequest_regen）のたびに進める時計
+    # 子孫はepochが親より古ければ、次に触られたとき（sync）にリセットを反映する
+    _clock: int = 0
+
     def __init__(
         self,
         name: str,
@@ -44,12 +76,14 @@ class Operation:
     ):
         self.name = name
         self.type = type
-        self.status = status or OpStatus.WAITING
+        self.status = status if status is not None else OpStatus.WAITING
         self.n1 = n1
         self.n2 = n2
         self.via = via
         self.parent = parent
-        self.children = children or []
+        self.children = children if children is not None else []
+        # DONEでない子の数。子のdone()で減り、子のrequest_regen()で戻る
+        self.pending: int = sum(1 for ch in self.children if ch.status != OpStatus.DONE)
         self.ep = ep  # この操作が完了した後にできるもつれ
         self.pur_eps = pur_eps or []
         self.request = request  # 対応するリクエスト
@@ -57,26 +91,92 @@ class Operation:
         self.threshold_purified = threshold_purified
         # gen_linkのとき、リンクレベルEP生成を要求したか
         self.demand_registered: bool = False
+        # READYになったら積むコントローラの待ち行列（attach_ready_queueで設定）
+        self.ready_queue: Optional[Deque["Operation"]] = None
+        self.queued: bool = False  # ready_queueに積まれていて、まだ取り出されていない
+        # 最後に反映した無効化の時刻（自分または祖先のrequest_regen）
+        self.epoch: int = 0
+        self.checked: int = 0  # 最後に祖先を確かめたときの_clock
+        # 積んである完了イベント（swap/purify）。RUNNINGから外れたら取り消す
+        self.completion: Optional["Event"] = None
+        # リクエストのopsリスト（後行順）での位置。同じtickに実行するopの順序に使う
+        self.order: int = 0
 
     def is_leaf(self) -> bool:
         # 自分が葉ノードかどうか
         return len(self.children) == 0
 
+    def add_child(self, child: "Operation"):
+        # 子を後から足す（pendingも合わせる）
+        self.children.append(child)
+        if child.status != OpStatus.DONE:
+            self.pending += 1
+
     def can_run(self) -> bool:
-        # 自分が実行可能かどうか
-        if self.is_leaf():
-            return True
-        return all(ch.status == OpStatus.DONE for ch in self.children)
+        # 自分が実行可能かどうか（葉か、子が全部DONE）
+        self.sync()
+        return self.pending == 0
+
+    def sync(self):
+        """
+        祖先のrequest_regenをまだ反映していなければ、ここでリセットする
+        前回から無効化が1回も無ければ何もしない（_clockの比較だけ）
+        状態を読み書きする前に呼ぶ（Operationのメソッドは自分で呼ぶ）
+        """
+        if self.checked == Operation._clock:
+            return
+        p = self.parent
+        if p is not None:
+            p.sync()
+            if p.epoch > self.epoch:
+                self._reset(p.epoch)
+        self.checked = Operation._clock
+
+    def is_stale(self) -> bool:
+        # 祖先のrequest_regenをまだ反映していないか（syncと違ってリセットはしない）
+        if self.checked == Operation._clock:
+            return False
+        p = self.parent
+        while p is not None:
+            if p.epoch > self.epoch:
+                return True
+            if p.checked == Operation._clock:
+                return False  # pより上の無効化はpのepochに反映済み
+            p = p.parent
+        return False
+
+    def sync_subtree(self):
+        # 子孫をすべてsyncする（リセットされた葉はready_queueに積まれる）
+        stack = list(self.children)
+        while stack:
+            op = stack.pop()
+            op.sync()
+            stack.extend(op.children)
+
+    def _reset(self, epoch: int):
+        # 再生成のためのリセット。葉はREADYにして再要求、内部ノードは子の完了待ち
+        self.epoch = epoch
+        self.cancel_completion()
+        self.ep = None
+        self.pur_eps.clear()
+        self.threshold_purified = False
+        self.demand_registered = False
+        if self.children:
+            self.status = OpStatus.RETRY
+            self.pending = len(self.children)
+        else:
+            self.set_ready()
 
     def judge_ready(self):
         # 自分が準備完了かどうか
         # purifyの場合
         # 子ノードが完了したときにこの関数が呼ばれる
+        self.sync()
         if self.type == OpType.PURIFY:
             self._judge_ready_purify()
         # purify以外
         elif self.can_run() and self.status in (OpStatus.WAITING, OpStatus.RETRY):
-            self.status = OpStatus.READY
+            self.set_ready()
 
     def _judge_ready_purify(self):
         # self.pur_epsの数で判定
@@ -92,40 +192,118 @@ class Operation:
 
         if num_eps == 0:
             # targetEPができたのでsacrifice用に子だけ再実行を要求
+            self.cancel_completion()
             self.status = OpStatus.WAITING
             for c in self.children:
                 c.request_regen()
         elif num_eps == 1:
             # sacrificeEPができた
-            self.status = OpStatus.READY
+            self.set_ready()
+
+    def set_ready(self):
+        # READYにして、コントローラの待ち行列に積む
+        self.cancel_completion()
+        self.status = OpStatus.READY
+        self._enqueue()
+
+    def _enqueue(self):
+        # 積まれたままなら積み直さない
+        if self.ready_queue is not None and not self.queued:
+            self.queued = True
+            self.ready_queue.append(self)
+
+    def attach_ready_queue(self, queue: Optional[Deque["Operation"]]):
+        # 以降READYになったらqueueに積む。すでにREADYならここで積む（Noneで外す）
+        self.sync()
+        self.ready_queue = queue
+        if queue is not None and self.status == OpStatus.READY:
+            self.set_ready()
 
     def start(self):
-        # 実行開始
+        # 実行開始（前の実行の完了イベントが残っていれば取り消す）
+        self.sync()
+        self.cancel_completion()
         self.status = OpStatus.RUNNING
 
     def done(self):
         # 実行完了して親に伝える or req完了を伝える
+        self.sync()
+        self.cancel_completion()
+        if self.status != OpStatus.DONE and self.parent is not None:
+            self.parent.pending -= 1
         self.status = OpStatus.DONE
         if self.parent:
             self.parent.judge_ready()
 
+    def _leave_done(self):
+        # DONEから戻るとき、親の待ち数を戻す
+        if self.status == OpStatus.DONE and self.parent is not None:
+            self.parent.pending += 1
+
     def failed(self):
+        self.sync()
+        self.cancel_completion()
+        self._leave_done()
         self.status = OpStatus.WAITING
         self.ep = None
         # request_regenでいい
 
+    def set_completion(self, event: "Event"):
+        # 実行中の操作の完了イベントを登録する
+        self.completion = event
+
+    def cancel_completion(self):
+        # 積んである完了イベントを取り消す（シミュレータは取り消されたイベントを飛ばす）
+        event = self.completion
+        if event is not None:
+            event.cancel()
+            self.completion = None
+
+    def take_completion(self, event: "Event") -> bool:
+        """
+        完了イベントの実行時に呼ぶ。eventがまだこの操作の完了イベントならTrue（登録は外す）
+        祖先のrequest_regenはsyncで反映されるので、ここで古いイベントも落ちる
+        """
+        self.sync()
+        if self.completion is not event:
+            return False
+        self.completion = None
+        return True
+
     def request_regen(self):
         # このOPに必要なEPを再生成
+        # 子孫は辿らずに時刻を進めるだけ（各子孫は次のsyncでリセットされる）
+        self.sync()
+        self._leave_done()
+        if self.is_leaf():
+            self._reset(self.epoch)
+            return
+        Operation._clock += 1
+        self._reset(Operation._clock)
+        self.checked = Operation._clock
+        # RETRYのまま積んでおき、コントローラが取り出したときにsync_subtreeで葉を再要求させる
+        self._enqueue()
+        for c in self.children:
+            if c.parent is not self:
+                # PSWのpurifyのように親子関係を借りているだけの子は、epochが伝わらないのですぐ戻す
+                c.request_regen()
+
+    def recycle(self, request: Optional["NewRequest"] = None):
+        # free listから使い回すときの初期化（木の形と名前はそのまま）
+        # queuedはそのまま（ready_queueに古い項目が残っていれば、それを使う）
+        self.cancel_completion()
+        self.status = (
+            OpStatus.READY if self.type == OpType.GEN_LINK else OpStatus.WAITING
+        )
+        self.pending = len(self.children)
         self.ep = None
         self.pur_eps.clear()
+        self.request = request
         self.threshold_purified = False
         self.demand_registered = False
-        if not self.is_leaf():
-            self.status = OpStatus.RETRY
-            for c in self.children:
-                c.request_regen()
-        else:  # 葉で再帰とめる
-            self.status = OpStatus.READY
+        self.ready_queue = None
+        self.epoch = 0
+        self.checked = 0
 
     def __repr__(self) -> str:
         return f"{self.name}"
@@ -139,71 +317,188 @@ def build_ops_from_edp_result(
     EDP が返した (latency, tree_dict) から
     OP インスタンスの配列を作って返す
     """
-    _, tree = edp_result
-    ops: List[Operation] = []
-    root: Operation | None = None
-
-    def _build(node_dict: dict, parent: Operation | None = None) -> Operation:
-        nonlocal root
-        node_type = node_dict["type"]
-
-        if node_type == "Link":
-            n1, n2 = node_dict["link"]
-            op = Operation(
-                name=f"GEN_LINK({n1.name}-{n2.name})",
-                type=OpType.GEN_LINK,
-                status=OpStatus.READY,  # ここでGENLINKをあらかじめ実行できるようにしとく
-                n1=n1,
-                n2=n2,
-                via=None,
-                parent=parent,
-                children=[],
-            )
+    latency, tree = edp_result
+    return build_ops_from_plan_array(PlanArray.from_tree(latency, tree))
 
-        elif node_type == "Swap":
-            via = node_dict["via"]
-            x = node_dict["x"]
-            y = node_dict["y"]
 
-            op = Operation(
-                name=f"SWAP({x.name}-{via.name}-{y.name})",
-                type=OpType.SWAP,
-                n1=x,
-                n2=y,
-                via=via,
-                parent=parent,
-                children=[],
-            )
-
-            left_child = _build(node_dict["left"], parent=op)
-            right_child = _build(node_dict["right"], parent=op)
-            op.children = [left_child, right_child]
+class OpTemplate:
+    """
+    OPの木の雛形（後行順の並列配列、rootが末尾）
+    instantiateで先頭から1回なめるだけで新しい木を作る。release()で返された木はfree listに置き、
+    次のinstantiateでは作らずに初期化して使い回す
+    """
 
-        elif node_type == "Purify":
-            x = node_dict["x"]
-            y = node_dict["y"]
+    __slots__ = ("names", "types", "n1", "n2", "via", "parent", "order", "free")
 
+    def __init__(
+        self,
+        names: List[str],
+        types: List[OpType],
+        n1: List[QNode],
+        n2: List[QNode],
+        via: List[Optional[QNode]],
+        parent: List[int],
+        order: Optional[List[int]] = None,
+    ):
+        self.names = names
+        self.types = types
+        self.n1 = n1
+        self.n2 = n2
+        self.via = via
+        self.parent = parent
+        # 各OPのOperation.order（同じtickに実行する順）。Noneなら後行順の位置そのまま
+        self.order = order if order is not None else list(range(len(types)))
+        self.free: List[List[Operation]] = []
+
+    def __len__(self) -> int:
+        return len(self.types)
+
+    @classmethod
+    def from_plan(
+        cls, plan: PlanArray, nodes: Optional[Sequence[QNode]] = None
+    ) -> "OpTemplate":
+        # 配列表現の計画から（nodes: ノード表、Noneならplan.nodes）
+        if nodes is None:
+            nodes = plan.nodes
+        assert nodes is not None
+        names, types, n1, n2, via = [], [], [], [], []
+        for i in range(len(plan)):
+            t = plan.types[i]
+            x = nodes[plan.n1[i]]
+            y = nodes[plan.n2[i]]
+            v = None
+            if t == PLAN_LINK:
+                names.append(f"GEN_LINK({x.name}-{y.name})")
+                types.append(OpType.GEN_LINK)
+            elif t == PLAN_SWAP:
+                v = nodes[plan.via[i]]
+                names.append(f"SWAP({x.name}-{v.name}-{y.name})")
+                types.append(OpType.SWAP)
+            elif t == PLAN_PURIFY:
+                names.append(f"PURIFY({x.name}-{y.name})")
+                types.append(OpType.PURIFY)
+            else:
+                raise ValueError(f"Unknown plan type: {t}")
+            n1.append(x)
+            n2.append(y)
+            via.append(v)
+        return cls(names, types, n1, n2, via, list(plan.parent))
+
+    @classmethod
+    def from_op(cls, root: Operation, prefix: str = "") -> "OpTemplate":
+        # 既存のOPの部分木から（PSWの犠牲側の木など）。名前にprefixを付ける
+        order: List[Operation] = []
+        up: Dict[int, Operation] = {}  # id(op) -> 部分木の中での親
+        stack = [(root, False)]
+        while stack:
+            op, expanded = stack.pop()
+            if expanded:
+                order.append(op)
+                continue
+            stack.append((op, True))
+            for ch in reversed(op.children):
+                up[id(ch)] = op
+                stack.append((ch, False))
+        pos = {id(op): i for i, op in enumerate(order)}
+        # 実行順は木を先行順（root、子の順）に複製していたときのopsリストの順
+        pre: Dict[int, int] = {}
+        stack = [root]
+        while stack:
+            op = stack.pop()
+            pre[id(op)] = len(pre)
+            stack.extend(reversed(op.children))
+        return cls(
+            [prefix + op.name for op in order],
+            [op.type for op in order],
+            [op.n1 for op in order],
+            [op.n2 for op in order],
+            [op.via for op in order],
+            [pos[id(up[id(op)])] if op is not root else -1 for op in order],
+            [pre[id(op)] for op in order],
+        )
+
+    def instantiate(
+        self, request: Optional["NewRequest"] = None
+    ) -> Tuple[Operation, List[Operation]]:
+        """(root, ops) を返す。opsは後行順（rootが末尾）で、毎回新しいリスト"""
+        if self.free:
+            ops = self.free.pop()
+            for op in ops:
+                op.recycle(request)
+            return ops[-1], list(ops)
+        ops: List[Operation] = []
+        children: List[List[Operation]] = [[] for _ in range(len(self.types))]
+        for i, t in enumerate(self.types):
             op = Operation(
-                name=f"PURIFY({x.name}-{y.name})",
-                type=OpType.PURIFY,
-                n1=x,
-                n2=y,
-                parent=parent,
-                children=[],
+                name=self.names[i],
+                type=t,
+                n1=self.n1[i],
+                n2=self.n2[i],
+                via=self.via[i],
+                # ここでGENLINKをあらかじめ実行できるようにしとく
+                status=OpStatus.READY if t == OpType.GEN_LINK else OpStatus.WAITING,
+                children=children[i],
+                request=request,
             )
-
-            child_op = _build(node_dict["child"], parent=op)
-            op.children = [child_op]
-
-        else:
-            raise ValueError(f"Unknown node type: {node_type}")
-
-        if parent is None and root is None:
-            root = op
-        ops.append(op)
-        # print(f"{op.name}, {op.parent}")
-        return op
-
-    _build(tree, parent=None)
-    assert root is not None
-    return root, ops
+            op.order = self.order[i]
+            for ch in op.children:
+                ch.parent = op
+            p = self.parent[i]
+            if p >= 0:
+                children[p].append(op)
+            ops.append(op)
+        root = ops[-1]
+        assert root.parent is None
+        return root, list(ops)
+
+    def release(self, ops: List[Operation]):
+        """
+        instantiateで作った木を返す。呼ぶ側は、もうどこからも使われない（EP・生成待ち行列から
+        参照されない）ことを確かめてから返す。積んである完了イベントはここで取り消す
+        """
+        tree = ops[: len(self.types)]  # 後から足されたOPは含めない
+        for op in tree:
+            op.cancel_completion()
+            op.attach_ready_queue(None)
+            op.request = None
+        self.free.append(tree)
+
+
+def template_for_plan(
+    plan: PlanArray,
+    templates: Optional[Dict[Any, OpTemplate]] = None,
+    nodes: Optional[Sequence[QNode]] = None,
+) -> OpTemplate:
+    """
+    計画の雛形。templatesがあれば同じ計画（同じ木・同じノード）の雛形を使い回す
+    """
+    if nodes is None:
+        nodes = plan.nodes
+    assert nodes is not None
+    if templates is None:
+        return OpTemplate.from_plan(plan, nodes)
+    key = (
+        plan.types.tobytes(),
+        plan.parent.tobytes(),
+        tuple(nodes[i] for i in plan.n1),
+        tuple(nodes[i] for i in plan.n2),
+        tuple(nodes[i] if i >= 0 else None for i in plan.via),
+    )
+    template = templates.get(key)
+    if template is None:
+        template = templates[key] = OpTemplate.from_plan(plan, nodes)
+    return template
+
+
+def build_ops_from_plan_array(
+    plan: PlanArray,
+    nodes: Optional[Sequence[QNode]] = None,
+    templates: Optional[Dict[Any, OpTemplate]] = None,
+) -> Tuple[Operation, List[Operation]]:
+    """
+    配列表現の計画から、先頭から1回なめるだけでOPの木を作る
+    後行順なので子のOPは親より先にできている。opsも後行順（rootが末尾）
+    nodes: ノード表（Noneならplan.nodes）
+    templates: 雛形の使い回し（template_for_plan参照）
+    """
+    return template_for_plan(plan, templates, nodes).instantiate()
@@ -0,0 +1,276 @@
+# bench_sim.py
+# シミュレータ1本当たりのイベント数と実行時間のベンチマーク
+# 同じ条件（seed・ネットワーク・リクエスト）を、コントローラのtickの回し方（通常 / fused_tick / skip_idle / 両方）や
+# イベントプール（heap / calendar）を変えて走らせ、
+# イベント数・s.run()の実時間・events/sec・slots/secをJSON/CSVに書く
+# 実行: python -m exp2.bench_sim --out-dir out/bench_sim [--nodes 50 --requests 10 --seeds 0 1 2]
+
+import argparse
+import csv
+import json
+import os
+import platform
+import subprocess
+import time
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from exp2.common import _run_single
+
+# モード名 -> _run_singleに渡すkwargs
+MODES: Dict[str, Dict[str, Any]] = {
+    "baseline": {},
+    "fused": {"fused_tick": True},
+    "skip_idle": {"skip_idle": True},
+    "fused+skip_idle": {"fused_tick": True, "skip_idle": True},
+    "calendar": {"event_pool": "calendar"},
+    "fused+skip_idle+calendar": {
+        "fused_tick": True,
+        "skip_idle": True,
+        "event_pool": "calendar",
+    },
+}
+
+BENCH_COLUMNS = [
+    "mode",
+    "seed",
+    "nodes",
+    "requests",
+    "sim_time",
+    "enable_psw",
+    "status",
+    "finished",
+    "avg_wait",
+    "sim_span_slot",
+    "sim_events",
+    "sim_run_sec",
+    "events_per_sec",
+    "slots_per_sec",
+    "error",
+]
+
+# _run_singleの既定の条件（exp2/configsの小さめの設定に合わせる）
+DEFAULT_RUN: Dict[str, Any] = {
+    "f_req": 0.8,
+    "p_swap": 0.4,
+    "init_fidelity": 0.95,
+    "psw_threshold": 0.9,
+    "gen_rate": 50,
+    "memory_capacity": 5,
+    "waxman_size": 100000,
+    "waxman_alpha": 0.2,
+    "waxman_beta": 0.6,
+}
+
+
+def bench_run(
+    mode: str,
+    seed: int,
+    nodes: int,
+    requests: int,
+    sim_time: float,
+    enable_psw: bool,
+    repeat: int = 1,
+    run_kwargs: Optional[Dict[str, Any]] = None,
+) -> Dict[str, Any]:
+    """1条件をrepeat回走らせ、s.run()が最短だった回の値を行にする。例外は status=error の行にする"""
+    kwargs = dict(DEFAULT_RUN)
+    kwargs.update(run_kwargs or {})
+    kwargs.update(MODES[mode])
+    row: Dict[str, Any] = {
+        "mode": mode,
+        "seed": seed,
+        "nodes": nodes,
+        "requests": requests,
+        "sim_time": sim_time,
+        "enable_psw": enable_psw,
+    }
+    best = None
+    for _ in range(max(1, repeat)):
+        try:
+            m = _run_single(
+                nodes=nodes,
+                requests=requests,
+                seed=seed,
+                sim_time=sim_time,
+                enable_psw=enable_psw,
+                verbose_sim=False,
+                **kwargs,
+            )
+        except Exception as exc:  # 1条件の失敗で全体を止めない
+            row.update(status="error", error=f"{type(exc).__name__}: {exc}")
+            return row
+        if best is None or m.sim_run_sec < best.sim_run_sec:
+            best = m
+    assert best is not None
+    sec = best.sim_run_sec
+    row.update(
+        status="ok",
+        finished=best.finished,
+        avg_wait=(
+            sum(best.wait_times) / len(best.wait_times) if best.wait_times else None
+        ),
+        sim_span_slot=best.sim_span_slot,
+        sim_events=best.sim_events,
+        sim_run_sec=sec,
+        events_per_sec=best.sim_events / sec if sec > 0 else None,
+        slots_per_sec=best.sim_span_slot / sec if sec > 0 else None,
+    )
+    return row
+
+
+def run_bench(
+    modes: Sequence[str] = tuple(MODES),
+    seeds: Sequence[int] = (0, 1, 2),
+    nodes: int = 50,
+    requests: int = 10,
+    sim_time: float = 3.0,
+    enable_psw: bool = True,
+    repeat: int = 1,
+    run_kwargs: Optional[Dict[str, Any]] = None,
+    log: Optional[Callable[[str], None]] = None,
+) -> List[Dict[str, Any]]:
+    """seedごとに全モードを回してBENCH_COLUMNSの行のリストを返す"""
+    rows: List[Dict[str, Any]] = []
+    for seed in seeds:
+        for mode in modes:
+            row = bench_run(
+                mode,
+                seed,
+                nodes,
+                requests,
+                sim_time,
+                enable_psw,
+                repeat=repeat,
+                run_kwargs=run_kwargs,
+            )
+            rows.append(row)
+            if log is not None:
+                log(_format_row(row))
+    return rows
+
+
+def summarize(rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    モードごとに合計のイベント数・実時間と、baselineに対する比を返す
+    イベント数と実時間は全seedの合計で比べる（errorの行は除く）
+    """
+    totals: Dict[str, Dict[str, float]] = {}
+    for row in rows:
+        if row.get("status") != "ok":
+            continue
+        t = totals.setdefault(row["mode"], {"runs": 0, "sim_events": 0, "sec": 0.0})
+        t["runs"] += 1
+        t["sim_events"] += row["sim_events"]
+        t["sec"] += row["sim_run_sec"]
+    base = totals.get("baseline")
+    out = []
+    for mode, t in totals.items():
+        out.append(
+            {
+                "mode": mode,
+                "runs": t["runs"],
+                "sim_events": t["sim_events"],
+                "sim_run_sec": t["sec"],
+                "events_per_sec": t["sim_events"] / t["sec"] if t["sec"] > 0 else None,
+                "events_ratio": (
+                    t["sim_events"] / base["sim_events"]
+                    if base and base["sim_events"]
+                    else None
+                ),
+                "speedup": base["sec"] / t["sec"] if base and t["sec"] > 0 else None,
+            }
+        )
+    return out
+
+
+def _format_row(row: Dict[str, Any]) -> str:
+    head = (
+        f"{row['mode']} seed={row['seed']} nodes={row['nodes']} reqs={row['requests']}"
+    )
+    if row.get("status") != "ok":
+        return f"{head}: {row.get('error')}"
+    return (
+        f"{head}: finished={row['finished']}, events={row['sim_events']}, "
+        f"{row['sim_run_sec']:.3f} s, {row['events_per_sec']:.0f} events/s, "
+        f"{row['slots_per_sec']:.0f} slots/s"
+    )
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        out = subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return out.stdout.strip()
+
+
+def write_results(
+    rows: List[Dict[str, Any]], out_dir: str, meta: Optional[Dict[str, Any]] = None
+) -> Tuple[str, str]:
+    """out_dir/bench_sim.json（metaと行と集計）とout_dir/bench_sim.csv（行だけ）を書いてパスを返す"""
+    os.makedirs(out_dir, exist_ok=True)
+    json_path = os.path.join(out_dir, "bench_sim.json")
+    csv_path = os.path.join(out_dir, "bench_sim.csv")
+    with open(json_path, "w", encoding="utf-8") as f:
+        json.dump(
+            {"meta": meta or {}, "rows": rows, "summary": summarize(rows)},
+            f,
+            ensure_ascii=False,
+            indent=2,
+        )
+    with open(csv_path, "w", encoding="utf-8", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=BENCH_COLUMNS)
+        writer.writeheader()
+        for row in rows:
+            writer.writerow({col: row.get(col) for col in BENCH_COLUMNS})
+    return json_path, csv_path
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        description="シミュレータのイベント数・events/secのベンチマーク"
+    )
+    parser.add_argument("--out-dir", default="bench_sim_out")
+    parser.add_argument("--modes", nargs="+", default=list(MODES), choices=list(MODES))
+    parser.add_argument("--seeds", nargs="+", type=int, default=[0, 1, 2])
+    parser.add_argument("--nodes", type=int, default=50)
+    parser.add_argument("--requests", type=int, default=10)
+    parser.add_argument("--sim-time", type=float, default=3.0)
+    parser.add_argument("--p-swap", type=float, default=DEFAULT_RUN["p_swap"])
+    parser.add_argument("--no-psw", action="store_true")
+    parser.add_argument("--repeat", type=int, default=1)
+    args = parser.parse_args(argv)
+
+    rows = run_bench(
+        modes=args.modes,
+        seeds=args.seeds,
+        nodes=args.nodes,
+        requests=args.requests,
+        sim_time=args.sim_time,
+        enable_psw=not args.no_psw,
+        repeat=args.repeat,
+        run_kwargs={"p_swap": args.p_swap},
+        log=print,
+    )
+    for s in summarize(rows):
+        print(s)
+    meta = {
+        "commit": _git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "args": vars(args),
+    }
+    json_path, csv_path = write_results(rows, args.out_dir, meta=meta)
+    print(f"wrote {json_path}, {csv_path}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
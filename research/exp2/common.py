@@ -9,9 +9,10 @@ import logging
 import math
 import os
 import sys
+import time
 import traceback
 import random
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from pathlib import Path
 from statistics import mean
 from typing import Any, Dict, Iterable, Iterator, List, Mapping, Optional, Sequence, Tuple
@@ -22,10 +23,13 @@ ROOT = Path(__file__).resolve().parents[1]
 if str(ROOT) not in sys.path:
     sys.path.insert(0, str(ROOT))
 
+from edp.alg.plan_cache import PlanCache
+from edp.alg.plan_store import PlanStore
 from edp.app.controller_app import ControllerApp
 from edp.app.node_app import NodeApp
 from edp.sim import SIMULATOR_ACCURACY
 from edp.sim import models
+from edp.sim.calendar_pool import EVENT_POOLS
 from qns.entity.node import QNode
 from qns.network import QuantumNetwork
 from qns.network.route.dijkstra import DijkstraRouteAlgorithm
@@ -58,6 +62,13 @@ class RunMetrics:
     psw_cancelled: int
     sim_span_slot: float
     completed_requests: List[Dict[str, Any]]
+    plan_cache_hits: int = 0
+    plan_cache_misses: int = 0
+    plan_cache_evictions: int = 0
+    plan_cache_size: int = 0
+    plan_times: List[float] = field(default_factory=list)
+    sim_events: int = 0
+    sim_run_sec: float = 0.0
 
 
 REQUIRED_CONFIG_KEYS: List[str] = [
@@ -172,9 +183,22 @@ def _run_single(
     waxman_alpha: float,
     waxman_beta: float,
     verbose_sim: bool,
+    edp_planner: str = "recursive",
+    plan_cache: Optional[PlanCache] = None,
+    edp_workers: int = 1,
+    edp_k_paths: int = 1,
+    plan_store: Optional[PlanStore] = None,
+    edp_planner_options: Optional[Dict[str, Any]] = None,
+    ep_pool: str = "object",
+    skip_idle: bool = False,
+    fused_tick: bool = False,
+    event_pool: str = "heap",
 ) -> RunMetrics:
     """単発シミュレーションを実行する。"""
-    s = Simulator(0, sim_time, SIMULATOR_ACCURACY)
+    cache_before = plan_cache.stats() if plan_cache is not None else None
+    if event_pool not in EVENT_POOLS:
+        raise ValueError(f"Unknown event_pool: {event_pool}")
+    s = Simulator(0, sim_time, SIMULATOR_ACCURACY, pool_cls=EVENT_POOLS[event_pool])
     set_seed(seed)
 
     topo = WaxmanTopology(
@@ -209,6 +233,15 @@ def _run_single(
                 init_fidelity=init_fidelity,
                 enable_psw=enable_psw,
                 psw_threshold=psw_threshold,
+                edp_planner=edp_planner,
+                plan_cache=plan_cache,
+                edp_workers=edp_workers,
+                edp_k_paths=edp_k_paths,
+                plan_store=plan_store,
+                edp_planner_options=edp_planner_options,
+                ep_pool=ep_pool,
+                skip_idle=skip_idle,
+                fused_tick=fused_tick,
             )
         ],
     )
@@ -219,11 +252,13 @@ def _run_single(
     if net.requests:
         net.query_route(net.requests[0].src, net.requests[0].dest)
 
+    t_run = time.perf_counter()
     if verbose_sim:
         s.run()
     else:
         with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
             s.run()
+    sim_run_sec = time.perf_counter() - t_run
 
     controller_app = controller_node.apps[0]
     completed = list(controller_app.completed_requests)
@@ -242,6 +277,13 @@ def _run_single(
         else:
             sim_span_slot = float(sim_time)
 
+    # run単位の差分で記録する（sizeはrun終了時点の値）
+    cache_stats = {"hits": 0, "misses": 0, "evictions": 0, "size": 0}
+    if plan_cache is not None and cache_before is not None:
+        cache_after = plan_cache.stats()
+        cache_stats = {k: cache_after[k] - cache_before[k] for k in cache_stats}
+        cache_stats["size"] = cache_after["size"]
+
     return RunMetrics(
         finished=finished,
         wait_times=wait_times,
@@ -264,6 +306,17 @@ def _run_single(
         else 0,
         sim_span_slot=sim_span_slot,
         completed_requests=completed,
+        plan_cache_hits=cache_stats["hits"],
+        plan_cache_misses=cache_stats["misses"],
+        plan_cache_evictions=cache_stats["evictions"],
+        plan_cache_size=cache_stats["size"],
+        plan_times=[
+            float(r.plan_time)
+            for r in controller_app.requests
+            if not getattr(r, "is_psw", False)
+        ],
+        sim_events=int(s.total_events),
+        sim_run_sec=sim_run_sec,
     )
 
 
@@ -419,6 +472,16 @@ def _build_summary_row(
         "psw_fail": metrics.psw_fail,
         "psw_cancelled": metrics.psw_cancelled,
         "attempts_per_finished": attempts_per_finished,
+        "plan_cache_hits": metrics.plan_cache_hits,
+        "plan_cache_misses": metrics.plan_cache_misses,
+        "plan_cache_evictions": metrics.plan_cache_evictions,
+        "plan_cache_size": metrics.plan_cache_size,
+        "plan_time_mean": _mean_or_none(metrics.plan_times),
+        "plan_time_max": max(metrics.plan_times) if metrics.plan_times else None,
+        "sim_events": metrics.sim_events,
+        "sim_events_per_sec": metrics.sim_events / metrics.sim_run_sec
+        if metrics.sim_run_sec > 0
+        else None,
         "status": status,
         "error_type": error_type,
         "error_message": error_message,
@@ -466,6 +529,14 @@ def _build_error_summary_row(
         "psw_fail": 0,
         "psw_cancelled": 0,
         "attempts_per_finished": None,
+        "plan_cache_hits": None,
+        "plan_cache_misses": None,
+        "plan_cache_evictions": None,
+        "plan_cache_size": None,
+        "plan_time_mean": None,
+        "plan_time_max": None,
+        "sim_events": None,
+        "sim_events_per_sec": None,
         "status": "error",
         "error_type": error_type,
         "error_message": error_message,
@@ -553,6 +624,26 @@ def run_psw_sweep(
     waxman_beta = float(config.get("waxman_beta", 0.6))
 
     verbose_sim = bool(config.get("verbose_sim", False))
+    edp_planner = str(config.get("edp_planner", "recursive"))
+    edp_workers = int(config.get("edp_workers", 1))
+    edp_k_paths = int(config.get("edp_k_paths", 1))
+    # 計画関数への追加引数（例: edp_planner: recursive のとき {prune: false}）
+    edp_planner_options = dict(config.get("edp_planner_options") or {})
+    # EPの状態の持ち方（object: EPオブジェクトごと / numpy: 配列のプールでまとめて切り捨て判定）
+    ep_pool = str(config.get("ep_pool", "object"))
+    # 何も起きないtickを飛ばす（結果は同じで、イベント数が減る）
+    skip_idle = bool(config.get("skip_idle", False))
+    # gen -> req -> link を、間に他のイベントが無ければ1つのイベントの中で続けて実行する
+    fused_tick = bool(config.get("fused_tick", False))
+    # シミュレータのイベントプール（heap: qnsの既定 / calendar: スロットごとのバケット）
+    event_pool = str(config.get("event_pool", "heap"))
+    # 指定があればディスク上の計画ストアを使う（t_mem等のスイープ点・別スイープ間で計画を共有）
+    plan_store_dir = config.get("plan_store_dir")
+    plan_store = PlanStore(str(plan_store_dir)) if plan_store_dir else None
+    # スイープ全体で共有する計画キャッシュ（同じ経路・リンク条件の計画をrun間で再利用）
+    plan_cache = PlanCache(
+        max_entries=int(config.get("plan_cache_max_entries", 200000))
+    )
 
     raw_rows: List[Dict[str, Any]] = []
     summary_rows: List[Dict[str, Any]] = []
@@ -587,6 +678,16 @@ def run_psw_sweep(
                             waxman_alpha=waxman_alpha,
                             waxman_beta=waxman_beta,
                             verbose_sim=verbose_sim,
+                            edp_planner=edp_planner,
+                            plan_cache=plan_cache,
+                            edp_workers=edp_workers,
+                            edp_k_paths=edp_k_paths,
+                            plan_store=plan_store,
+                            edp_planner_options=edp_planner_options,
+                            ep_pool=ep_pool,
+                            skip_idle=skip_idle,
+                            fused_tick=fused_tick,
+                            event_pool=event_pool,
                         )
                         summary_rows.append(
                             _build_summary_row(
@@ -662,6 +763,9 @@ def run_psw_sweep(
                             )
                         )
 
+    logging.info("計画キャッシュ: %s", plan_cache.stats())
+    if plan_store is not None:
+        logging.info("計画ストア: %s", plan_store.stats())
     _add_deltas(summary_rows)
 
     raw_path = run_dir / "raw.csv"
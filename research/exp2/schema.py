@@ -69,6 +69,14 @@ SUMMARY_COLUMNS: List[Column] = [
     Column("psw_fail", "int", "PSW失敗数"),
     Column("psw_cancelled", "int", "PSW中止数"),
     Column("attempts_per_finished", "float", "完了当たりPSW試行"),
+    Column("plan_cache_hits", "int", "計画キャッシュのヒット数(run単位)"),
+    Column("plan_cache_misses", "int", "計画キャッシュのミス数(run単位)"),
+    Column("plan_cache_evictions", "int", "計画キャッシュの追い出し数(run単位)"),
+    Column("plan_cache_size", "int", "run終了時の計画キャッシュ件数"),
+    Column("plan_time_mean", "float", "リクエスト当たり計画時間平均[秒]"),
+    Column("plan_time_max", "float", "リクエスト当たり計画時間最大[秒]"),
+    Column("sim_events", "int", "シミュレータに積んだイベント数"),
+    Column("sim_events_per_sec", "float", "s.run()の実時間当たりのイベント数"),
     Column("status", "str", "実行状態(ok/error)"),
     Column("error_type", "str", "例外型"),
     Column("error_message", "str", "例外メッセージ"),
@@ -0,0 +1,51 @@
+import random
+import sys
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+
+@pytest.fixture
+def line_controller():
+    """
+    n1 - n2 - ... の直線ネットワークにコントローラを置いてinstallしたところまで作る
+    build(n, requests=[(src, dest), ...], sim_time, rng_seed, **ControllerAppの引数) -> (sim, app)
+    """
+    from qns.entity.node import QNode
+    from qns.network import QuantumNetwork
+    from qns.network.route.dijkstra import DijkstraRouteAlgorithm
+    from qns.network.topology import LineTopology
+    from qns.network.topology.topo import ClassicTopology
+    from qns.simulator.simulator import Simulator
+
+    from edp.app.controller_app import ControllerApp
+    from edp.app.node_app import NodeApp
+    from edp.sim import SIMULATOR_ACCURACY
+
+    def build(n=5, requests=((0, 4),), sim_time=1.0, rng_seed=0, pool_cls=None, **kw):
+        random.seed(rng_seed)
+        pool = {} if pool_cls is None else {"pool_cls": pool_cls}
+        sim = Simulator(0, sim_time, SIMULATOR_ACCURACY, **pool)
+        topo = LineTopology(
+            nodes_number=n,
+            nodes_apps=[NodeApp(p_swap=0.4, gen_rate=50, memory_capacity=5)],
+            qchannel_args={"length": 10000},
+        )
+        net = QuantumNetwork(
+            topo=topo, classic_topo=ClassicTopology.All, route=DijkstraRouteAlgorithm()
+        )
+        net.build_route()
+        for src, dest in requests:
+            net.add_request(net.nodes[src], net.nodes[dest])
+        kw = {"p_swap": 0.4, "f_req": 0.8, "gen_rate": 50, "init_fidelity": 0.95, **kw}
+        app = ControllerApp(**kw)
+        net.add_node(QNode("controller", apps=[app]))
+        net.install(sim)
+        net.build_route()
+        return sim, app
+
+    return build
@@ -0,0 +1,49 @@
+# CalendarEventPool（スロットごとのdequeの輪 + 先のイベントのヒープ）の取り出し順
+from qns.simulator.simulator import Simulator
+
+from edp.sim.calendar_pool import CalendarEventPool, clear_events, peek_time
+from edp.sim.events import PhaseEvent
+
+
+def test_events_come_out_in_slot_then_insertion_order():
+    # horizonを小さくして、輪と先のヒープの行き来を起こす
+    sim = Simulator(0, 1, accuracy=1000)
+    pool = CalendarEventPool(sim.ts, sim.te, horizon=4)
+    slots = [9, 1, 3, 9, 2, 30, 1, 5, 30, 4, 9]
+    for i, slot in enumerate(slots):
+        assert pool.add_event(PhaseEvent(sim.time(time_slot=slot), i, lambda: None))
+    assert len(pool) == len(slots)
+    assert peek_time(pool) == sim.time(time_slot=1)
+    out = []
+    while (event := pool.next_event()) is not None:
+        assert pool.tc == event.t
+        out.append(event.by)
+    assert out == sorted(range(len(slots)), key=lambda i: (slots[i], i))
+    assert len(pool) == 0 and peek_time(pool) is None
+
+
+def test_rejects_past_events_and_clears():
+    sim = Simulator(0, 1, accuracy=1000)
+    pool = CalendarEventPool(sim.ts, sim.te, horizon=4)
+    pool.add_event(PhaseEvent(sim.time(time_slot=3), 0, lambda: None))
+    assert pool.next_event().by == 0
+    assert not pool.add_event(PhaseEvent(sim.time(time_slot=2), 1, lambda: None))
+    assert not pool.add_event(PhaseEvent(sim.time(time_slot=2000), 2, lambda: None))
+    for slot in (3, 100):
+        pool.add_event(PhaseEvent(sim.time(time_slot=slot), slot, lambda: None))
+    clear_events(pool)
+    assert len(pool) == 0 and pool.next_event() is None
+
+
+def test_simulator_skips_cancelled_events():
+    sim = Simulator(0, 1, accuracy=1000, pool_cls=CalendarEventPool)
+    ran = []
+    events = [
+        PhaseEvent(sim.time(time_slot=slot), None, lambda slot=slot: ran.append(slot))
+        for slot in (5, 2, 200, 5)
+    ]
+    for event in events:
+        sim.add_event(event)
+    events[1].cancel()
+    sim.run()
+    assert ran == [5, 5, 200]
@@ -0,0 +1,164 @@
+# 乱数を固定したシミュレーションの軌跡が、高速化前のコントローラ（opsを毎tick走査していた版）と同じになるか
+# 期待値は高速化前のコードで同じ条件を走らせた結果
+import dataclasses
+import random
+
+import pytest
+
+from edp.sim import models
+from exp2.common import _run_single
+
+RUN = dict(
+    f_req=0.8,
+    p_swap=0.4,
+    init_fidelity=0.95,
+    psw_threshold=0.9,
+    gen_rate=50,
+    memory_capacity=5,
+    waxman_size=100000,
+    waxman_alpha=0.2,
+    waxman_beta=0.6,
+    verbose_sim=False,
+)
+
+
+def run(monkeypatch, nodes, requests, sim_time, enable_psw, rng_seed, t_mem=None, **kw):
+    # _run_singleはトポロジを作った後にrandom.seed()で再シードするので、そこも固定する
+    seed = random.seed
+    monkeypatch.setattr(
+        random,
+        "seed",
+        lambda a=None, *args, **kwargs: seed(rng_seed if a is None else a),
+    )
+    if t_mem is not None:
+        monkeypatch.setattr(models, "T_MEM", t_mem)
+    return _run_single(
+        nodes=nodes,
+        requests=requests,
+        seed=1,
+        sim_time=sim_time,
+        enable_psw=enable_psw,
+        **{**RUN, **kw},
+    )
+
+
+# (nodes, requests, sim_time, enable_psw, rng_seed, t_mem) -> (完了時刻（完了順）, PSW試行, PSW成功)
+TRAJECTORIES = [
+    (
+        (50, 10, 3, True, 0, None),
+        ([61, 61, 121, 127, 307, 313, 373, 1213, 1393, 2533], 1, 1),
+    ),
+    (
+        (50, 10, 3, True, 1, None),
+        ([61, 61, 73, 121, 127, 187, 193, 313, 1873, 2833], 1, 1),
+    ),
+    (
+        (40, 12, 3, True, 4, 0.1),
+        ([61, 67, 73, 73, 127, 133, 373, 427, 793, 1033, 1273, 3793], 2, 1),
+    ),
+    # PSWが何度も起きるもの（同じtickに発火するopはリクエストの順 -> opsリストの順）
+    (
+        (30, 8, 3, True, 1, 0.05),
+        ([187, 256, 1033, 1093, 1453, 2053, 2293], 10, 7),
+    ),
+    (
+        (30, 8, 3, True, 2, 0.05),
+        ([133, 913, 1027, 1096, 1813, 2833, 7753], 13, 11),
+    ),
+    (
+        (60, 12, 3, True, 9, 0.2),
+        ([61, 67, 67, 73, 127, 127, 187, 187, 253, 313, 1573, 3973], 4, 4),
+    ),
+    # 切り捨てで片側待ちになったop、purifyでfidelityを代入したEPのPSW
+    ((30, 8, 3, True, 4, 0.05), ([73, 553, 1213, 4696, 5533, 6307], 20, 15)),
+    ((30, 8, 3, True, 22, 0.05), ([73, 193, 1753, 1867, 6673, 7036, 7333], 25, 20)),
+    ((30, 8, 3, True, 31, 0.05), ([73, 73, 193, 193, 796, 973], 11, 10)),
+    ((30, 8, 3, True, 39, 0.05), ([73, 73, 196, 613, 793, 1093], 10, 8)),
+    # 切り捨てが効くもの（減衰はlinks_manager_routineの周期ごと）
+    (
+        (40, 12, 3, True, 7, None),
+        ([61, 67, 67, 73, 73, 193, 247, 253, 433, 733, 1933, 2533], 2, 2),
+    ),
+    (
+        (30, 8, 3, False, 1, 0.05),
+        ([187, 193, 256, 313, 313, 373, 2893], 0, 0),
+    ),
+    (
+        (30, 8, 3, False, 5, None),
+        ([187, 193, 256, 313, 493, 1033, 1993], 0, 0),
+    ),
+]
+
+
+@pytest.mark.parametrize("args, expected", TRAJECTORIES)
+def test_trajectory_matches_scan_order(monkeypatch, args, expected):
+    m = run(monkeypatch, *args)
+    assert (m.wait_times, m.psw_attempts, m.psw_success) == expected
+
+
+def _summary(m):
+    # 実行時間以外
+    return dataclasses.replace(m, plan_times=[], sim_run_sec=0.0)
+
+
+@pytest.mark.parametrize("args", [args for args, _ in TRAJECTORIES])
+def test_numpy_pool_matches_object_pool(monkeypatch, args):
+    # EPPoolでも、切り捨てる順（下回った減衰の順 -> ep_idの順）まで同じ
+    obj = run(monkeypatch, *args)
+    pooled = run(monkeypatch, *args, ep_pool="numpy")
+    assert _summary(pooled) == _summary(obj)
+
+
+# swapの失敗が多く、request_regenで部分木を何度も作り直すもの
+# (nodes, requests, sim_time, enable_psw, rng_seed, t_mem, p_swap) -> 期待値はTRAJECTORIESと同じ形
+REGEN_TRAJECTORIES = [
+    (
+        (40, 10, 3, True, 3, None, 0.2),
+        ([61, 67, 247, 1027, 1453, 2293, 2833, 2833, 3973, 6193], 5, 5),
+    ),
+    (
+        (40, 10, 3, False, 3, None, 0.2),
+        ([61, 67, 367, 727, 1093, 2593, 2653, 3493, 3553], 0, 0),
+    ),
+    (
+        (30, 8, 3, True, 6, 0.1, 0.25),
+        ([2713, 4393, 5413, 7576, 8593], 16, 13),
+    ),
+]
+
+
+@pytest.mark.parametrize("args, expected", REGEN_TRAJECTORIES)
+def test_lazy_regen_matches_eager_reset(monkeypatch, args, expected):
+    # 子孫のリセットをsyncまで遅らせても、リセットされた葉はrequest_regenのtickで実行される
+    *args, p_swap = args
+    m = run(monkeypatch, *args, p_swap=p_swap)
+    assert (m.wait_times, m.psw_attempts, m.psw_success) == expected
+
+
+@pytest.mark.parametrize("event_pool", ["heap", "calendar"])
+@pytest.mark.parametrize("args", [args for args, _ in TRAJECTORIES])
+def test_fused_tick_matches_phase_events(monkeypatch, args, event_pool):
+    # 積まなかったフェーズも、同じ時刻の完了イベントより先に動く（イベント数だけが減る）
+    evented = run(monkeypatch, *args, event_pool=event_pool)
+    fused = run(monkeypatch, *args, event_pool=event_pool, fused_tick=True)
+    assert fused.sim_events < evented.sim_events
+    fused = dataclasses.replace(fused, sim_events=evented.sim_events)
+    assert _summary(fused) == _summary(evented)
+
+
+@pytest.mark.parametrize("args", [args for args, _ in TRAJECTORIES])
+def test_skip_idle_matches_every_tick(monkeypatch, args):
+    # 何も起きない周期を飛ばしても、動く周期の中身は毎tick回したときと同じ
+    ticked = run(monkeypatch, *args)
+    skipped = run(monkeypatch, *args, skip_idle=True)
+    assert skipped.sim_events < ticked.sim_events
+    skipped = dataclasses.replace(skipped, sim_events=ticked.sim_events)
+    assert _summary(skipped) == _summary(ticked)
+
+
+@pytest.mark.parametrize("args", [args for args, _ in TRAJECTORIES])
+def test_calendar_pool_matches_heap_pool(monkeypatch, args):
+    # 同じスロットのイベントは積んだ順に取り出すので、ヒープのプールと同じ軌跡になる
+    heap = run(monkeypatch, *args)
+    calendar = run(monkeypatch, *args, event_pool="calendar")
+    assert _summary(calendar) == _summary(heap)
@@ -0,0 +1,51 @@
+# 再帰EDPの計画がボトムアップのEDP_dpと同じになるか（枝刈り・深さ上限・キャッシュ込み）
+import pytest
+
+from edp.alg.bench import line_path, waxman_path
+from edp.alg.edp import EDP
+from edp.alg.edp_dp import EDP_dp
+from edp.alg.plan_cache import PlanCache
+
+
+def _latency(res):
+    return None if res is None else round(res[0], 9)
+
+
+def _plan(fn, path, qnet, f_req, **kwargs):
+    return _latency(
+        fn(path=path, src=path[0], dest=path[-1], qnet=qnet, f_req=f_req, **kwargs)
+    )
+
+
+@pytest.mark.parametrize("hops", [3, 5, 7])
+def test_recursive_matches_dp_on_random_paths(hops):
+    for seed in range(20):
+        path, qnet = waxman_path(hops, seed=seed)
+        for f_req in (0.7, 0.8, 0.9):
+            expected = _plan(EDP_dp, path, qnet, f_req)
+            assert _plan(EDP, path, qnet, f_req) == expected, (seed, f_req)
+
+
+# 枝刈りなしは遅いので少なめに。(seed, hops, f_req) は深さの上限で計画が悪くなっていた例
+@pytest.mark.parametrize(
+    "seed, hops, f_req",
+    [(seed, 3, 0.8) for seed in range(5)] + [(8, 7, 0.9), (19, 7, 0.9)],
+)
+def test_unpruned_matches_dp(seed, hops, f_req):
+    path, qnet = waxman_path(hops, seed=seed)
+    expected = _plan(EDP_dp, path, qnet, f_req)
+    assert _plan(EDP, path, qnet, f_req, prune=False) == expected
+
+
+def test_long_line_is_not_truncated():
+    # 既定では深さの上限が無いので、20ホップでも最適な計画になる
+    path, qnet = line_path(20)
+    assert _plan(EDP, path, qnet, 0.8) == _plan(EDP_dp, path, qnet, 0.8)
+
+
+def test_depth_limited_results_do_not_leak_into_cache():
+    # 上限で打ち切った部分問題がキャッシュに残ると、後の上限なしの計画が悪くなる
+    path, qnet = line_path(6)
+    cache = PlanCache()
+    _plan(EDP, path, qnet, 0.9, max_depth=2, cache=cache)
+    assert _plan(EDP, path, qnet, 0.9, cache=cache) == _plan(EDP_dp, path, qnet, 0.9)
@@ -0,0 +1,42 @@
+# プロセスプールでの計画が、逐次の計画と同じ結果をjobsの順で返すか
+from edp.alg.bench import waxman_path
+from edp.alg.edp import EDP
+from edp.alg.edp_parallel import plan_parallel
+from edp.alg.plan_array import PlanArray
+from edp.alg.plan_cache import PlanCache
+
+
+def _jobs(path):
+    # 区間の長さ・f_reqの違うjob（計画できないものも混ぜる）
+    jobs = []
+    for i, j, f_req in (
+        (0, 9, 0.8),
+        (2, 7, 0.9),
+        (0, 9, 0.999),
+        (1, 5, 0.85),
+        (0, 9, 0.9),
+    ):
+        sub = path[i:j]
+        jobs.append((sub, sub[0], sub[-1], f_req))
+    return jobs
+
+
+def test_workers_match_sequential_planning():
+    path, qnet = waxman_path(8, seed=1)
+    jobs = _jobs(path)
+    expected = []
+    for sub, src, dest, f_req in jobs:
+        res = EDP(path=sub, src=src, dest=dest, qnet=qnet, f_req=f_req)
+        expected.append(None if res is None else PlanArray.from_tree(*res).to_tree())
+
+    cache = PlanCache()
+    planned = plan_parallel(jobs, qnet, "recursive", workers=2, cache=cache)
+    # 親プロセスのQNodeに戻っている
+    assert [None if res is None else res.to_tree() for res, _ in planned] == expected
+    assert None in expected and all(elapsed >= 0 for _, elapsed in planned)
+
+    # 2回目は全部親プロセスのキャッシュに当たり、ワーカーに送らない
+    hits = cache.hits
+    again = plan_parallel(jobs, qnet, "recursive", workers=2, cache=cache)
+    assert cache.hits - hits == len(jobs)
+    assert [None if res is None else res.to_tree() for res, _ in again] == expected
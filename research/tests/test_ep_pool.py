@@ -0,0 +1,44 @@
+# EPPool（NumPy配列のEP）の減衰と切り捨ての順が、EPごとの計算と同じになるか
+from qns.entity.node.node import QNode
+from qns.simulator.simulator import Simulator
+
+from edp.sim.ep import DecayClock
+from edp.sim.ep_pool import EPPool, PooledEP
+
+F_CUT = 0.8
+
+
+def _at(sim, clock, slot):
+    # slotまで時刻を進め、links_manager_routineのスロットなら減衰させる
+    sim.event_pool.tc = sim.time(time_slot=slot)
+    if (slot - clock.first_slot) % clock.period == 0:
+        clock.tick()
+
+
+def test_below_follows_cutoff_heap_order():
+    sim = Simulator(0, 1, accuracy=1000)
+    clock = DecayClock(period=3)
+    clock.install(sim, first_slot=2)
+    pool = EPPool(clock=clock)
+    nodes = (QNode("n1"), QNode("n2"))
+    # 行の順とep_idの順が違う（free listから使い回したEPのように）
+    eps = {
+        ep_id: PooledEP(
+            pool=pool, fidelity=f0, nodes=nodes, t_mem=0.03, ep_id=ep_id, clock=clock
+        )
+        for ep_id, f0 in ((5, 0.95), (3, 0.95), (4, 0.83))
+    }
+    assert pool.next_crossing(F_CUT) == min(
+        ep.crossing_time(F_CUT) for ep in eps.values()
+    )
+
+    _at(sim, clock, 2)
+    assert pool.below(F_CUT) == [eps[4]]
+    _at(sim, clock, 8)
+    below = pool.below(F_CUT)
+    # 先に下回ったEP -> 同じ減衰で下回ったEPはep_idの順
+    assert below == [eps[4], eps[3], eps[5]]
+    assert below == sorted(
+        eps.values(), key=lambda ep: (ep.crossing_time(F_CUT), ep.ep_id)
+    )
+    assert [ep.fidelity for ep in below] == [pool.fidelities()[ep._row] for ep in below]
@@ -0,0 +1,22 @@
+# gen_EP_routineは要求のあるチャネル（_genlink_active）だけを見る
+
+
+def test_active_channels_cover_every_pending_demand(line_controller):
+    sim, app = line_controller(n=8, requests=[(0, 3), (4, 7)], sim_time=1.0)
+    gen = app.gen_EP_routine
+    seen = []
+
+    def checked():
+        pending = {name for name, queue in app.genlink_queue.items() if queue}
+        # 要求の残っているチャネルは必ず入っている（空になったものは次に見たときに外す）
+        assert pending <= app._genlink_active
+        seen.append(set(app._genlink_active))
+        gen()
+
+    app.gen_EP_routine = checked
+    sim.run()
+    assert len(app.completed_requests) == 2
+    # 2つのリクエストの間のl4（n4-n5）には要求が来ない
+    assert seen and all("l4" not in active for active in seen)
+    assert any(active for active in seen)
+    assert not any(app.genlink_queue.values())
@@ -0,0 +1,32 @@
+# k最短経路（Yen）とPathCacheの使い回し
+from qns.entity.node import QNode
+
+from edp.alg.ksp import PathCache
+from edp.sim.new_qchannel import NewQC
+
+
+def _ring(n):
+    # n1 - n2 - ... - nn - n1 の環（どの2点間にも向きの違う2本の経路がある）
+    nodes = [QNode(f"n{i + 1}") for i in range(n)]
+    qcs = [
+        NewQC(name=f"qc{i}", node_list=[nodes[i], nodes[(i + 1) % n]]) for i in range(n)
+    ]
+    return nodes, PathCache(qcs)
+
+
+def test_paths_are_loop_free_and_shortest_first():
+    nodes, cache = _ring(6)
+    paths = cache.get(nodes[0], nodes[2], k=3)
+    assert paths == [nodes[:3], [nodes[0], *nodes[:2:-1], nodes[2]]]
+    assert all(len(set(p)) == len(p) for p in paths)
+
+
+def test_cached_paths_follow_first():
+    nodes, cache = _ring(6)
+    short = nodes[:3]
+    long = [nodes[0], *nodes[:2:-1], nodes[2]]
+    assert cache.get(nodes[0], nodes[2], k=2)[0] == short
+    # kが足りていても、1本目が違えば計算し直す
+    assert cache.get(nodes[0], nodes[2], k=1, first=long) == [long]
+    assert cache.get(nodes[0], nodes[2], k=2, first=long) == [long, short]
+    assert cache.get(nodes[0], nodes[2], k=2) == [long, short]
@@ -0,0 +1,52 @@
+# LinkStore（live / pendingのEPと、qcごと・ノードの組ごとの索引）
+from qns.entity.node import QNode
+
+from edp.sim.ep import EP
+from edp.sim.link_store import LinkStore
+from edp.sim.new_qchannel import NewQC
+
+
+def _eps():
+    n1, n2, n3 = QNode("n1"), QNode("n2"), QNode("n3")
+    qc = NewQC(name="l1", node_list=[n1, n2])
+    link = [EP(nodes=(n1, n2), qc=qc, fidelity=0.9, ep_id=i) for i in range(2)]
+    # swapでできたEP（qcなし、向きは逆）
+    swapped = EP(nodes=(n3, n1), fidelity=0.8, ep_id=2, use_node_memory=False)
+    return (n1, n2, n3), qc, link, swapped
+
+
+def test_promote_moves_pending_to_live_in_order():
+    _, _, link, swapped = _eps()
+    store = LinkStore()
+    for ep in (link[1], swapped, link[0]):
+        store.add(ep)
+    assert store.has_pending() and not store.live()
+    assert all(store.is_pending(ep) and not store.is_live(ep) for ep in store)
+    store.promote()
+    assert not store.has_pending()
+    assert store.live() == [link[1], swapped, link[0]]
+    assert len(store) == 3 and link[0] in store
+
+
+def test_indexes_follow_add_and_remove():
+    (n1, n2, n3), qc, link, swapped = _eps()
+    store = LinkStore()
+    store.add(link[0])
+    store.promote()
+    store.add(link[1])
+    store.add(swapped)
+    assert store.by_qc(qc) == link
+    assert store.by_pair(n2, n1) == link
+    assert store.by_pair(n1, n2, live_only=True) == [link[0]]
+    assert store.by_pair(n1, n3) == [swapped]
+
+    owner = object()
+    link[1].owner_op = owner
+    assert store.owned_by(owner, n2, n1) is link[1]
+    assert store.owned_by(owner, n1, n3) is None
+
+    assert store.remove(swapped) and store.remove(link[0])
+    assert not store.remove(link[0])
+    assert store.by_qc(qc) == [link[1]] == store.by_pair(n1, n2)
+    assert store.by_pair(n1, n3) == [] and frozenset((n1, n3)) not in store._by_pair
+    assert list(store) == [link[1]] and store.is_pending(link[1])
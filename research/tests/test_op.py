@@ -0,0 +1,75 @@
+# OPの木の雛形（OpTemplate）から作った木の実行順（Operation.order）
+from qns.simulator.simulator import Simulator
+
+from edp.alg.bench import line_path
+from edp.alg.edp import EDP
+from edp.alg.plan_array import PlanArray
+from edp.sim.events import PhaseEvent
+from edp.sim.op import OpTemplate, build_ops_from_plan_array
+
+
+def _tree():
+    path, qnet = line_path(4)
+    latency, tree = EDP(path=path, src=path[0], dest=path[-1], qnet=qnet, f_req=0.9)
+    return build_ops_from_plan_array(PlanArray.from_tree(latency, tree))
+
+
+def _preorder(root):
+    out, stack = [], [root]
+    while stack:
+        op = stack.pop()
+        out.append(op)
+        stack.extend(reversed(op.children))
+    return out
+
+
+def test_plan_ops_run_in_post_order():
+    _, ops = _tree()
+    assert [op.order for op in ops] == list(range(len(ops)))
+
+
+def test_psw_clone_runs_in_pre_order():
+    # PSWの木は先行順に複製していたので、実行順もその順
+    root, _ = _tree()
+    template = OpTemplate.from_op(root, prefix="PSW_")
+    for _ in range(2):  # free listから使い回した木も同じ
+        clone_root, clone_ops = template.instantiate()
+        assert clone_ops[-1] is clone_root
+        assert [op.order for op in _preorder(clone_root)] == list(range(len(clone_ops)))
+        assert [op.name for op in _preorder(clone_root)] == [
+            "PSW_" + op.name for op in _preorder(root)
+        ]
+        template.release(clone_ops)
+
+
+def test_psw_templates_are_dropped_with_completed_requests(line_controller):
+    # ターゲットごとの雛形は、リクエストが完了したら捨てる
+    sim, app = line_controller(
+        requests=[(0, 4), (1, 3)], sim_time=5.0, rng_seed=2, t_mem=0.3
+    )
+    sim.run()
+    assert len(app.completed_requests) == 2
+    assert app.psw_gen_link_scheduled > 0
+    assert app.psw_templates == {}
+
+
+def test_request_regen_cancels_completion_event():
+    # 再生成したopの完了イベントは取り消され、シミュレータに飛ばされる
+    root, _ = _tree()
+    child = root.children[0]
+    sim = Simulator(0, 1, accuracy=1000)
+    ran = []
+    events = {}
+    for op in (root, child):
+        event = PhaseEvent(sim.time(time_slot=1), None, lambda op=op: ran.append(op))
+        op.set_completion(event)
+        sim.add_event(event)
+        events[op] = event
+    root.request_regen()
+    assert events[root].is_canceled and root.completion is None
+    # 子孫はsyncまで触らない。take_completionのsyncでリセットされ、そこで取り消される
+    assert not events[child].is_canceled
+    assert not child.take_completion(events[child])
+    assert events[child].is_canceled and child.completion is None
+    sim.run()
+    assert ran == []
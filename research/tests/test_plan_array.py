@@ -0,0 +1,63 @@
+# 木（tree_dict）と配列表現（PlanArray）の行き来
+import json
+
+from qns.entity.node import QNode
+
+from edp.alg.bench import line_path
+from edp.alg.edp import EDP
+from edp.alg.plan_array import PLAN_PURIFY, PlanArray
+
+
+def _plan(hops=6, f_req=0.95):
+    # purifyとswapの両方を含む計画
+    path, qnet = line_path(hops)
+    latency, tree = EDP(path=path, src=path[0], dest=path[-1], qnet=qnet, f_req=f_req)
+    return path, latency, tree
+
+
+def _names(tree):
+    # QNodeを名前にした木（別のQNodeに載せ替えた木と比べる）
+    if isinstance(tree, QNode):
+        return tree.name
+    if isinstance(tree, dict):
+        return {k: _names(v) for k, v in tree.items()}
+    if isinstance(tree, (tuple, list)):
+        return tuple(_names(v) for v in tree)
+    return tree
+
+
+def test_tree_round_trip_in_post_order():
+    path, latency, tree = _plan()
+    plan = PlanArray.from_tree(latency, tree)
+    assert plan.to_tree() == tree
+    assert plan.latency == latency
+    assert PLAN_PURIFY in plan.types
+    # 子は親より前、根は末尾
+    assert [i for i, p in enumerate(plan.parent) if p < 0] == [len(plan) - 1]
+    assert all(p > i for i, p in enumerate(plan.parent) if p >= 0)
+
+
+def test_relative_plan_moves_to_other_nodes():
+    path, latency, tree = _plan()
+    index = {nd: i for i, nd in enumerate(path)}
+    rel = PlanArray.from_tree(latency, tree).relative_to(index)
+    assert rel.nodes is None
+    assert rel.to_tree(path) == tree
+    # 同じ名前の別QNode（別run）にもそのまま載る
+    other = [QNode(nd.name) for nd in path]
+    moved = rel.with_nodes(other)
+    assert moved.types is rel.types
+    assert _names(moved.to_tree()) == _names(tree)
+    root = moved.to_tree()
+    assert root["x"] is other[0] and root["y"] is other[-1]
+
+
+def test_json_round_trip_by_node_name():
+    path, latency, tree = _plan()
+    data = json.loads(json.dumps(PlanArray.from_tree(latency, tree).to_json()))
+    other = {nd.name: QNode(nd.name) for nd in path}
+    restored = PlanArray.from_json(data, other)
+    assert restored.latency == latency
+    assert _names(restored.to_tree()) == _names(tree)
+    # ノード表が無ければ、使う側が表を渡す
+    assert PlanArray.from_json(data).nodes is None
@@ -0,0 +1,63 @@
+# 計画キャッシュのキー（計画関数ごとに分かれるか）と件数の上限
+from edp.alg.bench import line_path
+from edp.alg.edp import EDP, F
+from edp.alg.edp_dp import EDP_dp
+from edp.alg.plan_cache import PlanCache, PlanContext, planner_key
+
+
+def _solve(fn, path, qnet, cache, f_req=0.8):
+    return fn(
+        path=path, src=path[0], dest=path[-1], qnet=qnet, f_req=f_req, cache=cache
+    )
+
+
+def test_planners_do_not_share_entries():
+    path, qnet = line_path(4)
+    cache = PlanCache()
+    _solve(EDP_dp, path, qnet, cache)
+    assert len(cache) == 1
+
+    # dpの結果は再帰EDPからは当たらない
+    hits = cache.hits
+    _solve(EDP, path, qnet, cache)
+    assert cache.hits == hits
+    assert {key[0] for key in cache._entries} == {
+        planner_key("dp"),
+        planner_key("recursive", {"prune": True}),
+    }
+
+
+def test_planner_options_are_part_of_key():
+    path, qnet = line_path(3)
+    cache = PlanCache()
+    plain = PlanContext(cache, path, qnet, F, planner=planner_key("recursive"))
+    tuned = PlanContext(
+        cache, path, qnet, F, planner=planner_key("recursive", {"prune": False})
+    )
+    plain.store(path[0], path[-1], 0.8, None)
+    assert tuned.lookup(path[0], path[-1], 0.8) == (False, None)
+    assert plain.lookup(path[0], path[-1], 0.8) == (True, None)
+
+
+def test_invalidate_link_and_max_entries():
+    path, qnet = line_path(4)
+    cache = PlanCache(max_entries=3)
+    ctx = PlanContext(cache, path, qnet, F, planner=planner_key("dp"))
+    for f_req in (0.7, 0.8, 0.9, 0.95):
+        ctx.store(path[0], path[-1], f_req, None)
+    assert len(cache) == 3
+    assert cache.evictions == 1
+    assert cache.invalidate_link(path[1].name, path[2].name) == 3
+    assert len(cache) == 0
+
+
+def test_invalidate_link_keeps_segments_without_that_link():
+    # n1 - n2 - n3 の区間はn1とn3を両方含むが、n1-n3のリンクは無い
+    path, qnet = line_path(4)
+    cache = PlanCache()
+    ctx = PlanContext(cache, path, qnet, F, planner=planner_key("dp"))
+    ctx.store(path[0], path[2], 0.8, None)
+    ctx.store(path[1], path[3], 0.8, None)
+    assert cache.invalidate_link(path[0].name, path[2].name) == 0
+    assert cache.invalidate_link(path[2].name, path[1].name) == 2
+    assert len(cache) == 0
@@ -0,0 +1,85 @@
+# ディスク上の計画ストア: キーの分け方と、別のQNodeへの読み戻し
+import os
+
+from qns.entity.node import QNode
+
+from edp.alg import plan_store
+from edp.alg.bench import line_path
+from edp.alg.edp import EDP, F
+from edp.alg.plan_array import PlanArray
+from edp.alg.plan_store import PlanStore, topology_hash
+
+
+def _setup(tmp_path):
+    path, qnet = line_path(4)
+    store = PlanStore(str(tmp_path))
+    topo = topology_hash(qnet, F)
+    return path, qnet, store, topo
+
+
+def test_save_and_load_onto_other_nodes(tmp_path):
+    path, qnet, store, topo = _setup(tmp_path)
+    latency, tree = EDP(path=path, src=path[0], dest=path[-1], qnet=qnet, f_req=0.9)
+    key = store.key(topo, path[0], path[-1], 0.9, {"planner": "recursive"})
+    assert store.load(key, {}) == (False, None)
+    store.save(key, PlanArray.from_tree(latency, tree))
+
+    # 同じseedで作り直したトポロジ（同じ名前の別QNode）に読み戻す
+    nodes = {nd.name: QNode(nd.name) for nd in path}
+    hit, plan = store.load(key, nodes)
+    assert hit and plan.latency == latency
+    assert plan.to_tree()["x"] is nodes[path[0].name]
+
+    # 計画なしも保存する
+    none_key = store.key(topo, path[0], path[-1], 0.99, {"planner": "recursive"})
+    store.save(none_key, None)
+    assert store.load(none_key, nodes) == (True, None)
+    assert store.stats() == {"hits": 2, "misses": 1, "writes": 2}
+    assert not any(
+        name.endswith(".tmp") for _, _, files in os.walk(tmp_path) for name in files
+    )
+
+
+def test_key_covers_topology_request_options_and_version(tmp_path, monkeypatch):
+    path, qnet, store, topo = _setup(tmp_path)
+    src, dest = path[0], path[-1]
+    base = store.key(topo, src, dest, 0.9, {"planner": "recursive"})
+    assert base == store.key(topo, src, dest, 0.9, {"planner": "recursive"})
+
+    link = next(iter(qnet))
+    changed = {**qnet, link: {**qnet[link], "rate": qnet[link]["rate"] * 2}}
+    others = [
+        store.key(topology_hash(changed, F), src, dest, 0.9, {"planner": "recursive"}),
+        store.key(topo, path[1], dest, 0.9, {"planner": "recursive"}),
+        store.key(topo, src, dest, 0.8, {"planner": "recursive"}),
+        store.key(topo, src, dest, 0.9, {"planner": "dp"}),
+    ]
+    monkeypatch.setattr(
+        plan_store, "PLAN_STORE_VERSION", plan_store.PLAN_STORE_VERSION + 1
+    )
+    others.append(store.key(topo, src, dest, 0.9, {"planner": "recursive"}))
+    assert len({base, *others}) == len(others) + 1
+
+
+def test_broken_file_is_a_miss(tmp_path):
+    path, qnet, store, topo = _setup(tmp_path)
+    key = store.key(topo, path[0], path[-1], 0.9, {})
+    store.save(key, None)
+    with open(store._path(key), "w", encoding="utf-8") as f:
+        f.write("{")
+    assert store.load(key, {}) == (False, None)
+
+
+def test_controller_reuses_stored_plans(line_controller, tmp_path):
+    runs = []
+    for _ in range(2):
+        store = PlanStore(str(tmp_path))
+        sim, app = line_controller(
+            requests=[(0, 4), (1, 3)], sim_time=3.0, plan_store=store
+        )
+        sim.run()
+        runs.append((store.stats(), [r["finish_time"] for r in app.completed_requests]))
+    (first, done1), (second, done2) = runs
+    assert first["writes"] == 2 and first["hits"] == 0
+    assert second == {"hits": 2, "misses": 0, "writes": 0}
+    assert len(done1) == 2 and done2 == done1
@@ -0,0 +1,27 @@
+# リンクの条件が変わったとき、そのリンクを経路に含むリクエストだけ再計画して差し替える
+from edp.alg.plan_cache import PlanCache
+
+
+def test_update_link_replans_only_affected_requests(line_controller):
+    cache = PlanCache()
+    sim, app = line_controller(
+        requests=[(0, 4), (0, 2)], sim_time=3.0, plan_cache=cache
+    )
+    long_req, short_req = app.requests
+    before = set(cache._entries)
+
+    # n4 - n5 のリンクは長いリクエストの経路にだけある
+    app.update_link("l4", rate=25, fidelity=0.97)
+    assert list(app.pending_plans) == [long_req]
+    # n4 - n5 を含む区間だけ捨てる（再計画で新しいrate/fidのエントリが入る）
+    stale = {key for key in before if {"n4", "n5"} <= set(key[1][0])}
+    assert stale and not stale & set(cache._entries)
+    assert before - stale <= set(cache._entries)
+    qc = app.qc_by_name["l4"]
+    assert (qc.gen_rate, qc.fidelity_init, qc.plan_fidelity) == (25, 0.97, 0.97)
+
+    new_plan = app.pending_plans[long_req]
+    sim.run()
+    assert app.replanned == 1
+    assert long_req.swap_plan is new_plan
+    assert {r["name"] for r in app.completed_requests} == {"req0", "req1"}